@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The flask CLI imports this directory as the 'backend' package; make the
+# sibling modules importable the same way the tests and `python api.py` see them
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
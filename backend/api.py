@@ -2,27 +2,123 @@ from flask import Flask, jsonify, request
 from flask_migrate import Migrate
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+import os
+import threading
 import uuid
-from sqlalchemy import event
+import base64
+import hashlib
+import json
+import time
+import click
+from sqlalchemy import and_, delete, event, func, inspect, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import defer, load_only
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import http_date, quote_etag
+from autosave import AutosaveCoalescer
+from blobs import BlobStore
+from bulk import ImportStats, copy_rows, next_ids
+from cache import TTLCache
+from ciphertext import Ciphertext
+from compress import Compress
+from database import configure_engine, database_url, engine_options, replica_urls
+from instrumentation import RequestMetrics
+from metrics import CONTENT_TYPE, Counter, exposition
+from ratelimit import CounterServer  # also registers the resp:// limiter storages
+from replicas import ReplicaRouter, RoutingSession
+from serialize import (FastJSONProvider, chunked_document_data, document_data, document_frame, dumps, loads,
+                       session_data)
+from sweeper import SessionSweeper
+from touches import TouchBuffer
 
 app = Flask(__name__)
+# jsonify and request.get_json go through serialize.py (orjson when installed)
+app.json = FastJSONProvider(app)
 CORS(app)
+# Per-route latency, SQL and size metrics on /metrics, when METRICS_ENABLED is
+# set; registered before Compress so response sizes are measured as sent
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes', 'on')
+request_metrics = RequestMetrics(app)
+request_metrics.watch_json(app.json)
 
-# Configure rate limiting
+# Configure rate limiting. Counters are per process unless the storage is
+# shared by all workers, e.g. resp+unix:///tmp/securenotes-limiter.sock served
+# by `flask limiter-server`, or resp://host:6379 for Redis (see ratelimit.py)
+app.config['RATELIMIT_STORAGE_URI'] = os.environ.get('RATELIMIT_STORAGE_URI', 'memory://')
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"]
 )
+request_metrics.watch_limiter(limiter)
+# After the Limiter, so its checks come before any request body is read
+compress = Compress(app)
 
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://localhost/securenotes'
+# Database configuration; DATABASE_URL and the pool and timeout settings come
+# from the environment, see database.py
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+# Read-only routes use DATABASE_REPLICA_URLS when set; an address stays on the
+# primary for this many seconds after each write to it
+app.config['DATABASE_REPLICA_URLS'] = replica_urls()
+app.config['REPLICA_STICKY_SECONDS'] = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+app.config['SESSION_CACHE_SIZE'] = 10000
+app.config['SESSION_CACHE_TTL'] = 300
+# last_accessed is only rewritten when older than the granularity, and the
+# rewrites are batched every flush interval (seconds)
+app.config['SESSION_TOUCH_GRANULARITY'] = 60
+app.config['SESSION_TOUCH_FLUSH_INTERVAL'] = 10
+# Whole-document PUTs of a document within this many seconds are acknowledged
+# at once and only the latest is written; unset to write every save
+app.config['AUTOSAVE_COALESCE_WINDOW'] = float(os.environ['AUTOSAVE_COALESCE_WINDOW'])\
+    if os.environ.get('AUTOSAVE_COALESCE_WINDOW') else None
+app.config['BATCH_MAX_OPERATIONS'] = 500
+# Sessions unused for this long (seconds) are deleted by the sweeper, in
+# batches; set SESSION_SWEEP_INTERVAL to also sweep from every worker
+app.config['SESSION_MAX_AGE'] = 12 * 60 * 60
+app.config['SESSION_SWEEP_BATCH_SIZE'] = 100
+app.config['SESSION_SWEEP_INTERVAL'] = int(os.environ['SESSION_SWEEP_INTERVAL'])\
+    if os.environ.get('SESSION_SWEEP_INTERVAL') else None
+# Rows fetched per round trip from the export's server-side cursors
+app.config['EXPORT_YIELD_PER'] = 100
+# Imports are copied in batches of this many documents or bytes, whichever fills first
+app.config['IMPORT_BATCH_SIZE'] = 1000
+app.config['IMPORT_BATCH_BYTES'] = 16 * 1024 * 1024
+# Ciphertexts over BLOB_STORE_THRESHOLD bytes are kept as files under
+# BLOB_STORE_PATH, when set, instead of in the documents table (see blobs.py).
+# Unreferenced blobs are deleted once older than the grace period (seconds)
+app.config['BLOB_STORE_PATH'] = os.environ.get('BLOB_STORE_PATH') or None
+app.config['BLOB_STORE_THRESHOLD'] = int(os.environ.get('BLOB_STORE_THRESHOLD', 256 * 1024))
+app.config['BLOB_STORE_GRACE'] = 60
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 migrate = Migrate(app, db)
+with app.app_context():
+    configure_engine(db.engine)
+    request_metrics.watch_pool('primary', db.engine)
+replicas = ReplicaRouter(
+    app, limiter.storage,
+    urls=app.config['DATABASE_REPLICA_URLS'],
+    sticky_seconds=app.config['REPLICA_STICKY_SECONDS']
+)
+for i, engine in enumerate(replicas.engines):
+    request_metrics.watch_pool(f'replica-{i}', engine)
+
+# Maps session address -> Session.id so document routes can skip the lookup
+session_cache = TTLCache(
+    maxsize=app.config['SESSION_CACHE_SIZE'],
+    ttl=app.config['SESSION_CACHE_TTL']
+)
+
+blob_store = BlobStore(
+    app.config['BLOB_STORE_PATH'],
+    threshold=app.config['BLOB_STORE_THRESHOLD'],
+    grace=app.config['BLOB_STORE_GRACE']
+)
 
 # Models
 class Session(db.Model):
@@ -31,25 +127,739 @@ class Session(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     address = db.Column(db.String(64), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    last_accessed = db.Column(db.DateTime, default=datetime.utcnow)
-    documents = db.relationship('Document', backref='session', lazy=True)
+    last_accessed = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # The listing ETag and Last-Modified; moved by every document write, see
+    # documents_changed()
+    documents_changed_at = db.Column(db.DateTime, nullable=True)
+    documents = db.relationship('Document', backref='session', lazy=True, order_by='Document.id')
 
 class Document(db.Model):
     __tablename__ = 'documents'
     
     id = db.Column(db.Integer, primary_key=True)
     document_url = db.Column(db.String(256), unique=True, nullable=False)
-    encrypted_content = db.Column(db.Text, nullable=False)
-    encrypted_title = db.Column(db.Text, nullable=False)
+    # Stored as bytea; read and written as the client's ciphertext strings
+    encrypted_content = db.Column(Ciphertext, nullable=False)
+    encrypted_title = db.Column(Ciphertext, nullable=False)
+    # sha256 of title and content, see content_digest(); NULL when unknown
+    content_digest = db.Column(db.LargeBinary(32), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_modified = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     session_id = db.Column(db.Integer, db.ForeignKey('sessions.id'), nullable=False)
+    # Set for chunked documents, whose content lives in document_chunks and
+    # whose encrypted_content is empty; NULL for single-blob documents
+    chunk_count = db.Column(db.Integer, nullable=True)
+    # Set for documents whose ciphertext is in the blob store, whose
+    # encrypted_content is empty: the blob's sha256 and size in bytes
+    content_hash = db.Column(db.LargeBinary(32), nullable=True)
+    content_length = db.Column(db.Integer, nullable=True)
+    # Only used to create chunks with a new document; see load_chunks()
+    chunks = db.relationship('DocumentChunk', lazy='raise', cascade='all, delete-orphan', passive_deletes=True)
+
+class DocumentChunk(db.Model):
+    __tablename__ = 'document_chunks'
+    
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id', ondelete='CASCADE'), primary_key=True)
+    index = db.Column(db.Integer, primary_key=True)
+    encrypted_chunk = db.Column(Ciphertext, nullable=False)
+
+# Serves listings in both pagination modes, per-session lookups and the bulk
+# delete in end_session. Created concurrently by migration 7c2d9e4b1a3f.
+db.Index(
+    'ix_documents_session_id_last_modified_id',
+    Document.session_id,
+    Document.last_modified.desc(),
+    Document.id.desc()
+)
+
+# Finds the documents still referencing a blob before it's deleted
+db.Index(
+    'ix_documents_content_hash',
+    Document.content_hash,
+    postgresql_where=Document.content_hash.isnot(None)
+)
+
+def documents_changed(session_ids):
+    """An UPDATE moving the listing marker of ``session_ids`` forward, for
+    the transaction of every document write.
+
+    The marker only grows: it is the clock at execution, or a microsecond past
+    the previous marker if that is later. Writes that keep an older
+    last_modified (imports, coalesced autosaves) or commit out of order still
+    change it, as each waits for the previous one's lock on the session row.
+    """
+    return update(Session)\
+        .where(Session.id.in_(session_ids))\
+        .values(documents_changed_at=func.greatest(
+            Session.documents_changed_at + timedelta(microseconds=1),
+            func.timezone('utc', func.clock_timestamp())
+        ))\
+        .execution_options(synchronize_session=False)
+
+touch_buffer = TouchBuffer(
+    app, db, Session,
+    granularity=app.config['SESSION_TOUCH_GRANULARITY'],
+    flush_interval=app.config['SESSION_TOUCH_FLUSH_INTERVAL']
+)
+
+autosaves = AutosaveCoalescer(app, db, Document, window=app.config['AUTOSAVE_COALESCE_WINDOW'],
+                              on_write=documents_changed,
+                              on_flush=replicas.wrote)
+
+@app.before_request
+def flush_autosaves():
+    # Every other route reads a session with its coalesced saves written
+    if autosaves.enabled and request.endpoint != 'update_document'\
+            and request.view_args and 'address' in request.view_args:
+        autosaves.flush(request.view_args['address'])
+
+# Drops the reclaimed sessions from this process' cache and touch buffer;
+# other workers find out when their cached id no longer exists
+def forget_sessions(sessions):
+    for session_id, address in sessions:
+        session_cache.pop(address)
+        touch_buffer.discard(session_id)
+
+# Deletes the blobs among content_hashes that no document references any more;
+# called once the documents releasing them are committed
+def release_blobs(content_hashes):
+    content_hashes = [content_hash for content_hash in content_hashes if content_hash is not None]
+    if not content_hashes:
+        return
+    try:
+        with app.app_context(), db.engine.connect() as connection:
+            blob_store.collect(connection, Document.content_hash, content_hashes)
+    except Exception:
+        # Left for `flask collect-blobs`; the documents are gone either way
+        app.logger.exception('Failed to collect blobs')
+
+sweeper = SessionSweeper(
+    app, db, Session, Document,
+    max_age=app.config['SESSION_MAX_AGE'],
+    batch_size=app.config['SESSION_SWEEP_BATCH_SIZE'],
+    interval=app.config['SESSION_SWEEP_INTERVAL'],
+    on_reclaimed=forget_sessions,
+    on_released=release_blobs
+)
+
+@app.before_request
+def start_sweeper():
+    # Started lazily so the thread runs in each worker, not in a preloading parent
+    sweeper.start()
 
 # Add SQLAlchemy event listener to update last_modified
 @event.listens_for(Document, 'before_update')
 def update_timestamp(mapper, connection, target):
     target.last_modified = datetime.utcnow()
 
+@event.listens_for(Document, 'before_insert')
+@event.listens_for(Document, 'before_update')
+def invalidate_content_digest(mapper, connection, target):
+    # Ciphertext written without a matching digest makes the stored one stale
+    attrs = inspect(target).attrs
+    changed = attrs.encrypted_content.history.has_changes() or attrs.encrypted_title.history.has_changes()
+    if changed and not attrs.content_digest.history.has_changes():
+        target.content_digest = None
+
+def content_digest(encrypted_title, encrypted_content=None, encrypted_chunks=None):
+    title = encrypted_title.encode()
+    digest = hashlib.sha256(len(title).to_bytes(8, 'big'))
+    digest.update(title)
+    if encrypted_chunks is None:
+        digest.update(encrypted_content.encode())
+    else:
+        digest.update(b'chunks')
+        for chunk in encrypted_chunks:
+            chunk = chunk.encode()
+            digest.update(len(chunk).to_bytes(8, 'big'))
+            digest.update(chunk)
+    return digest.digest()
+
+# Chunked documents
+def load_chunks(document_ids):
+    """Return ``{document_id: [encrypted_chunk, ...]}`` in index order, in one query."""
+    chunks = {}
+    if document_ids:
+        rows = db.session.query(DocumentChunk.document_id, DocumentChunk.encrypted_chunk)\
+            .filter(DocumentChunk.document_id.in_(document_ids))\
+            .order_by(DocumentChunk.document_id, DocumentChunk.index)
+        for document_id, encrypted_chunk in rows:
+            chunks.setdefault(document_id, []).append(encrypted_chunk)
+    return chunks
+
+# Large ciphertexts in the blob store
+def content_values(encrypted_content):
+    """The columns holding single-blob content: the ciphertext itself, or the
+    hash and length of its blob once it's over the blob store's threshold."""
+    if blob_store.stores(len(encrypted_content)):
+        data = dumps(encrypted_content)
+        return {'encrypted_content': '', 'content_hash': blob_store.put(data), 'content_length': len(data)}
+    return {'encrypted_content': encrypted_content, 'content_hash': None, 'content_length': None}
+
+def document_content(document):
+    """A single-blob document's ciphertext, wherever it's stored."""
+    if document.content_hash is None:
+        return document.encrypted_content
+    return loads(blob_store.read(document.content_hash))
+
+def store_content(document, encrypted_content=None, encrypted_chunks=None):
+    """Replace a document's content with a single blob or a list of chunks.
+
+    Returns the hash of the blob the document stored before, if any, for
+    release_blobs() once committed.
+    """
+    replaced = document.content_hash
+    if document.id is not None and document.chunk_count is not None:
+        DocumentChunk.query.filter_by(document_id=document.id).delete()
+    if encrypted_chunks is None:
+        for name, value in content_values(encrypted_content).items():
+            setattr(document, name, value)
+        document.chunk_count = None
+        return replaced
+    
+    document.encrypted_content = ''
+    document.content_hash = document.content_length = None
+    document.chunk_count = len(encrypted_chunks)
+    chunks = [DocumentChunk(index=index, encrypted_chunk=chunk)
+              for index, chunk in enumerate(encrypted_chunks)]
+    if document.id is None:
+        document.chunks = chunks
+    else:
+        for chunk in chunks:
+            chunk.document_id = document.id
+        db.session.add_all(chunks)
+    return replaced
+
+def valid_chunks(encrypted_chunks):
+    return isinstance(encrypted_chunks, list) and len(encrypted_chunks) > 0\
+        and all(isinstance(chunk, str) for chunk in encrypted_chunks)
+
+def valid_ciphertexts(data):
+    """Whether the title and single-blob content in ``data``, where given, are strings."""
+    return all(isinstance(data[field], str)
+               for field in ('encryptedTitle', 'encryptedContent') if field in data)
+
+# Request checks shared with asgi.py; each returns the error message, or None
+def new_document_error(data):
+    """Why ``data`` can't create a document."""
+    if not isinstance(data, dict):
+        return 'Invalid request body'
+    # Content is either one blob or, for chunked documents, a list of chunks
+    if not data or 'encryptedTitle' not in data\
+            or ('encryptedContent' in data) == ('encryptedChunks' in data):
+        return 'Missing required fields'
+    if not valid_ciphertexts(data):
+        return 'Invalid encryptedTitle or encryptedContent'
+    if 'encryptedChunks' in data and not valid_chunks(data['encryptedChunks']):
+        return 'Invalid chunks'
+    return None
+
+def document_update_error(data):
+    """Why ``data`` can't update a document."""
+    if not data:
+        return 'No data provided'
+    if not isinstance(data, dict):
+        return 'Invalid request body'
+    if 'encryptedContent' in data and 'encryptedChunks' in data:
+        return 'Send either encryptedContent or encryptedChunks'
+    if not valid_ciphertexts(data):
+        return 'Invalid encryptedTitle or encryptedContent'
+    if 'encryptedChunks' in data and not valid_chunks(data['encryptedChunks']):
+        return 'Invalid chunks'
+    return None
+
+def batch_targets(operations):
+    """Check the operations of a batch: returns ``(results, targets)``, where
+    ``results`` holds a 400 result for every invalid operation (None for the
+    rest) and ``targets`` maps document URLs to the valid operations on them."""
+    results = [None] * len(operations)
+    targets = {}
+    for i, operation in enumerate(operations):
+        error = None
+        if not isinstance(operation, dict) or operation.get('op') not in ('get', 'create', 'update', 'delete'):
+            error = 'Invalid operation'
+        elif 'encryptedChunks' in operation:
+            error = 'Chunked documents must be written individually'
+        elif not valid_ciphertexts(operation):
+            error = 'Invalid encryptedTitle or encryptedContent'
+        elif operation['op'] == 'create':
+            if 'encryptedContent' not in operation or 'encryptedTitle' not in operation:
+                error = 'Missing required fields'
+        elif not isinstance(operation.get('id'), str):
+            error = 'Missing document id'
+        elif operation['id'] in targets:
+            error = 'Document appears more than once in the batch'
+        elif operation['op'] == 'update' and 'encryptedContent' not in operation\
+                and 'encryptedTitle' not in operation:
+            error = 'No data provided'
+        else:
+            targets[operation['id']] = operation
+        if error:
+            results[i] = {'status': 400, 'error': error}
+    return results, targets
+
+def batch_needs_content(targets):
+    """The URLs of the batch's documents whose stored ciphertext is needed:
+    reads and partial updates need it, nothing else does."""
+    return {
+        document_url for document_url, operation in targets.items()
+        if operation['op'] == 'get' or (operation['op'] == 'update' and not (
+            'encryptedContent' in operation and 'encryptedTitle' in operation))
+    }
+
+def document_patch_error(data, current_count):
+    """Why ``data`` can't patch a chunked document of ``current_count``
+    chunks (None when the document isn't chunked)."""
+    if not data:
+        return 'No data provided'
+    if not isinstance(data, dict):
+        return 'Invalid request body'
+    if current_count is None:
+        return 'Document is not chunked'
+    chunk_count = data.get('chunkCount', current_count)
+    if not isinstance(chunk_count, int) or isinstance(chunk_count, bool) or chunk_count < 1:
+        return 'Invalid chunkCount'
+    if 'encryptedTitle' in data and not isinstance(data['encryptedTitle'], str):
+        return 'Invalid encryptedTitle'
+    return chunk_patch_error(data.get('chunks', []), chunk_count, current_count)
+
+def chunk_patch_error(chunks, chunk_count, current_count):
+    """Why the chunks of a PATCH can't be applied."""
+    # bool is an int, but `"index": true` is no index
+    if not isinstance(chunks, list) or not all(
+            isinstance(chunk, dict)
+            and type(chunk.get('index')) is int and 0 <= chunk['index'] < chunk_count
+            and isinstance(chunk.get('encryptedChunk'), str)
+            for chunk in chunks):
+        return 'Invalid chunks'
+    indexes = {chunk['index'] for chunk in chunks}
+    # One upsert can't write the same row twice
+    if len(indexes) < len(chunks):
+        return 'Duplicate chunk indexes'
+    # Growing the document means sending every new chunk
+    if not set(range(current_count, chunk_count)) <= indexes:
+        return 'Missing chunks'
+    return None
+
+# Listing helpers shared with asgi.py
+LISTING_PAGE_SIZE = 10
+
+def listing_params(args):
+    """The page, fields, cursor and keyset position of a listing's query
+    ``args``; raises ValueError with the message for a 400."""
+    try:
+        page = int(args.get('page', 1))
+    except ValueError:
+        page = 1
+    # 'metadata' lists titles and timestamps only, for the sidebar
+    fields = args.get('fields', 'all')
+    if fields not in ('all', 'metadata'):
+        raise ValueError('Invalid fields parameter')
+    # Passing 'cursor' (empty for the first page) switches to keyset pagination
+    cursor = args.get('cursor')
+    position = decode_cursor(cursor) if cursor else None
+    return page, fields, cursor, position
+
+def listing_query(session_id, fields, keyset=False, position=None):
+    """The SELECT of a listing page's documents, newest first: with ``keyset``,
+    a page and one more row after ``position``; else ready to paginate."""
+    query = select(Document).where(Document.session_id == session_id)
+    if fields == 'metadata':
+        # Leave the ciphertext out of the SELECT; touching it would raise
+        query = query.options(defer(Document.encrypted_content, raiseload=True))
+    if not keyset:
+        return query.order_by(Document.last_modified.desc())
+    if position is not None:
+        query = query.where(tuple_(Document.last_modified, Document.id) < position)
+    # The extra row tells whether there is a next page
+    return query.order_by(Document.last_modified.desc(), Document.id.desc()).limit(LISTING_PAGE_SIZE + 1)
+
+def keyset_page(rows):
+    """The page of a keyset listing_query()'s rows and the cursor of the next one."""
+    next_cursor = encode_cursor(rows[LISTING_PAGE_SIZE - 1]) if len(rows) > LISTING_PAGE_SIZE else None
+    return rows[:LISTING_PAGE_SIZE], next_cursor
+
+def listing_items(rows, fields, contents, chunks):
+    """The documents of a listing page; ``contents`` and ``chunks`` map the ids
+    of single-blob and chunked documents to their ciphertext."""
+    if fields == 'metadata':
+        return [document_data(doc.document_url, doc.encrypted_title, doc.created_at, doc.last_modified,
+                              content=False) for doc in rows]
+    return [document_data(doc.document_url, doc.encrypted_title, doc.created_at, doc.last_modified,
+                          contents.get(doc.id), chunks.get(doc.id)) for doc in rows]
+
+# Batch and PATCH helpers shared with asgi.py
+def batch_query(session_id, targets, needs_content):
+    """The SELECT of the documents a batch operates on."""
+    query = select(Document).where(Document.session_id == session_id,
+                                   Document.document_url.in_(list(targets)))
+    if not needs_content:
+        query = query.options(defer(Document.encrypted_content), defer(Document.encrypted_title))
+    return query
+
+class BatchWrites:
+    """The rows a batch inserts, updates and deletes, from plan_batch()."""
+    
+    def __init__(self):
+        self.inserts, self.updates, self.deletes, self.unchunked = [], [], [], []
+        # Blobs the deleted and rewritten documents referenced
+        self.released = []
+        self.skipped = 0
+    
+    def statements(self, session_id):
+        """The statements applying the writes, each with its parameters."""
+        statements = []
+        if self.inserts:
+            statements.append((insert(Document), self.inserts))
+        if self.updates:
+            statements.append((update(Document), self.updates))
+        if self.unchunked:
+            statements.append((delete(DocumentChunk).where(DocumentChunk.document_id.in_(self.unchunked))
+                               .execution_options(synchronize_session=False), None))
+        if self.deletes:
+            statements.append((delete(Document).where(Document.id.in_(self.deletes))
+                               .execution_options(synchronize_session=False), None))
+        if statements:
+            statements.append((documents_changed([session_id]), None))
+        return statements
+
+def plan_batch(operations, results, documents, chunks, session_id):
+    """Fill in the ``results`` of a batch's valid operations and return their
+    BatchWrites. ``documents`` maps URLs to the rows of batch_query() and
+    ``chunks`` their ids to their chunks. Reads and writes the blob store, so
+    asgi.py runs it in a worker thread."""
+    writes = BatchWrites()
+    now = datetime.utcnow()
+    for i, operation in enumerate(operations):
+        if results[i] is not None:
+            continue
+        if operation['op'] == 'create':
+            document_url = str(uuid.uuid4())
+            writes.inserts.append({
+                'document_url': document_url,
+                **content_values(operation['encryptedContent']),
+                'encrypted_title': operation['encryptedTitle'],
+                'content_digest': content_digest(operation['encryptedTitle'], operation['encryptedContent']),
+                'created_at': now,
+                'last_modified': now,
+                'session_id': session_id
+            })
+            results[i] = {'status': 200, 'data': document_data(
+                document_url, operation['encryptedTitle'], now, now, operation['encryptedContent'])}
+            continue
+        
+        document = documents.get(operation['id'])
+        if document is None:
+            results[i] = {'status': 404, 'error': 'Document not found'}
+        elif operation['op'] == 'delete':
+            writes.deletes.append(document.id)
+            writes.released.append(document.content_hash)
+            results[i] = {'status': 200, 'data': {'message': 'Document deleted successfully'}}
+        elif operation['op'] == 'get':
+            results[i] = {'status': 200, 'data': document_data(
+                document.document_url, document.encrypted_title, document.created_at, document.last_modified,
+                document_content(document) if document.chunk_count is None else None,
+                chunks.get(document.id) if document.chunk_count is not None else None)}
+        else:
+            encrypted_title = operation['encryptedTitle'] if 'encryptedTitle' in operation else document.encrypted_title
+            encrypted_content = encrypted_chunks = None
+            if 'encryptedContent' in operation:
+                encrypted_content = operation['encryptedContent']
+            elif document.chunk_count is not None:
+                encrypted_chunks = chunks.get(document.id, [])
+            else:
+                encrypted_content = document_content(document)
+            digest = content_digest(encrypted_title, encrypted_content, encrypted_chunks)
+            
+            last_modified = document.last_modified
+            if digest == document.content_digest:
+                writes.skipped += 1
+            else:
+                values = {
+                    'id': document.id,
+                    'encrypted_title': encrypted_title,
+                    'content_digest': digest,
+                    'last_modified': now
+                }
+                if 'encryptedContent' in operation:
+                    values.update(content_values(encrypted_content))
+                    values['chunk_count'] = None
+                    writes.released.append(document.content_hash)
+                    if document.chunk_count is not None:
+                        writes.unchunked.append(document.id)
+                writes.updates.append(values)
+                last_modified = now
+            results[i] = {'status': 200, 'data': document_data(
+                document.document_url, encrypted_title, document.created_at, last_modified,
+                encrypted_content, encrypted_chunks)}
+    return writes
+
+def chunk_patch_statements(document_id, chunks, chunk_count, current_count):
+    """The upsert of a PATCH's chunks, and the DELETE of those past a smaller
+    chunk_count."""
+    statements = []
+    if chunks:
+        upsert = insert(DocumentChunk).values([{
+            'document_id': document_id,
+            'index': chunk['index'],
+            'encrypted_chunk': chunk['encryptedChunk']
+        } for chunk in chunks])
+        statements.append(upsert.on_conflict_do_update(
+            index_elements=[DocumentChunk.document_id, DocumentChunk.index],
+            set_={'encrypted_chunk': upsert.excluded.encrypted_chunk}
+        ))
+    if chunk_count < current_count:
+        statements.append(delete(DocumentChunk).where(DocumentChunk.document_id == document_id,
+                                                      DocumentChunk.index >= chunk_count))
+    return statements
+
+def export_lines(engine, session_id, yield_per):
+    """Yield one NDJSON line per document of a session, oldest first.
+
+    Documents and chunks are read through two server-side cursors on their own
+    REPEATABLE READ connection, so they come from the same snapshot and only
+    ``yield_per`` rows of each are held at a time.
+    """
+    documents = select(Document.id, Document.document_url, Document.encrypted_title,
+                       Document.encrypted_content, Document.content_hash, Document.chunk_count,
+                       Document.created_at, Document.last_modified)\
+        .where(Document.session_id == session_id)\
+        .order_by(Document.id)
+    chunks = select(DocumentChunk.document_id, DocumentChunk.encrypted_chunk)\
+        .join(Document, Document.id == DocumentChunk.document_id)\
+        .where(Document.session_id == session_id)\
+        .order_by(DocumentChunk.document_id, DocumentChunk.index)
+    
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level='REPEATABLE READ', yield_per=yield_per)
+        chunk_rows = iter(connection.execute(chunks))
+        chunk = next(chunk_rows, None)
+        for doc in connection.execute(documents):
+            encrypted_chunks = None
+            if doc.chunk_count is not None:
+                encrypted_chunks = []
+                # Both cursors are ordered by document id; merge them
+                while chunk is not None and chunk.document_id <= doc.id:
+                    if chunk.document_id == doc.id:
+                        encrypted_chunks.append(chunk.encrypted_chunk)
+                    chunk = next(chunk_rows, None)
+            elif doc.content_hash is not None:
+                # The blob is the content's JSON already; copy it in as it is
+                head, tail = document_frame(doc.document_url, doc.encrypted_title,
+                                            doc.created_at, doc.last_modified)
+                yield head + blob_store.read(doc.content_hash) + tail + b'\n'
+                continue
+            yield dumps(document_data(doc.document_url, doc.encrypted_title, doc.created_at,
+                                      doc.last_modified, doc.encrypted_content, encrypted_chunks)) + b'\n'
+
+DOCUMENT_COLUMNS = ('id', 'document_url', 'encrypted_title', 'encrypted_content', 'content_digest',
+                    'chunk_count', 'created_at', 'last_modified', 'session_id', 'content_hash', 'content_length')
+CHUNK_COLUMNS = ('document_id', 'index', 'encrypted_chunk')
+
+def import_lines(session_id, lines, batch_size, batch_bytes):
+    """Load NDJSON documents, in the export format, into a session.
+
+    Each document gets a new URL; ``createdAt`` and ``lastModified`` are kept
+    when present. Rows are copied in batches within the caller's transaction.
+    Returns an ImportStats; raises ValueError naming the first invalid line.
+    """
+    connection = db.session.connection()
+    stats = ImportStats()
+    documents, chunks, pending_bytes = [], [], 0
+    
+    def flush():
+        ids = next_ids(connection, Document.__table__, len(documents))
+        for document_id, row in zip(ids, documents):
+            row[0] = document_id
+        copy_rows(connection, Document.__table__, DOCUMENT_COLUMNS, documents)
+        copy_rows(connection, DocumentChunk.__table__, CHUNK_COLUMNS, [
+            (ids[position], index, chunk) for position, index, chunk in chunks
+        ])
+        stats.rows += len(documents)
+    
+    now = datetime.utcnow()
+    for number, line in enumerate(lines, 1):
+        stats.bytes += len(line)
+        if not line.strip():
+            continue
+        try:
+            data = loads(line)
+            encrypted_title = data['encryptedTitle']
+            encrypted_content = data.get('encryptedContent')
+            encrypted_chunks = data.get('encryptedChunks')
+            if not isinstance(encrypted_title, str)\
+                    or (encrypted_content is None) == (encrypted_chunks is None)\
+                    or (encrypted_content is not None and not isinstance(encrypted_content, str))\
+                    or (encrypted_chunks is not None and not valid_chunks(encrypted_chunks)):
+                raise ValueError
+            created_at = datetime.fromisoformat(data['createdAt']) if 'createdAt' in data else now
+            last_modified = datetime.fromisoformat(data['lastModified']) if 'lastModified' in data else now
+        except (TypeError, KeyError, ValueError) as e:
+            raise ValueError(f'Invalid document on line {number}') from e
+        
+        digest = content_digest(encrypted_title, encrypted_content, encrypted_chunks)
+        if encrypted_chunks is not None:
+            chunks.extend((len(documents), index, chunk) for index, chunk in enumerate(encrypted_chunks))
+            content = content_values('')
+        else:
+            content = content_values(encrypted_content)
+        documents.append([None, str(uuid.uuid4()), encrypted_title, content['encrypted_content'], digest,
+                          None if encrypted_chunks is None else len(encrypted_chunks),
+                          created_at, last_modified, session_id, content['content_hash'], content['content_length']])
+        pending_bytes += len(line)
+        if len(documents) >= batch_size or pending_bytes >= batch_bytes:
+            flush()
+            documents, chunks, pending_bytes = [], [], 0
+    if documents:
+        flush()
+    
+    db.session.execute(documents_changed([session_id]))
+    stats.finish()
+    return stats
+
+document_writes = Counter('document_writes_total', 'Document updates written to the database')
+document_writes_skipped = Counter('document_writes_skipped_total', 'Document updates skipped because nothing changed')
+
+# Lookup helpers shared by the document routes
+def get_session_id(address):
+    """Return the id of the session at ``address``, or None if it doesn't exist."""
+    session_id = session_cache.get(address)
+    if session_id is None:
+        session_id = db.session.query(Session.id).filter_by(address=address).scalar()
+        if session_id is not None:
+            session_cache.set(address, session_id)
+    return session_id
+
+def get_session_document(address, document_url, *options):
+    """Resolve a session and one of its documents in a single query.
+
+    Returns ``(session_id, document)``; ``session_id`` is None when the session
+    doesn't exist and ``document`` is None when the document doesn't.
+    ``options`` are loader options applied to the document query.
+    """
+    session_id = session_cache.get(address)
+    if session_id is not None:
+        document = Document.query.options(*options)\
+            .filter_by(session_id=session_id, document_url=document_url)\
+            .first()
+        return session_id, document
+    
+    row = db.session.query(Session.id, Document)\
+        .options(*options)\
+        .outerjoin(Document, and_(Document.session_id == Session.id,
+                                  Document.document_url == document_url))\
+        .filter(Session.address == address)\
+        .first()
+    if row is None:
+        return None, None
+    session_cache.set(address, row[0])
+    return row[0], row[1]
+
+def encode_cursor(document):
+    """Build the opaque keyset cursor pointing just past ``document``."""
+    position = [document.last_modified.isoformat(), document.id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_cursor(cursor):
+    """Return ``(last_modified, id)`` from a cursor; raises ValueError if malformed."""
+    try:
+        last_modified, document_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(last_modified), int(document_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+# Conditional GET helpers
+# For refresh() after a conditional miss: it keeps load_only(), and the
+# columns left out would each lazy-load with a query of their own
+DOCUMENT_ATTRIBUTES = [column.key for column in Document.__mapper__.column_attrs]
+
+def document_etag(document):
+    return f'{document.id}.{document.last_modified:%Y%m%d%H%M%S%f}'
+
+def listing_marker(session_id):
+    """Return a value that changes whenever the session's document list does,
+    or None if the session no longer exists."""
+    row = db.session.query(Session.documents_changed_at).filter(Session.id == session_id).first()
+    return None if row is None else tuple(row)
+
+def listing_validators(marker, fields, page, cursor):
+    """The ETag of a listing page and when its document list last changed
+    (None if it never had documents)."""
+    etag = hashlib.sha1(repr((marker, fields, page, cursor)).encode()).hexdigest()
+    changed_at, = marker
+    return etag, changed_at
+
+def rate_limit_error(limit, reset_at):
+    """The body and headers of a 429 for ``limit``, whose window ends at the
+    ``reset_at`` timestamp."""
+    # As Flask-Limiter's own Retry-After header counts it
+    retry_after = max(int(reset_at - time.time()), 1)
+    return {'error': f'Rate limit exceeded: {limit}'}, {'Retry-After': str(retry_after)}
+
+def http_last_modified(last_modified):
+    """``last_modified`` as the whole second HTTP dates carry, or None while
+    that second is still current.
+
+    A later write within the same second would not move the date, so until
+    the second is over only the ETag can tell the versions apart.
+    """
+    if last_modified is None:
+        return None
+    last_modified = last_modified.replace(microsecond=0)
+    if last_modified >= datetime.utcnow().replace(microsecond=0):
+        return None
+    return last_modified.replace(tzinfo=timezone.utc)
+
+def validators_match(etag, last_modified, if_none_match, if_modified_since):
+    """Whether a request's If-None-Match (parsed ETags) or, without one, its
+    If-Modified-Since (a datetime or None) still match."""
+    if if_none_match:
+        # Weak comparison, so compressed (weak) variants revalidate too
+        return if_none_match.contains_weak(etag)
+    modified_at = http_last_modified(last_modified)
+    return modified_at is not None and if_modified_since is not None and modified_at <= if_modified_since
+
+def validator_headers(etag, last_modified=None):
+    headers = {'ETag': quote_etag(etag)}
+    modified_at = http_last_modified(last_modified)
+    if modified_at is not None:
+        headers['Last-Modified'] = http_date(modified_at)
+    # Browsers may keep the response but must revalidate before reusing it
+    headers['Cache-Control'] = 'private, no-cache'
+    return headers
+
+def not_modified(etag, last_modified=None):
+    """Return a 304 response if the request's validators still match, else None."""
+    if not validators_match(etag, last_modified, request.if_none_match, request.if_modified_since):
+        return None
+    return with_validators(app.response_class(status=304), etag, last_modified)
+
+def with_validators(response, etag, last_modified=None):
+    response.headers.update(validator_headers(etag, last_modified))
+    return response
+
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def metrics():
+    # Not found unless enabled, like the rest of the instrumentation
+    if not request_metrics.enabled:
+        return jsonify({'error': 'Not found'}), 404
+    return app.response_class(exposition(), content_type=CONTENT_TYPE)
+
+@app.errorhandler(429)
+def rate_limit_exceeded(e):
+    # JSON like every other error, with the same body and headers as asgi.py
+    current = limiter.current_limit
+    body, headers = rate_limit_error(current.limit, current.reset_at)
+    return jsonify(body), 429, headers
+
+@app.errorhandler(PoolTimeoutError)
+def database_busy(e):
+    # Every pooled connection stayed busy for DB_POOL_TIMEOUT; see db_pool_wait_seconds
+    response = jsonify({'error': 'Database busy'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 # Session routes
 @app.route('/api/sessions', methods=['POST'])
 @limiter.limit("5 per minute")
@@ -64,157 +874,394 @@ def create_session():
     db.session.add(session)
     
     try:
+        db.session.flush()
+        # Built before the commit expires the row, which would read it back
+        response = jsonify({'data': session_data(session.address, session.created_at, session.last_accessed)})
         db.session.commit()
-        return jsonify({
-            'data': {
-                'id': session.address,
-                'createdAt': session.created_at.isoformat(),
-                'lastAccessed': session.last_accessed.isoformat()
-            }
-        })
+        replicas.wrote(address)
+        return response
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Failed to create session'}), 500
 
 @app.route('/api/sessions/<address>', methods=['GET'])
 @limiter.limit("60 per minute")
+@replicas.read_only
 def validate_session(address):
     session = Session.query.filter_by(address=address).first()
     if not session:
         return jsonify({'error': 'Session not found'}), 404
-        
-    session.last_accessed = datetime.utcnow()
-    db.session.commit()
+    session_cache.set(address, session.id)
     
-    return jsonify({
-        'data': {
-            'id': session.address,
-            'createdAt': session.created_at.isoformat(),
-            'lastAccessed': session.last_accessed.isoformat()
-        }
-    })
+    # Buffered; written by touch_buffer in batches rather than per request
+    last_accessed = touch_buffer.touch(session.id, session.last_accessed)
+    
+    return jsonify({'data': session_data(session.address, session.created_at, last_accessed)})
 
 # Document routes
 @app.route('/api/sessions/<address>/documents', methods=['GET'])
 @limiter.limit("60 per minute")
+@replicas.read_only
 def get_documents(address):
-    session = Session.query.filter_by(address=address).first()
-    if not session:
+    session_id = get_session_id(address)
+    if session_id is None:
         return jsonify({'error': 'Session not found'}), 404
     
-    page = request.args.get('page', 1, type=int)
-    per_page = 10
+    try:
+        page, fields, cursor, position = listing_params(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    marker = listing_marker(session_id)
+    if marker is None:
+        session_cache.pop(address)
+        return jsonify({'error': 'Session not found'}), 404
+    etag, changed_at = listing_validators(marker, fields, page, cursor)
+    response = not_modified(etag, changed_at)
+    if response:
+        return response
     
-    documents = Document.query.filter_by(session_id=session.id)\
-        .order_by(Document.last_modified.desc())\
-        .paginate(page=page, per_page=per_page)
+    if cursor is None:
+        documents = db.paginate(listing_query(session_id, fields), page=page, per_page=LISTING_PAGE_SIZE)
+        rows = documents.items
+    else:
+        rows, next_cursor = keyset_page(db.session.scalars(
+            listing_query(session_id, fields, keyset=True, position=position)).all())
     
-    return jsonify({
+    contents, chunks = {}, {}
+    if fields == 'all':
+        contents = {doc.id: document_content(doc) for doc in rows if doc.chunk_count is None}
+        chunks = load_chunks([doc.id for doc in rows if doc.chunk_count is not None])
+    items = listing_items(rows, fields, contents, chunks)
+    
+    if cursor is not None:
+        return with_validators(jsonify({
+            'data': {
+                'documents': items,
+                'nextCursor': next_cursor
+            }
+        }), etag, changed_at)
+    return with_validators(jsonify({
         'data': {
-            'documents': [{
-                'id': doc.document_url,
-                'encryptedTitle': doc.encrypted_title,
-                'encryptedContent': doc.encrypted_content,
-                'createdAt': doc.created_at.isoformat(),
-                'lastModified': doc.last_modified.isoformat()
-            } for doc in documents.items],
+            'documents': items,
             'total': documents.total,
             'pages': documents.pages,
             'currentPage': documents.page
         }
-    })
+    }), etag, changed_at)
+
+@app.route('/api/sessions/<address>/export', methods=['GET'])
+@limiter.limit("5 per minute")
+@replicas.read_only
+def export_session(address):
+    session_id = get_session_id(address)
+    if session_id is None:
+        return jsonify({'error': 'Session not found'}), 404
+    
+    # Streamed as NDJSON, one document per line, in the shape get_document returns
+    lines = export_lines(replicas.engine(db.engine), session_id, app.config['EXPORT_YIELD_PER'])
+    response = app.response_class(lines, mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename="session.ndjson"'
+    return response
+
+@app.route('/api/sessions/<address>/import', methods=['POST'])
+@limiter.limit("5 per minute")
+# Read a batch at a time, so a compressed body needs no size limit either
+@compress.streamed
+def import_session(address):
+    """Bulk-load an NDJSON body, one document per line, as produced by export_session."""
+    session_id = get_session_id(address)
+    if session_id is None:
+        return jsonify({'error': 'Session not found'}), 404
+    
+    try:
+        stats = import_lines(session_id, request.stream,
+                             app.config['IMPORT_BATCH_SIZE'], app.config['IMPORT_BATCH_BYTES'])
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except HTTPException:
+        # A compressed body turned out corrupt or too large while being read
+        db.session.rollback()
+        raise
+    except IntegrityError:
+        db.session.rollback()
+        session_cache.pop(address)
+        return jsonify({'error': 'Session not found'}), 404
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to import documents'}), 500
+    
+    return jsonify({'data': stats.as_dict()})
 
 @app.route('/api/sessions/<address>/documents', methods=['POST'])
 @limiter.limit("60 per minute")
 def create_document(address):
-    session = Session.query.filter_by(address=address).first()
-    if not session:
+    session_id = get_session_id(address)
+    if session_id is None:
         return jsonify({'error': 'Session not found'}), 404
     
     data = request.get_json()
-    if not data or 'encryptedContent' not in data or 'encryptedTitle' not in data:
-        return jsonify({'error': 'Missing required fields'}), 400
+    message = new_document_error(data)
+    if message:
+        return jsonify({'error': message}), 400
+    encrypted_content = data.get('encryptedContent')
+    encrypted_chunks = data.get('encryptedChunks')
     
     # Generate unique document URL (you might want to implement a more secure method)
     document_url = str(uuid.uuid4())
     
     document = Document(
         document_url=document_url,
-        encrypted_content=data['encryptedContent'],
         encrypted_title=data['encryptedTitle'],
-        session_id=session.id
+        content_digest=content_digest(data['encryptedTitle'], encrypted_content, encrypted_chunks),
+        session_id=session_id
     )
+    store_content(document, encrypted_content, encrypted_chunks)
     
     try:
         db.session.add(document)
-        db.session.commit()
-        return jsonify({
-            'data': {
-                'id': document.document_url,
-                'encryptedTitle': document.encrypted_title,
-                'encryptedContent': document.encrypted_content,
-                'createdAt': document.created_at.isoformat(),
-                'lastModified': document.last_modified.isoformat()
-            }
+        # Build the response before commit() expires the row and forces a reload
+        db.session.flush()
+        response = jsonify({
+            'data': document_data(document_url, data['encryptedTitle'], document.created_at,
+                                  document.last_modified, encrypted_content, encrypted_chunks)
         })
+        db.session.execute(documents_changed([session_id]))
+        db.session.commit()
+        return response
+    except IntegrityError:
+        # The cached session may have been ended by another worker
+        db.session.rollback()
+        session_cache.pop(address)
+        return jsonify({'error': 'Session not found'}), 404
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Failed to create document'}), 500
 
-@app.route('/api/sessions/<address>/documents/<document_url>', methods=['GET'])
+@app.route('/api/sessions/<address>/documents/batch', methods=['POST'])
 @limiter.limit("60 per minute")
-def get_document(address, document_url):
-    session = Session.query.filter_by(address=address).first()
-    if not session:
+def batch_documents(address):
+    """Apply many document operations with one session lookup and one commit.
+
+    Body: ``{"operations": [{"op": "create", "encryptedTitle": ..., "encryptedContent": ...},
+    {"op": "get" | "update" | "delete", "id": ..., ...}, ...]}``. A document may
+    appear in only one operation per batch. The response holds one
+    ``{"status", "data" | "error"}`` result per operation, in order.
+    """
+    session_id = get_session_id(address)
+    if session_id is None:
         return jsonify({'error': 'Session not found'}), 404
     
-    document = Document.query.filter_by(session_id=session.id, document_url=document_url).first()
-    if not document:
-        return jsonify({'error': 'Document not found'}), 404
+    data = request.get_json()
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'No operations provided'}), 400
+    if len(operations) > app.config['BATCH_MAX_OPERATIONS']:
+        return jsonify({'error': 'Too many operations'}), 400
+    
+    results, targets = batch_targets(operations)
+    needs_content = batch_needs_content(targets)
+    documents = {}
+    if targets:
+        documents = {document.document_url: document
+                     for document in db.session.scalars(batch_query(session_id, targets, needs_content))}
+    chunks = load_chunks([document.id for document_url, document in documents.items()
+                          if document_url in needs_content and document.chunk_count is not None])
+    writes = plan_batch(operations, results, documents, chunks, session_id)
     
+    try:
+        for statement, parameters in writes.statements(session_id):
+            db.session.execute(statement, parameters)
+        db.session.commit()
+    except IntegrityError:
+        # The cached session may have been ended by another worker
+        db.session.rollback()
+        session_cache.pop(address)
+        return jsonify({'error': 'Session not found'}), 404
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to apply batch'}), 500
+    
+    release_blobs(writes.released)
+    document_writes.inc(len(writes.updates))
+    document_writes_skipped.inc(writes.skipped)
     return jsonify({
         'data': {
-            'id': document.document_url,
-            'encryptedTitle': document.encrypted_title,
-            'encryptedContent': document.encrypted_content,
-            'createdAt': document.created_at.isoformat(),
-            'lastModified': document.last_modified.isoformat()
+            'results': results
         }
     })
 
+@app.route('/api/sessions/<address>/documents/<document_url>', methods=['GET'])
+@limiter.limit("60 per minute")
+@replicas.read_only
+def get_document(address, document_url):
+    # Revalidation only needs the validators, not the ciphertext
+    conditional = bool(request.if_none_match or request.if_modified_since)
+    options = [load_only(Document.id, Document.last_modified)] if conditional else []
+    session_id, document = get_session_document(address, document_url, *options)
+    if session_id is None:
+        return jsonify({'error': 'Session not found'}), 404
+    
+    if not document:
+        return jsonify({'error': 'Document not found'}), 404
+    
+    etag = document_etag(document)
+    if conditional:
+        response = not_modified(etag, document.last_modified)
+        if response:
+            return response
+        db.session.refresh(document, DOCUMENT_ATTRIBUTES)
+    
+    if document.content_hash is not None:
+        # Sent from the mapped blob around the rest of the JSON, never decoded
+        head, tail = document_frame(document.document_url, document.encrypted_title, document.created_at,
+                                    document.last_modified, wrap=True)
+        response = app.response_class(blob_store.stream(document.content_hash, head, tail),
+                                      mimetype='application/json')
+        response.content_length = len(head) + document.content_length + len(tail)
+        return with_validators(response, etag, document.last_modified)
+    
+    encrypted_chunks = None
+    if document.chunk_count is not None:
+        encrypted_chunks = load_chunks([document.id]).get(document.id, [])
+    
+    return with_validators(jsonify({
+        'data': document_data(document.document_url, document.encrypted_title, document.created_at,
+                              document.last_modified, document.encrypted_content, encrypted_chunks)
+    }), etag, document.last_modified)
+
 @app.route('/api/sessions/<address>/documents/<document_url>', methods=['PUT'])
 @limiter.limit("60 per minute")
 def update_document(address, document_url):
-    session = Session.query.filter_by(address=address).first()
-    if not session:
+    data = request.get_json()
+    replaces_content = isinstance(data, dict) and ('encryptedContent' in data or 'encryptedChunks' in data)
+    # A full replacement is compared by digest, without reading the stored ciphertext
+    options = []
+    if replaces_content and 'encryptedTitle' in data:
+        options = [defer(Document.encrypted_content), defer(Document.encrypted_title)]
+    # Autosaves of the whole document are coalesced, unless large enough for
+    # the blob store; anything else is written after the saves before it
+    coalesce = autosaves.enabled and isinstance(data, dict) and 'encryptedTitle' in data and 'encryptedContent' in data\
+        and valid_ciphertexts(data) and not blob_store.stores(len(data['encryptedContent']))
+    if autosaves.enabled and not coalesce:
+        autosaves.flush(address)
+    session_id, document = get_session_document(address, document_url, *options)
+    if session_id is None:
         return jsonify({'error': 'Session not found'}), 404
     
-    document = Document.query.filter_by(session_id=session.id, document_url=document_url).first()
     if not document:
         return jsonify({'error': 'Document not found'}), 404
     
-    data = request.get_json()
-    if not data:
-        return jsonify({'error': 'No data provided'}), 400
+    message = document_update_error(data)
+    if message:
+        return jsonify({'error': message}), 400
     
-    if 'encryptedContent' in data:
-        document.encrypted_content = data['encryptedContent']
-    if 'encryptedTitle' in data:
-        document.encrypted_title = data['encryptedTitle']
+    encrypted_title = data['encryptedTitle'] if 'encryptedTitle' in data else document.encrypted_title
+    encrypted_content = encrypted_chunks = None
+    if 'encryptedChunks' in data:
+        encrypted_chunks = data['encryptedChunks']
+    elif 'encryptedContent' in data:
+        encrypted_content = data['encryptedContent']
+    elif document.chunk_count is not None:
+        encrypted_chunks = load_chunks([document.id]).get(document.id, [])
+    else:
+        encrypted_content = document_content(document)
+    digest = content_digest(encrypted_title, encrypted_content, encrypted_chunks)
+    # Chunked and blob-stored documents are never coalesced, so never have a pending save
+    coalesce = coalesce and document.chunk_count is None and document.content_hash is None
+    pending = autosaves.pending(address, document_url) if coalesce else None
+    # A save still waiting to be written is the latest version
+    last_modified = pending['last_modified'] if pending else None
+    
+    def representation():
+        return jsonify({
+            'data': document_data(document.document_url, encrypted_title, document.created_at,
+                                  last_modified or document.last_modified, encrypted_content, encrypted_chunks)
+        })
     
+    if digest == (pending['content_digest'] if pending else document.content_digest):
+        # Autosave re-sent what is already stored; skip the UPDATE entirely
+        document_writes_skipped.inc()
+        return representation()
+    
+    if coalesce:
+        last_modified = datetime.utcnow()
+        autosaves.save(address, document_url, document.id, encrypted_title, encrypted_content, digest,
+                       last_modified)
+        return representation()
+    
+    released = []
+    if replaces_content:
+        replaced = store_content(document, encrypted_content, encrypted_chunks)
+        if replaced != document.content_hash:
+            released.append(replaced)
+    if 'encryptedTitle' in data:
+        document.encrypted_title = encrypted_title
+    document.content_digest = digest
     document.last_modified = datetime.utcnow()
     
     try:
+        # Build the response before commit() expires the row and forces a reload
+        db.session.flush()
+        response = representation()
+        db.session.execute(documents_changed([session_id]))
         db.session.commit()
-        return jsonify({
-            'data': {
-                'id': document.document_url,
-                'encryptedTitle': document.encrypted_title,
-                'encryptedContent': document.encrypted_content,
-                'createdAt': document.created_at.isoformat(),
-                'lastModified': document.last_modified.isoformat()
-            }
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to update document'}), 500
+    
+    release_blobs(released)
+    document_writes.inc()
+    return response
+
+@app.route('/api/sessions/<address>/documents/<document_url>', methods=['PATCH'])
+@limiter.limit("60 per minute")
+def patch_document(address, document_url):
+    """Replace some chunks of a chunked document, optionally resizing it.
+
+    Body: ``{"chunks": [{"index": 3, "encryptedChunk": "..."}], "chunkCount": 10,
+    "encryptedTitle": "..."}``; every field is optional. Only the given chunks
+    are written, and the response leaves out the content.
+    """
+    session_id, document = get_session_document(
+        address, document_url,
+        defer(Document.encrypted_content), defer(Document.encrypted_title)
+    )
+    if session_id is None:
+        return jsonify({'error': 'Session not found'}), 404
+    
+    if not document:
+        return jsonify({'error': 'Document not found'}), 404
+    
+    data = request.get_json()
+    message = document_patch_error(data, document.chunk_count)
+    if message:
+        return jsonify({'error': message}), 400
+    chunk_count = data.get('chunkCount', document.chunk_count)
+    chunks = data.get('chunks', [])
+    
+    try:
+        for statement in chunk_patch_statements(document.id, chunks, chunk_count, document.chunk_count):
+            db.session.execute(statement)
+        document.chunk_count = chunk_count
+        if 'encryptedTitle' in data:
+            document.encrypted_title = data['encryptedTitle']
+        # Recomputing the digest would mean reading every chunk back
+        document.content_digest = None
+        document.last_modified = datetime.utcnow()
+        
+        # Build the response before commit() expires the row and forces a reload
+        db.session.flush()
+        response = jsonify({
+            'data': chunked_document_data(document.document_url, document.chunk_count, document.created_at,
+                                          document.last_modified)
         })
+        db.session.execute(documents_changed([session_id]))
+        db.session.commit()
+        document_writes.inc()
+        return response
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Failed to update document'}), 500
@@ -222,48 +1269,123 @@ def update_document(address, document_url):
 @app.route('/api/sessions/<address>/documents/<document_url>', methods=['DELETE'])
 @limiter.limit("60 per minute")
 def delete_document(address, document_url):
-    session = Session.query.filter_by(address=address).first()
-    if not session:
+    session_id, document = get_session_document(address, document_url)
+    if session_id is None:
         return jsonify({'error': 'Session not found'}), 404
     
-    document = Document.query.filter_by(session_id=session.id, document_url=document_url).first()
     if not document:
         return jsonify({'error': 'Document not found'}), 404
     
+    released = [document.content_hash]
     try:
         db.session.delete(document)
+        db.session.execute(documents_changed([session_id]))
         db.session.commit()
-        return jsonify({
-            'data': {
-                'message': 'Document deleted successfully'
-            }
-        })
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Failed to delete document'}), 500
+    
+    release_blobs(released)
+    return jsonify({
+        'data': {
+            'message': 'Document deleted successfully'
+        }
+    })
 
 @app.route('/api/sessions/<address>', methods=['DELETE'])
 @limiter.limit("60 per minute")
 def end_session(address):
-    session = Session.query.filter_by(address=address).first()
-    if not session:
+    session_id = db.session.query(Session.id).filter_by(address=address).scalar()
+    if session_id is None:
         return jsonify({'error': 'Session not found'}), 404
     
     try:
-        # Delete all documents first due to foreign key constraint
-        Document.query.filter_by(session_id=session.id).delete()
-        # Then delete the session
-        db.session.delete(session)
+        # Delete all documents first due to foreign key constraint, noting the
+        # blobs they referenced
+        released = db.session.execute(
+            delete(Document).where(Document.session_id == session_id).returning(Document.content_hash)
+        ).scalars().all()
+        # Then the session, with a Core DELETE; db.session.delete() would
+        # lazy-load Session.documents first
+        Session.query.filter_by(id=session_id).delete()
         db.session.commit()
-        
-        return jsonify({
-            'data': {
-                'message': 'Session ended successfully'
-            }
-        })
+        session_cache.pop(address)
+        touch_buffer.discard(session_id)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Failed to end session'}), 500
+    
+    release_blobs(released)
+    return jsonify({
+        'data': {
+            'message': 'Session ended successfully'
+        }
+    })
+
+# CLI commands, next to Flask-Migrate's `flask db`
+@app.cli.command('import-documents')
+@click.argument('address')
+@click.argument('source', type=click.File('rb'), default='-')
+@click.option('--batch-size', type=int, default=None, help='Documents per COPY batch.')
+@click.option('--create-session', is_flag=True, help='Create the session if it does not exist.')
+def import_documents_command(address, source, batch_size, create_session):
+    """Bulk-load NDJSON documents from SOURCE (default stdin) into a session."""
+    session_id = db.session.query(Session.id).filter_by(address=address).scalar()
+    if session_id is None:
+        if not create_session:
+            raise click.ClickException(f'Session {address} not found')
+        session = Session(address=address)
+        db.session.add(session)
+        db.session.flush()
+        session_id = session.id
+    
+    try:
+        stats = import_lines(session_id, source,
+                             batch_size or app.config['IMPORT_BATCH_SIZE'], app.config['IMPORT_BATCH_BYTES'])
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+    click.echo(f'Imported {stats.rows} documents ({stats.bytes / 1e6:.1f} MB) in {stats.seconds:.2f}s: '
+               f'{stats.rows_per_second:.0f} rows/s, {stats.megabytes_per_second:.1f} MB/s')
+
+@app.cli.command('sweep-sessions')
+@click.option('--max-age', type=int, default=None, help='Seconds since last access (default SESSION_MAX_AGE).')
+@click.option('--batch-size', type=int, default=None, help='Sessions deleted per transaction.')
+def sweep_sessions_command(max_age, batch_size):
+    """Delete expired sessions and their documents."""
+    result = SessionSweeper(
+        app, db, Session, Document,
+        max_age=app.config['SESSION_MAX_AGE'] if max_age is None else max_age,
+        batch_size=batch_size or app.config['SESSION_SWEEP_BATCH_SIZE'],
+        on_released=release_blobs
+    ).sweep()
+    click.echo(f'Reclaimed {result.sessions} sessions and {result.documents} documents '
+               f'in {result.batches} batches ({result.seconds:.2f}s)')
+
+@app.cli.command('collect-blobs')
+def collect_blobs_command():
+    """Delete the blob store's files that no document references."""
+    if not blob_store.enabled:
+        raise click.ClickException('BLOB_STORE_PATH is not set')
+    with db.engine.connect() as connection:
+        removed = blob_store.sweep(connection, Document.content_hash)
+    click.echo(f'Deleted {removed} unreferenced blobs')
+
+@app.cli.command('limiter-server')
+@click.option('--unix', 'path', default='/tmp/securenotes-limiter.sock', help='Unix socket to listen on.')
+@click.option('--port', type=int, default=None, help='Listen on this TCP port instead.')
+@click.option('--max-keys', type=int, default=100000, help='Counters kept before evicting.')
+def limiter_server_command(path, port, max_keys):
+    """Serve rate limit counters to every worker on this host."""
+    server = CounterServer(('localhost', port) if port else path, max_keys=max_keys).start()
+    click.echo(f'Serving rate limit counters on {server.address}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
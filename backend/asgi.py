@@ -0,0 +1,765 @@
+"""ASGI serving mode: the API's routes on async SQLAlchemy and asyncpg.
+
+Serves the same routes and JSON contracts as api.py from an event loop, so a
+worker keeps many requests in flight while they wait on Postgres instead of
+holding a thread each:
+
+    cd backend
+    uvicorn asgi:app --workers 4
+
+Models, configuration, the session cache, touch buffer, sweeper and rate
+limit counters are shared with api.py, as are the request checks, the
+listing, batch and PATCH queries, conditional GET validators and response
+bodies; only the I/O around them is written again here. The database is the
+Flask app's, reached through asyncpg. Export and import stream through the
+sync engine in a worker thread, reusing export_lines() and import_lines().
+
+Autosave coalescing (autosave.py), read replicas, /metrics and compression
+(compress.py, left to the proxy here) are Flask-only: the app refuses to
+start with any of them configured rather than silently going without.
+"""
+import functools
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import anyio.from_thread
+from limits import parse
+from sqlalchemy import and_, delete, func, select
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import defer, load_only
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse as BaseJSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.http import parse_date, parse_etags
+
+from api import (app as flask_app, blob_store, db, limiter, session_cache, sweeper, touch_buffer,
+                 Session, Document, DocumentChunk)
+from api import (DOCUMENT_ATTRIBUTES, LISTING_PAGE_SIZE, batch_needs_content, batch_query, batch_targets,
+                 chunk_patch_statements, content_digest, content_values, document_content, document_etag,
+                 document_patch_error, document_update_error, document_writes, document_writes_skipped,
+                 documents_changed, export_lines, import_lines, keyset_page, listing_items, listing_params,
+                 listing_query, listing_validators, new_document_error, plan_batch, rate_limit_error,
+                 release_blobs, validator_headers, validators_match)
+from compress import DEFAULTS as COMPRESS_DEFAULTS
+from database import configure_engine, engine_options
+from serialize import chunked_document_data, document_data, document_frame, dumps, loads, session_data
+
+
+class JSONResponse(BaseJSONResponse):
+    def render(self, content):
+        return dumps(content)
+
+
+class JSONError(Exception):
+    def __init__(self, status_code, error):
+        super().__init__(error)
+        self.status_code = status_code
+        self.error = error
+
+
+def error(status_code, message):
+    return JSONResponse({'error': message}, status_code=status_code)
+
+
+async def get_json(request):
+    """The body parsed as JSON, like Flask's request.get_json()."""
+    content_type = request.headers.get('content-type', '').split(';')[0].strip()
+    if content_type != 'application/json' and not content_type.endswith('+json'):
+        raise JSONError(415, 'Content-Type must be application/json')
+    try:
+        return loads(await request.body())
+    except ValueError:
+        raise JSONError(400, 'Invalid JSON')
+
+
+def remote_address(request):
+    return request.client.host if request.client else '127.0.0.1'
+
+
+def rate_limited(limit_value):
+    """Count requests against Flask-Limiter's storage under the same keys it
+    uses, and handle errors as api.py does."""
+    item = parse(limit_value)
+
+    def decorator(view):
+        endpoint = view.__name__
+
+        @functools.wraps(view)
+        async def wrapper(request):
+            # Storage calls can be network round trips (resp://), so they're
+            # made from the thread pool rather than on the event loop
+            keys = (remote_address(request), endpoint)
+            if limiter.enabled and not await run_in_threadpool(limiter.limiter.hit, item, *keys):
+                window = await run_in_threadpool(limiter.limiter.get_window_stats, item, *keys)
+                # Flask-Limiter's reset time for the window
+                body, headers = rate_limit_error(item, window[0] + 1)
+                return JSONResponse(body, status_code=429, headers=headers)
+            try:
+                response = await view(request, **request.path_params)
+            except JSONError as e:
+                return error(e.status_code, e.error)
+            except PoolTimeoutError:
+                response = error(503, 'Database busy')
+                response.headers['Retry-After'] = '1'
+                return response
+            return response
+        return wrapper
+    return decorator
+
+
+def unsupported_options(config):
+    """The options set in ``config`` that the Flask app acts on and this mode
+    would silently ignore."""
+    options = []
+    if config['AUTOSAVE_COALESCE_WINDOW'] is not None:
+        options.append('AUTOSAVE_COALESCE_WINDOW')
+    if config['DATABASE_REPLICA_URLS']:
+        options.append('DATABASE_REPLICA_URLS')
+    if config['METRICS_ENABLED']:
+        options.append('METRICS_ENABLED')
+    options.extend(name for name, default in COMPRESS_DEFAULTS.items() if config[name] != default)
+    return options
+
+
+def async_url(url):
+    """The Flask app's database URL with the asyncpg driver."""
+    return url.set(drivername='postgresql+asyncpg')
+
+
+@asynccontextmanager
+async def lifespan(app):
+    options = unsupported_options(flask_app.config)
+    if options:
+        raise RuntimeError(f'Not supported in async mode: {", ".join(options)}; serve api:app instead')
+    with flask_app.app_context():
+        sync_engine = db.engine
+    # A fixed pool by default: overflow connections are closed on checkin, and a
+    # burst would keep reconnecting (asyncpg also re-introspects types per connection)
+    engine = create_async_engine(async_url(sync_engine.url),
+                                 **engine_options(asynchronous=True, pool_size=10, max_overflow=0))
+    configure_engine(engine.sync_engine)
+    # Connect (and let the dialect initialize) before the first request
+    async with engine.connect():
+        pass
+    app.state.sync_engine = sync_engine
+    app.state.sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+    sweeper.start()
+    yield
+    sweeper.stop()
+    await engine.dispose()
+
+
+def database(request):
+    return request.app.state.sessionmaker()
+
+
+# Lookup helpers shared by the document routes, as in api.py
+async def load_chunks(session, document_ids):
+    """Return ``{document_id: [encrypted_chunk, ...]}`` in index order, in one query."""
+    chunks = {}
+    if document_ids:
+        rows = await session.execute(
+            select(DocumentChunk.document_id, DocumentChunk.encrypted_chunk)
+            .where(DocumentChunk.document_id.in_(document_ids))
+            .order_by(DocumentChunk.document_id, DocumentChunk.index)
+        )
+        for document_id, encrypted_chunk in rows:
+            chunks.setdefault(document_id, []).append(encrypted_chunk)
+    return chunks
+
+
+# Blob store files are read, written and collected from worker threads
+async def stored_content(encrypted_content):
+    """content_values() for ``encrypted_content``."""
+    if blob_store.stores(len(encrypted_content)):
+        return await run_in_threadpool(content_values, encrypted_content)
+    return content_values(encrypted_content)
+
+
+async def read_content(document):
+    """A single-blob document's ciphertext, wherever it's stored."""
+    if document.content_hash is None:
+        return document.encrypted_content
+    return await run_in_threadpool(document_content, document)
+
+
+async def release(content_hashes):
+    """release_blobs() for the hashes of deleted or rewritten documents."""
+    if any(content_hash is not None for content_hash in content_hashes):
+        await run_in_threadpool(release_blobs, content_hashes)
+
+
+async def store_content(session, document, encrypted_content=None, encrypted_chunks=None):
+    """Replace a document's content with a single blob or a list of chunks.
+
+    Returns the hash of the blob the document stored before, if any.
+    """
+    replaced = document.content_hash
+    if document.id is not None and document.chunk_count is not None:
+        await session.execute(delete(DocumentChunk).where(DocumentChunk.document_id == document.id))
+    if encrypted_chunks is None:
+        for name, value in (await stored_content(encrypted_content)).items():
+            setattr(document, name, value)
+        document.chunk_count = None
+        return replaced
+
+    document.encrypted_content = ''
+    document.content_hash = document.content_length = None
+    document.chunk_count = len(encrypted_chunks)
+    chunks = [DocumentChunk(index=index, encrypted_chunk=chunk)
+              for index, chunk in enumerate(encrypted_chunks)]
+    if document.id is None:
+        document.chunks = chunks
+    else:
+        for chunk in chunks:
+            chunk.document_id = document.id
+        session.add_all(chunks)
+    return replaced
+
+
+async def get_session_id(session, address):
+    """Return the id of the session at ``address``, or None if it doesn't exist."""
+    session_id = session_cache.get(address)
+    if session_id is None:
+        session_id = await session.scalar(select(Session.id).where(Session.address == address))
+        if session_id is not None:
+            session_cache.set(address, session_id)
+    return session_id
+
+
+async def get_session_document(session, address, document_url, *options):
+    """Resolve a session and one of its documents in a single query; see api.py."""
+    session_id = session_cache.get(address)
+    if session_id is not None:
+        document = await session.scalar(
+            select(Document).options(*options)
+            .where(Document.session_id == session_id, Document.document_url == document_url)
+            .limit(1)
+        )
+        return session_id, document
+
+    row = (await session.execute(
+        select(Session.id, Document)
+        .options(*options)
+        .outerjoin(Document, and_(Document.session_id == Session.id,
+                                  Document.document_url == document_url))
+        .where(Session.address == address)
+        .limit(1)
+    )).first()
+    if row is None:
+        return None, None
+    session_cache.set(address, row[0])
+    return row[0], row[1]
+
+
+async def listing_marker(session, session_id):
+    row = (await session.execute(
+        select(Session.documents_changed_at).where(Session.id == session_id)
+    )).first()
+    return None if row is None else tuple(row)
+
+
+# Conditional GET helpers
+def not_modified(request, etag, last_modified=None):
+    """Return a 304 response if the request's validators still match, else None."""
+    if not validators_match(etag, last_modified, parse_etags(request.headers.get('if-none-match')),
+                            parse_date(request.headers.get('if-modified-since'))):
+        return None
+    return with_validators(Response(status_code=304), etag, last_modified)
+
+
+def with_validators(response, etag, last_modified=None):
+    response.headers.update(validator_headers(etag, last_modified))
+    return response
+
+
+# Session routes
+@rate_limited("5 per minute")
+async def create_session(request):
+    data = await get_json(request)
+    address = data.get('address')
+
+    if not address:
+        return error(400, 'Address is required')
+
+    async with database(request) as session:
+        record = Session(address=address)
+        session.add(record)
+        try:
+            await session.flush()
+            response = JSONResponse({'data': session_data(record.address, record.created_at, record.last_accessed)})
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            return error(500, 'Failed to create session')
+    return response
+
+
+@rate_limited("60 per minute")
+async def validate_session(request, address):
+    async with database(request) as session:
+        record = await session.scalar(select(Session).where(Session.address == address).limit(1))
+    if not record:
+        return error(404, 'Session not found')
+    session_cache.set(address, record.id)
+
+    # Buffered; written by touch_buffer in batches rather than per request
+    last_accessed = touch_buffer.touch(record.id, record.last_accessed)
+
+    return JSONResponse({'data': session_data(record.address, record.created_at, last_accessed)})
+
+
+# Document routes
+@rate_limited("60 per minute")
+async def get_documents(request, address):
+    async with database(request) as session:
+        session_id = await get_session_id(session, address)
+        if session_id is None:
+            return error(404, 'Session not found')
+
+        try:
+            page, fields, cursor, position = listing_params(request.query_params)
+        except ValueError as e:
+            return error(400, str(e))
+
+        marker = await listing_marker(session, session_id)
+        if marker is None:
+            session_cache.pop(address)
+            return error(404, 'Session not found')
+        etag, changed_at = listing_validators(marker, fields, page, cursor)
+        response = not_modified(request, etag, changed_at)
+        if response:
+            return response
+
+        if cursor is None:
+            # Same contract as Flask-SQLAlchemy's paginate()
+            if page < 1:
+                return error(404, 'Not Found')
+            total = await session.scalar(
+                select(func.count()).select_from(Document).where(Document.session_id == session_id))
+            rows = (await session.scalars(
+                listing_query(session_id, fields).limit(LISTING_PAGE_SIZE).offset((page - 1) * LISTING_PAGE_SIZE)
+            )).all()
+            if not rows and page != 1:
+                return error(404, 'Not Found')
+            pages = -(-total // LISTING_PAGE_SIZE)
+        else:
+            rows, next_cursor = keyset_page((await session.scalars(
+                listing_query(session_id, fields, keyset=True, position=position))).all())
+
+        contents, chunks = {}, {}
+        if fields == 'all':
+            chunks = await load_chunks(session, [doc.id for doc in rows if doc.chunk_count is not None])
+
+    if fields == 'all':
+        contents = {doc.id: await read_content(doc) for doc in rows if doc.chunk_count is None}
+    items = listing_items(rows, fields, contents, chunks)
+
+    if cursor is not None:
+        return with_validators(JSONResponse({
+            'data': {
+                'documents': items,
+                'nextCursor': next_cursor
+            }
+        }), etag, changed_at)
+    return with_validators(JSONResponse({
+        'data': {
+            'documents': items,
+            'total': total,
+            'pages': pages,
+            'currentPage': page
+        }
+    }), etag, changed_at)
+
+
+@rate_limited("5 per minute")
+async def export_session(request, address):
+    async with database(request) as session:
+        session_id = await get_session_id(session, address)
+    if session_id is None:
+        return error(404, 'Session not found')
+
+    # A sync generator; Starlette iterates it in a worker thread
+    lines = export_lines(request.app.state.sync_engine, session_id, flask_app.config['EXPORT_YIELD_PER'])
+    return StreamingResponse(lines, media_type='application/x-ndjson',
+                             headers={'Content-Disposition': 'attachment; filename="session.ndjson"'})
+
+
+class LineReader:
+    """Split the request body stream into lines for a worker thread."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = b''
+        self.done = False
+
+    async def readline(self):
+        while b'\n' not in self.buffer and not self.done:
+            try:
+                self.buffer += await self.stream.__anext__()
+            except StopAsyncIteration:
+                self.done = True
+        line, newline, self.buffer = self.buffer.partition(b'\n')
+        return line + newline
+
+    def __iter__(self):
+        while True:
+            line = anyio.from_thread.run(self.readline)
+            if not line:
+                return
+            yield line
+
+
+@rate_limited("5 per minute")
+async def import_session(request, address):
+    """Bulk-load an NDJSON body through import_lines() and COPY, in a worker thread."""
+    async with database(request) as session:
+        session_id = await get_session_id(session, address)
+    if session_id is None:
+        return error(404, 'Session not found')
+
+    lines = LineReader(request.stream())
+
+    def run():
+        with flask_app.app_context():
+            try:
+                stats = import_lines(session_id, lines,
+                                     flask_app.config['IMPORT_BATCH_SIZE'], flask_app.config['IMPORT_BATCH_BYTES'])
+                db.session.commit()
+            except ValueError as e:
+                db.session.rollback()
+                return error(400, str(e))
+            except IntegrityError:
+                db.session.rollback()
+                session_cache.pop(address)
+                return error(404, 'Session not found')
+            except Exception as e:
+                db.session.rollback()
+                return error(500, 'Failed to import documents')
+            return JSONResponse({'data': stats.as_dict()})
+
+    return await run_in_threadpool(run)
+
+
+@rate_limited("60 per minute")
+async def create_document(request, address):
+    async with database(request) as session:
+        session_id = await get_session_id(session, address)
+        if session_id is None:
+            return error(404, 'Session not found')
+
+        data = await get_json(request)
+        message = new_document_error(data)
+        if message:
+            return error(400, message)
+        encrypted_content = data.get('encryptedContent')
+        encrypted_chunks = data.get('encryptedChunks')
+
+        document = Document(
+            document_url=str(uuid.uuid4()),
+            encrypted_title=data['encryptedTitle'],
+            content_digest=content_digest(data['encryptedTitle'], encrypted_content, encrypted_chunks),
+            session_id=session_id
+        )
+        await store_content(session, document, encrypted_content, encrypted_chunks)
+
+        try:
+            session.add(document)
+            await session.flush()
+            response = JSONResponse({
+                'data': document_data(document.document_url, data['encryptedTitle'], document.created_at,
+                                      document.last_modified, encrypted_content, encrypted_chunks)
+            })
+            await session.execute(documents_changed([session_id]))
+            await session.commit()
+            return response
+        except IntegrityError:
+            # The cached session may have been ended by another worker
+            await session.rollback()
+            session_cache.pop(address)
+            return error(404, 'Session not found')
+        except Exception as e:
+            await session.rollback()
+            return error(500, 'Failed to create document')
+
+
+@rate_limited("60 per minute")
+async def batch_documents(request, address):
+    """Apply many document operations with one session lookup and one commit; see api.py."""
+    async with database(request) as session:
+        session_id = await get_session_id(session, address)
+        if session_id is None:
+            return error(404, 'Session not found')
+
+        data = await get_json(request)
+        operations = data.get('operations') if isinstance(data, dict) else None
+        if not isinstance(operations, list) or not operations:
+            return error(400, 'No operations provided')
+        if len(operations) > flask_app.config['BATCH_MAX_OPERATIONS']:
+            return error(400, 'Too many operations')
+
+        results, targets = batch_targets(operations)
+        needs_content = batch_needs_content(targets)
+        documents = {}
+        if targets:
+            documents = {document.document_url: document
+                         for document in await session.scalars(batch_query(session_id, targets, needs_content))}
+        chunks = await load_chunks(session, [document.id for document_url, document in documents.items()
+                                             if document_url in needs_content and document.chunk_count is not None])
+        # The blob store is read and written from a worker thread
+        writes = await run_in_threadpool(plan_batch, operations, results, documents, chunks, session_id)
+
+        try:
+            for statement, parameters in writes.statements(session_id):
+                await session.execute(statement, parameters)
+            await session.commit()
+        except IntegrityError:
+            # The cached session may have been ended by another worker
+            await session.rollback()
+            session_cache.pop(address)
+            return error(404, 'Session not found')
+        except Exception as e:
+            await session.rollback()
+            return error(500, 'Failed to apply batch')
+
+    await release(writes.released)
+    document_writes.inc(len(writes.updates))
+    document_writes_skipped.inc(writes.skipped)
+    return JSONResponse({
+        'data': {
+            'results': results
+        }
+    })
+
+
+@rate_limited("60 per minute")
+async def get_document(request, address, document_url):
+    # Revalidation only needs the validators, not the ciphertext
+    conditional = bool(request.headers.get('if-none-match') or request.headers.get('if-modified-since'))
+    options = [load_only(Document.id, Document.last_modified)] if conditional else []
+    async with database(request) as session:
+        session_id, document = await get_session_document(session, address, document_url, *options)
+        if session_id is None:
+            return error(404, 'Session not found')
+
+        if not document:
+            return error(404, 'Document not found')
+
+        etag = document_etag(document)
+        if conditional:
+            response = not_modified(request, etag, document.last_modified)
+            if response:
+                return response
+            await session.refresh(document, DOCUMENT_ATTRIBUTES)
+
+        if document.content_hash is not None:
+            # Sent from the mapped blob around the rest of the JSON, never decoded
+            head, tail = document_frame(document.document_url, document.encrypted_title, document.created_at,
+                                        document.last_modified, wrap=True)
+            body = await run_in_threadpool(blob_store.stream, document.content_hash, head, tail, True)
+            return with_validators(StreamingResponse(body, media_type='application/json', headers={
+                'Content-Length': str(len(head) + document.content_length + len(tail))
+            }), etag, document.last_modified)
+
+        encrypted_chunks = None
+        if document.chunk_count is not None:
+            encrypted_chunks = (await load_chunks(session, [document.id])).get(document.id, [])
+
+    return with_validators(JSONResponse({
+        'data': document_data(document.document_url, document.encrypted_title, document.created_at,
+                              document.last_modified, document.encrypted_content, encrypted_chunks)
+    }), etag, document.last_modified)
+
+
+@rate_limited("60 per minute")
+async def update_document(request, address, document_url):
+    data = await get_json(request)
+    replaces_content = isinstance(data, dict) and ('encryptedContent' in data or 'encryptedChunks' in data)
+    # A full replacement is compared by digest, without reading the stored ciphertext
+    options = []
+    if replaces_content and 'encryptedTitle' in data:
+        options = [defer(Document.encrypted_content), defer(Document.encrypted_title)]
+    async with database(request) as session:
+        session_id, document = await get_session_document(session, address, document_url, *options)
+        if session_id is None:
+            return error(404, 'Session not found')
+
+        if not document:
+            return error(404, 'Document not found')
+
+        message = document_update_error(data)
+        if message:
+            return error(400, message)
+
+        encrypted_title = data['encryptedTitle'] if 'encryptedTitle' in data else document.encrypted_title
+        encrypted_content = encrypted_chunks = None
+        if 'encryptedChunks' in data:
+            encrypted_chunks = data['encryptedChunks']
+        elif 'encryptedContent' in data:
+            encrypted_content = data['encryptedContent']
+        elif document.chunk_count is not None:
+            encrypted_chunks = (await load_chunks(session, [document.id])).get(document.id, [])
+        else:
+            encrypted_content = await read_content(document)
+        digest = content_digest(encrypted_title, encrypted_content, encrypted_chunks)
+
+        def representation():
+            return JSONResponse({
+                'data': document_data(document.document_url, encrypted_title, document.created_at,
+                                      document.last_modified, encrypted_content, encrypted_chunks)
+            })
+
+        if digest == document.content_digest:
+            # Autosave re-sent what is already stored; skip the UPDATE entirely
+            document_writes_skipped.inc()
+            return representation()
+
+        released = []
+        if replaces_content:
+            replaced = await store_content(session, document, encrypted_content, encrypted_chunks)
+            if replaced != document.content_hash:
+                released.append(replaced)
+        if 'encryptedTitle' in data:
+            document.encrypted_title = encrypted_title
+        document.content_digest = digest
+        document.last_modified = datetime.utcnow()
+
+        try:
+            await session.flush()
+            response = representation()
+            await session.execute(documents_changed([session_id]))
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            return error(500, 'Failed to update document')
+
+    await release(released)
+    document_writes.inc()
+    return response
+
+
+@rate_limited("60 per minute")
+async def patch_document(request, address, document_url):
+    """Replace some chunks of a chunked document, optionally resizing it; see api.py."""
+    async with database(request) as session:
+        session_id, document = await get_session_document(
+            session, address, document_url,
+            defer(Document.encrypted_content), defer(Document.encrypted_title)
+        )
+        if session_id is None:
+            return error(404, 'Session not found')
+
+        if not document:
+            return error(404, 'Document not found')
+
+        data = await get_json(request)
+        message = document_patch_error(data, document.chunk_count)
+        if message:
+            return error(400, message)
+        chunk_count = data.get('chunkCount', document.chunk_count)
+        chunks = data.get('chunks', [])
+
+        try:
+            for statement in chunk_patch_statements(document.id, chunks, chunk_count, document.chunk_count):
+                await session.execute(statement)
+            document.chunk_count = chunk_count
+            if 'encryptedTitle' in data:
+                document.encrypted_title = data['encryptedTitle']
+            # Recomputing the digest would mean reading every chunk back
+            document.content_digest = None
+            document.last_modified = datetime.utcnow()
+
+            await session.flush()
+            response = JSONResponse({
+                'data': chunked_document_data(document.document_url, document.chunk_count, document.created_at,
+                                              document.last_modified)
+            })
+            await session.execute(documents_changed([session_id]))
+            await session.commit()
+            document_writes.inc()
+            return response
+        except Exception as e:
+            await session.rollback()
+            return error(500, 'Failed to update document')
+
+
+@rate_limited("60 per minute")
+async def delete_document(request, address, document_url):
+    async with database(request) as session:
+        session_id, document = await get_session_document(session, address, document_url)
+        if session_id is None:
+            return error(404, 'Session not found')
+
+        if not document:
+            return error(404, 'Document not found')
+
+        released = [document.content_hash]
+        try:
+            await session.delete(document)
+            await session.execute(documents_changed([session_id]))
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            return error(500, 'Failed to delete document')
+
+    await release(released)
+    return JSONResponse({
+        'data': {
+            'message': 'Document deleted successfully'
+        }
+    })
+
+
+@rate_limited("60 per minute")
+async def end_session(request, address):
+    async with database(request) as session:
+        session_id = await session.scalar(select(Session.id).where(Session.address == address))
+        if session_id is None:
+            return error(404, 'Session not found')
+
+        try:
+            released = (await session.execute(
+                delete(Document).where(Document.session_id == session_id).returning(Document.content_hash)
+            )).scalars().all()
+            # A Core DELETE; the ORM would lazy-load Session.documents first
+            await session.execute(delete(Session).where(Session.id == session_id))
+            await session.commit()
+            session_cache.pop(address)
+            touch_buffer.discard(session_id)
+        except Exception as e:
+            await session.rollback()
+            return error(500, 'Failed to end session')
+
+    await release(released)
+    return JSONResponse({
+        'data': {
+            'message': 'Session ended successfully'
+        }
+    })
+
+
+routes = [
+    Route('/api/sessions', create_session, methods=['POST']),
+    Route('/api/sessions/{address}', validate_session, methods=['GET']),
+    Route('/api/sessions/{address}', end_session, methods=['DELETE']),
+    Route('/api/sessions/{address}/documents', get_documents, methods=['GET']),
+    Route('/api/sessions/{address}/documents', create_document, methods=['POST']),
+    Route('/api/sessions/{address}/export', export_session, methods=['GET']),
+    Route('/api/sessions/{address}/import', import_session, methods=['POST']),
+    Route('/api/sessions/{address}/documents/batch', batch_documents, methods=['POST']),
+    Route('/api/sessions/{address}/documents/{document_url}', get_document, methods=['GET']),
+    Route('/api/sessions/{address}/documents/{document_url}', update_document, methods=['PUT']),
+    Route('/api/sessions/{address}/documents/{document_url}', patch_document, methods=['PATCH']),
+    Route('/api/sessions/{address}/documents/{document_url}', delete_document, methods=['DELETE']),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
@@ -0,0 +1,206 @@
+import atexit
+import logging
+import threading
+import time
+
+from sqlalchemy import column, update, values
+
+from metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+autosaves_received = Counter('autosaves_received_total', 'Document saves acknowledged by the autosave coalescer')
+autosaves_written = Counter('autosaves_written_total', 'Coalesced document saves written to the database')
+autosaves_superseded = Counter('autosaves_superseded_total',
+                               'Coalesced document saves dropped because the row had a newer write')
+writes_saved_ratio = Gauge('autosave_writes_saved_ratio', 'Share of coalesced saves that never needed a write',
+                           function=lambda: 1 - autosaves_written.value / autosaves_received.value
+                           if autosaves_received.value else 0)
+
+
+class AutosaveCoalescer:
+    """Write-behind buffer for the editor's autosave PUTs.
+
+    ``save()`` acknowledges a document save in memory; further saves of the
+    same document replace it. A background thread writes each document's
+    latest save once it has been pending for ``window`` seconds, so a save
+    waits at most ``window`` plus ``window / 2`` (the thread's interval), as
+    one ``UPDATE`` for every due document. Pending saves are also written on
+    ``flush()``, which routes call before reading a session, and when the
+    process exits. Only the worker that acknowledged a save holds it: until
+    it's written, other workers read the row as it was, so a reader routed to
+    another worker can miss a save for up to the window.
+
+    ``on_write(session_ids)`` returns a statement to run in the same
+    transaction as a write, given the sessions of the rows it changed; the
+    app uses it to move their listing markers.
+
+    ``flush()`` of an address waits only for writes of that address, and
+    returns at once when it has nothing pending or being written. After
+    writing saves of an address it calls ``on_flush(address)``; the app uses
+    it to keep the address' reads on the primary, since the write may come
+    well after the request that made the save.
+
+    A write only replaces a row last modified before the save, so a delayed
+    save never overwrites a newer one written by another worker.
+    ``window=None`` turns coalescing off.
+    """
+
+    def __init__(self, app, db, model, window=None, on_write=None, on_flush=None):
+        self.app = app
+        self.db = db
+        self.table = model.__table__
+        self.window = window
+        self.on_write = on_write
+        self.on_flush = on_flush
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Address -> number of flushes writing its saves, so a flush() of an
+        # address returns only once earlier writes of it are visible
+        self._writing = {}
+        self._written = threading.Condition(self._lock)
+        self._stopped = threading.Event()
+        self._thread = None
+        atexit.register(self.stop)
+
+    @property
+    def enabled(self):
+        return self.window is not None
+
+    def save(self, address, document_url, document_id, encrypted_title, encrypted_content, digest, saved_at):
+        """Acknowledge a save of the whole document; it's written within the window."""
+        with self._lock:
+            documents = self._pending.setdefault(address, {})
+            first_saved = documents[document_url]['first_saved'] if document_url in documents else time.monotonic()
+            documents[document_url] = {
+                'document_id': document_id,
+                'encrypted_title': encrypted_title,
+                'encrypted_content': encrypted_content,
+                'content_digest': digest,
+                'last_modified': saved_at,
+                'first_saved': first_saved
+            }
+        autosaves_received.inc()
+        self._start()
+
+    def pending(self, address, document_url):
+        """The save of ``document_url`` waiting to be written, if any."""
+        with self._lock:
+            return self._pending.get(address, {}).get(document_url)
+
+    def flush(self, address=None, due_only=False):
+        """Write the pending saves of ``address`` (or every address); with
+        ``due_only``, only those pending for the whole window. Returns the
+        number of documents written, leaving out saves a newer write of the
+        row superseded."""
+        with self._lock:
+            if address is not None and address not in self._pending and address not in self._writing:
+                return 0
+            taken = self._take(address, due_only)
+            addresses = {taken_address for taken_address, _, _ in taken}
+            for taken_address in addresses:
+                self._writing[taken_address] = self._writing.get(taken_address, 0) + 1
+
+        written = 0
+        try:
+            if taken:
+                written = self._write(taken)
+                autosaves_written.inc(written)
+                autosaves_superseded.inc(len(taken) - written)
+            if self.on_flush is not None:
+                # Before the flush counts as done, so waiting flushes return after it
+                for taken_address in addresses:
+                    self.on_flush(taken_address)
+        except Exception:
+            # Keep the saves for the next attempt unless newer ones arrived
+            with self._lock:
+                for taken_address, document_url, save in taken:
+                    self._pending.setdefault(taken_address, {}).setdefault(document_url, save)
+            raise
+        finally:
+            with self._lock:
+                for taken_address in addresses:
+                    self._writing[taken_address] -= 1
+                    if not self._writing[taken_address]:
+                        del self._writing[taken_address]
+                self._written.notify_all()
+                if address is not None:
+                    self._written.wait_for(lambda: address not in self._writing)
+
+        return written
+
+    def stop(self):
+        """Stop the background thread and write whatever is still pending."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _take(self, address, due_only):
+        addresses = list(self._pending) if address is None else [address]
+        due = time.monotonic() - self.window if due_only else None
+        taken = []
+        for address in addresses:
+            documents = self._pending.get(address, {})
+            for document_url, save in list(documents.items()):
+                if due is None or save['first_saved'] <= due:
+                    taken.append((address, document_url, documents.pop(document_url)))
+            if not documents:
+                self._pending.pop(address, None)
+        return taken
+
+    def _write(self, taken):
+        """Write ``taken`` in one transaction; returns the number of rows changed."""
+        with self.app.app_context(), self.db.engine.begin() as connection:
+            written = connection.execute(self._update(taken)).all()
+            if written and self.on_write is not None:
+                # Sorted, so concurrent flushes lock the sessions in the same order
+                connection.execute(self.on_write(sorted({session_id for _, session_id in written})))
+        return len(written)
+
+    def _update(self, taken):
+        # One UPDATE ... FROM (VALUES ...) rather than an executemany, whose
+        # rowcount the driver can't report, so RETURNING tells which rows the
+        # last_modified guard let through
+        table = self.table
+        saves = values(
+            column('id', table.c.id.type),
+            column('encrypted_title', table.c.encrypted_title.type),
+            column('encrypted_content', table.c.encrypted_content.type),
+            column('content_digest', table.c.content_digest.type),
+            column('last_modified', table.c.last_modified.type),
+            name='saves'
+        ).data([
+            (save['document_id'], save['encrypted_title'], save['encrypted_content'], save['content_digest'],
+             save['last_modified'])
+            for _, _, save in taken
+        ])
+        return update(table)\
+            .where(table.c.id == saves.c.id)\
+            .where(table.c.last_modified < saves.c.last_modified)\
+            .values(encrypted_title=saves.c.encrypted_title,
+                    encrypted_content=saves.c.encrypted_content,
+                    content_digest=saves.c.content_digest,
+                    last_modified=saves.c.last_modified,
+                    # Coalesced saves are small enough to be stored inline
+                    content_hash=None,
+                    content_length=None)\
+            .returning(table.c.id, table.c.session_id)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='autosave-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.window / 2):
+            try:
+                self.flush(due_only=True)
+            except Exception:
+                logger.exception('Failed to write coalesced autosaves')
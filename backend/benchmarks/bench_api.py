@@ -0,0 +1,258 @@
+"""Replay realistic traffic against the Flask app and record the results.
+
+Seeds ``--sessions`` sessions of ``--documents`` documents, whose ciphertext
+sizes cycle through ``--sizes``, plus ``--large-sessions`` sessions of
+``--large-documents`` documents to end. Then it runs each scenario on
+``--concurrency`` threads, each with its own test client:
+
+    autosave     PUT update_document repeatedly on a few documents; every
+                 other save resends unchanged content, as editors do
+    polling      GET get_documents?fields=metadata, revalidating with the
+                 last ETag the way the sidebar does
+    validate     GET validate_session in bursts across all sessions
+    end-session  DELETE end_session on the large sessions
+
+For each scenario it reports throughput, p50/p95/p99 latency and SQL
+statements per request. ``--output`` saves the results as JSON, and
+``--baseline`` compares a run with results saved earlier, e.g. on another
+commit:
+
+    cd backend
+    python -m benchmarks.bench_api --output before.json
+    git checkout my-branch
+    python -m benchmarks.bench_api --baseline before.json --output after.json
+"""
+import argparse
+import base64
+import json
+import math
+import os
+import statistics
+import subprocess
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from sqlalchemy import event, insert
+from sqlalchemy.engine import Engine
+
+from api import app, content_digest, db, limiter, Document, Session
+
+PREFIX = 'bench-api'
+SCENARIOS = ['autosave', 'polling', 'validate', 'end-session']
+
+counts = threading.local()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    counts.queries = getattr(counts, 'queries', 0) + 1
+
+
+def ciphertext(size):
+    return base64.b64encode(os.urandom(size * 3 // 4)).decode()
+
+
+def seed(address, documents, sizes):
+    """Create a session with ``documents`` documents; returns their urls."""
+    session = Session(address=address)
+    db.session.add(session)
+    db.session.flush()
+    # One ciphertext per size, so seeding large datasets doesn't take longer than the run
+    contents = {size: ciphertext(size) for size in sizes}
+    title = ciphertext(48)
+    rows = []
+    for i in range(documents):
+        content = contents[sizes[i % len(sizes)]]
+        rows.append({
+            'document_url': f'{address}-{i}',
+            'encrypted_title': title,
+            'encrypted_content': content,
+            'content_digest': content_digest(title, content),
+            'session_id': session.id
+        })
+        if len(rows) == 1000:
+            db.session.execute(insert(Document), rows)
+            rows = []
+    if rows:
+        db.session.execute(insert(Document), rows)
+    db.session.commit()
+    return [f'{address}-{i}' for i in range(documents)]
+
+
+def clean_up():
+    session_ids = [id for id, in db.session.query(Session.id).filter(Session.address.startswith(PREFIX))]
+    if session_ids:
+        Document.query.filter(Document.session_id.in_(session_ids)).delete()
+        Session.query.filter(Session.id.in_(session_ids)).delete()
+        db.session.commit()
+
+
+def percentile(timings, p):
+    return timings[max(math.ceil(len(timings) * p / 100) - 1, 0)]
+
+
+def run(requests, concurrency):
+    """Send ``requests``, callables taking a test client and returning a
+    response, from ``concurrency`` threads."""
+    timings, queries, statuses = [], [], Counter()
+    queue = iter(requests)
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        for request in queue:
+            counts.queries = 0
+            began = time.perf_counter()
+            response = request(client)
+            elapsed = time.perf_counter() - began
+            with lock:
+                timings.append(elapsed)
+                queries.append(counts.queries)
+                statuses[response.status_code] += 1
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - began
+
+    timings.sort()
+    return {
+        'requests': len(timings),
+        'throughput': len(timings) / elapsed,
+        'p50_ms': statistics.median(timings) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'queries_per_request': statistics.mean(queries),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())}
+    }
+
+
+def autosave(dataset, args):
+    address, urls = dataset['sessions'][0]
+    urls = urls[:args.autosave_documents]
+    bodies = {url: [{'encryptedTitle': 'title', 'encryptedContent': ciphertext(args.sizes[i % len(args.sizes)])}
+                    for _ in range(2)] for i, url in enumerate(urls)}
+
+    def save(url, body):
+        return lambda client: client.put(f'/api/sessions/{address}/documents/{url}', json=body)
+
+    # Per document: A, A, B, B, A, ... so every other save is unchanged
+    return [save(url, bodies[url][i // len(urls) // 2 % 2])
+            for i, url in ((i, urls[i % len(urls)]) for i in range(args.requests))]
+
+
+def polling(dataset, args):
+    etags = {}
+
+    def poll(address):
+        def request(client):
+            headers = {'If-None-Match': etags[address]} if address in etags else {}
+            response = client.get(f'/api/sessions/{address}/documents?fields=metadata', headers=headers)
+            if response.headers.get('ETag'):
+                etags[address] = response.headers['ETag']
+            return response
+        return request
+
+    sessions = dataset['sessions']
+    return [poll(sessions[i % len(sessions)][0]) for i in range(args.requests)]
+
+
+def validate(dataset, args):
+    sessions = dataset['sessions']
+    return [lambda client, address=sessions[i % len(sessions)][0]: client.get(f'/api/sessions/{address}')
+            for i in range(args.requests)]
+
+
+def end_session(dataset, args):
+    return [lambda client, address=address: client.delete(f'/api/sessions/{address}')
+            for address in dataset['large_sessions']]
+
+
+BUILDERS = {'autosave': autosave, 'polling': polling, 'validate': validate, 'end-session': end_session}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    columns = ['throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request']
+    print(f"{'scenario':<13}{'requests':>9}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}")
+    for name, result in results.items():
+        print(f"{name:<13}{result['requests']:>9}{result['throughput']:>10.1f}{result['p50_ms']:>10.2f}"
+              f"{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['queries_per_request']:>9.2f}")
+        before = (baseline or {}).get(name)
+        if before:
+            changes = ''.join(f'{(result[column] / before[column] - 1) * 100 if before[column] else 0:>+9.1f}%'
+                              for column in columns)
+            print(f"{'  vs baseline':<22}{changes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--documents', type=int, default=50, help='documents per session')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1024, 16 * 1024, 256 * 1024],
+                        help='ciphertext bytes, cycled through the documents')
+    parser.add_argument('--large-sessions', type=int, default=5, help='sessions for end-session')
+    parser.add_argument('--large-documents', type=int, default=5000)
+    parser.add_argument('--autosave-documents', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=1000, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with results saved by --output')
+    args = parser.parse_args()
+
+    limiter.enabled = False
+    with app.app_context():
+        db.create_all()
+        clean_up()
+        try:
+            dataset = {
+                'sessions': [(f'{PREFIX}-{i}', seed(f'{PREFIX}-{i}', args.documents, args.sizes))
+                             for i in range(args.sessions)],
+                'large_sessions': [f'{PREFIX}-large-{i}' for i in range(args.large_sessions)]
+            }
+            for address in dataset['large_sessions']:
+                seed(address, args.large_documents, [min(args.sizes)])
+            db.session.remove()
+
+            results = {}
+            for name in args.scenarios:
+                requests = BUILDERS[name](dataset, args)
+                # A few unmeasured requests first, on a scenario that can repeat them
+                if name != 'end-session':
+                    run(requests[:20], args.concurrency)
+                results[name] = run(requests, args.concurrency)
+        finally:
+            clean_up()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    print(f"{args.sessions} sessions x {args.documents} documents of {args.sizes} bytes, "
+          f"{args.concurrency} clients")
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'date': datetime.now(timezone.utc).isoformat(),
+                'arguments': vars(args),
+                'results': results
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Compare the WSGI and ASGI serving modes under concurrent clients.
+
+Starts each mode in its own process: api.py on a WSGI server with a fixed
+pool of threads (like ``gunicorn --threads``), and asgi.py on uvicorn. Both
+serve one seeded session. Then, at each concurrency level, keeps that many
+requests in flight (single-document reads and listings) and reports the
+throughput and latency percentiles.
+
+    cd backend
+    python -m benchmarks.bench_asgi --requests 2000 --concurrency 1 16 64 --threads 8
+"""
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from api import app, db, limiter, Document, Session
+
+ADDRESS = 'bench-asgi'
+
+
+def serve(mode, port, threads):
+    limiter.enabled = False
+    if mode == 'asgi':
+        import uvicorn
+        from asgi import app as asgi_app
+        uvicorn.run(asgi_app, port=port, log_level='warning')
+        return
+
+    from werkzeug.serving import BaseWSGIServer
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    class PooledWSGIServer(BaseWSGIServer):
+        """Handles each connection on one of ``threads`` worker threads."""
+        executor = ThreadPoolExecutor(threads)
+
+        def process_request(self, request, client_address):
+            self.executor.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    PooledWSGIServer('localhost', port, app).serve_forever()
+
+
+def seed(documents):
+    with app.app_context():
+        session = Session(address=ADDRESS)
+        db.session.add(session)
+        db.session.flush()
+        for i in range(documents):
+            db.session.add(Document(
+                document_url=f'{ADDRESS}-{i}',
+                encrypted_title='title',
+                encrypted_content='content ' * 128,
+                session_id=session.id
+            ))
+        db.session.commit()
+
+
+def clean_up():
+    with app.app_context():
+        db.create_all()
+        session_id = db.session.query(Session.id).filter_by(address=ADDRESS).scalar()
+        if session_id is not None:
+            Document.query.filter_by(session_id=session_id).delete()
+            Session.query.filter_by(id=session_id).delete()
+            db.session.commit()
+
+
+def start(mode, port, threads):
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_asgi',
+                                '--serve', mode, '--port', str(port), '--threads', str(threads)])
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f'http://localhost:{port}/api/sessions/{ADDRESS}', timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+async def run(port, paths, concurrency, count):
+    timings = []
+    queue = iter(range(count))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def worker(client):
+        for i in queue:
+            began = time.perf_counter()
+            response = await client.get(paths[i % len(paths)])
+            timings.append(time.perf_counter() - began)
+            assert response.status_code == 200, response.text
+
+    async with httpx.AsyncClient(base_url=f'http://localhost:{port}', limits=limits, timeout=60) as client:
+        began = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - began
+    timings.sort()
+    return {
+        'req/s': count / elapsed,
+        'p50 ms': statistics.median(timings) * 1000,
+        'p99 ms': timings[int(len(timings) * 0.99) - 1] * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000, help='requests per concurrency level')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--threads', type=int, default=8, help='WSGI worker threads')
+    parser.add_argument('--documents', type=int, default=50)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--serve', choices=['wsgi', 'asgi'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.threads)
+        return
+
+    clean_up()
+    seed(args.documents)
+    paths = [f'/api/sessions/{ADDRESS}/documents/{ADDRESS}-{i}' for i in range(args.documents)]
+    paths += [f'/api/sessions/{ADDRESS}/documents?fields=metadata'] * (len(paths) // 4)
+    random.Random(0).shuffle(paths)
+
+    results = {}
+    try:
+        for mode in ('wsgi', 'asgi'):
+            process = start(mode, args.port, args.threads)
+            try:
+                asyncio.run(run(args.port, paths, max(args.concurrency), 200))
+                for concurrency in args.concurrency:
+                    results[mode, concurrency] = asyncio.run(run(args.port, paths, concurrency, args.requests))
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        clean_up()
+
+    print(f'{args.requests} requests per level; WSGI with {args.threads} threads, ASGI on uvicorn')
+    print(f"{'clients':>8}{'mode':>6}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for (mode, concurrency), result in sorted(results.items(), key=lambda item: (item[0][1], item[0][0])):
+        print(f"{concurrency:>8}{mode:>6}{result['req/s']:>10.0f}{result['p50 ms']:>10.2f}{result['p99 ms']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
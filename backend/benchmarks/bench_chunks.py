@@ -0,0 +1,108 @@
+"""Measure write amplification of a small edit to a large document.
+
+Edits one chunk's worth of a large document, first as a whole-document PUT
+of a single-blob document, then as a PATCH of one chunk of a chunked
+document, and reports request bytes and the WAL bytes Postgres wrote.
+
+    cd backend
+    python -m benchmarks.bench_chunks --size 5242880 --chunk-size 65536
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import time
+
+from sqlalchemy import text
+
+from api import app, db, limiter
+
+
+def ciphertext(size):
+    return base64.b64encode(os.urandom(size)).decode()
+
+
+def wal_position():
+    return db.session.execute(text('SELECT pg_current_wal_lsn()')).scalar()
+
+
+def wal_bytes(start):
+    return db.session.execute(
+        text('SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), :start)'), {'start': start}
+    ).scalar()
+
+
+def measure(client, method, url, make_body, edits):
+    timings = []
+    request_bytes = 0
+    db.session.commit()
+    start = wal_position()
+    db.session.commit()
+    for i in range(edits):
+        body = json.dumps(make_body(i))
+        request_bytes += len(body)
+        began = time.perf_counter()
+        response = client.open(url, method=method, data=body, content_type='application/json')
+        timings.append(time.perf_counter() - began)
+        assert response.status_code == 200, response.data
+    written = wal_bytes(start)
+    db.session.commit()
+    return {
+        'request_bytes': request_bytes // edits,
+        'wal_bytes': int(written) // edits,
+        'p50_ms': statistics.median(timings) * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=5 * 1024 * 1024, help='document bytes')
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024)
+    parser.add_argument('--edits', type=int, default=20)
+    args = parser.parse_args()
+
+    limiter.enabled = False
+    address = 'bench-chunks'
+    chunk_count = args.size // args.chunk_size
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        client.post('/api/sessions', json={'address': address})
+        try:
+            chunks = [ciphertext(args.chunk_size) for _ in range(chunk_count)]
+            title = ciphertext(48)
+            blob = json.loads(client.post(f'/api/sessions/{address}/documents', json={
+                'encryptedTitle': title, 'encryptedContent': ''.join(chunks)
+            }).data)['data']['id']
+            chunked = json.loads(client.post(f'/api/sessions/{address}/documents', json={
+                'encryptedTitle': title, 'encryptedChunks': chunks
+            }).data)['data']['id']
+
+            def edited_blob(i):
+                edited = list(chunks)
+                edited[i % chunk_count] = ciphertext(args.chunk_size)
+                return {'encryptedTitle': title, 'encryptedContent': ''.join(edited)}
+
+            def edited_chunk(i):
+                return {'chunks': [{'index': i % chunk_count, 'encryptedChunk': ciphertext(args.chunk_size)}]}
+
+            results = {
+                'PUT blob': measure(client, 'PUT', f'/api/sessions/{address}/documents/{blob}',
+                                    edited_blob, args.edits),
+                'PATCH chunk': measure(client, 'PATCH', f'/api/sessions/{address}/documents/{chunked}',
+                                       edited_chunk, args.edits)
+            }
+        finally:
+            client.delete(f'/api/sessions/{address}')
+
+    print(f"{args.size} byte document, {chunk_count} chunks of {args.chunk_size} bytes, {args.edits} edits")
+    print(f"{'edit':<14}{'request B':>12}{'WAL B':>12}{'p50 ms':>10}")
+    for name, result in results.items():
+        print(f"{name:<14}{result['request_bytes']:>12}{result['wal_bytes']:>12}{result['p50_ms']:>10.2f}")
+    ratio = results['PUT blob']['wal_bytes'] / max(results['PATCH chunk']['wal_bytes'], 1)
+    print(f"write amplification reduced {ratio:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
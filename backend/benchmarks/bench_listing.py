@@ -0,0 +1,85 @@
+"""Compare full and metadata-only document listings.
+
+Seeds one session with large documents and times ``get_documents`` with
+``fields=all`` (the old behaviour) against ``fields=metadata``.
+
+    cd backend
+    DATABASE_URL=postgresql://localhost/securenotes_bench python -m benchmarks.bench_listing
+"""
+import argparse
+import base64
+import os
+import statistics
+import time
+
+# Read when api creates its engine, so it must be set before the import
+os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/securenotes_bench')
+
+from api import app, db, limiter, Document, Session
+
+
+def seed(address, documents, size):
+    session = Session(address=address)
+    db.session.add(session)
+    db.session.flush()
+    for i in range(documents):
+        content = base64.b64encode(os.urandom(size * 3 // 4)).decode()
+        db.session.add(Document(
+            document_url=f'{address}-{i}',
+            encrypted_content=content,
+            encrypted_title=base64.b64encode(os.urandom(48)).decode(),
+            session_id=session.id
+        ))
+    db.session.commit()
+    return session.id
+
+
+def measure(client, url, requests):
+    timings = []
+    size = 0
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.data
+        size = len(response.data)
+    timings.sort()
+    return {
+        'bytes': size,
+        'p50_ms': statistics.median(timings) * 1000,
+        'p95_ms': timings[int(len(timings) * 0.95) - 1] * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=10)
+    parser.add_argument('--size', type=int, default=256 * 1024, help='ciphertext bytes per document')
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    limiter.enabled = False
+    address = 'bench-listing'
+    with app.app_context():
+        db.create_all()
+        session_id = seed(address, args.documents, args.size)
+        try:
+            client = app.test_client()
+            url = f'/api/sessions/{address}/documents'
+            results = {
+                'all': measure(client, f'{url}?fields=all', args.requests),
+                'metadata': measure(client, f'{url}?fields=metadata', args.requests)
+            }
+        finally:
+            Document.query.filter_by(session_id=session_id).delete()
+            Session.query.filter_by(id=session_id).delete()
+            db.session.commit()
+
+    print(f"{args.documents} documents x {args.size} bytes, {args.requests} requests")
+    print(f"{'fields':<10}{'bytes':>12}{'p50 ms':>10}{'p95 ms':>10}")
+    for fields, result in results.items():
+        print(f"{fields:<10}{result['bytes']:>12}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
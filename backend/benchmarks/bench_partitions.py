@@ -0,0 +1,128 @@
+"""Compare a plain and a hash-partitioned documents table.
+
+Seeds many sessions of documents, times listings, single-document reads,
+whole-session deletes (end_session) and a VACUUM after them on the plain
+table, then partitions it and repeats with other sessions.
+
+    cd backend
+    python -m benchmarks.bench_partitions --sessions 2000 --documents 50 --partitions 16
+"""
+import argparse
+import random
+import statistics
+import time
+
+from sqlalchemy import text
+
+from api import app, db, limiter
+from partitioning import partition_documents, unpartition_documents, is_partitioned
+
+
+def seed(sessions, documents, size):
+    db.session.execute(text('''
+        INSERT INTO sessions (address, created_at, last_accessed)
+        SELECT 'bench-partitions-' || s, now(), now() FROM generate_series(1, :sessions) AS s
+    '''), {'sessions': sessions})
+    # The leading zero byte is the UTF-8 tag of ciphertext.pack()
+    db.session.execute(text('''
+        INSERT INTO documents (document_url, encrypted_title, encrypted_content,
+                               created_at, last_modified, session_id)
+        SELECT s.address || '-' || d, '\\x00'::bytea || convert_to('title', 'UTF8'),
+               '\\x00'::bytea || convert_to(repeat(md5(s.address || d), :size / 32), 'UTF8'),
+               now() - d * interval '1 minute', now() - d * interval '1 minute', s.id
+        FROM sessions s, generate_series(1, :documents) AS d
+        WHERE s.address LIKE 'bench-partitions-%'
+    '''), {'documents': documents, 'size': size})
+    db.session.commit()
+
+
+def vacuum(table):
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        began = time.perf_counter()
+        connection.execute(text(f'VACUUM (ANALYZE) {table}'))
+        return time.perf_counter() - began
+
+
+def timed(requests):
+    timings = []
+    for request in requests:
+        began = time.perf_counter()
+        response = request()
+        timings.append(time.perf_counter() - began)
+        assert response.status_code == 200, response.data
+    return statistics.median(timings) * 1000
+
+
+def measure(client, addresses, deletes):
+    listings = addresses[:200]
+    reads = []
+    for address in addresses[:200]:
+        first = client.get(f'/api/sessions/{address}/documents').get_json()['data']['documents'][0]['id']
+        reads.append((address, first))
+    ended = addresses[200:200 + deletes]
+
+    results = {
+        'listing p50 ms': timed(lambda address=address: client.get(f'/api/sessions/{address}/documents')
+                                for address in listings),
+        'get p50 ms': timed(lambda address=address, url=url: client.get(f'/api/sessions/{address}/documents/{url}')
+                            for address, url in reads),
+    }
+    began = time.perf_counter()
+    for address in ended:
+        assert client.delete(f'/api/sessions/{address}').status_code == 200
+    results['end_session total s'] = time.perf_counter() - began
+    results['VACUUM documents s'] = vacuum('documents')
+    if is_partitioned(db.session.connection()):
+        db.session.commit()
+        results['VACUUM one partition s'] = vacuum('documents_p0')
+    db.session.commit()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=2000)
+    parser.add_argument('--documents', type=int, default=50, help='documents per session')
+    parser.add_argument('--size', type=int, default=1024, help='ciphertext bytes per document')
+    parser.add_argument('--partitions', type=int, default=16)
+    parser.add_argument('--deletes', type=int, default=100, help='sessions ended per layout')
+    args = parser.parse_args()
+
+    limiter.enabled = False
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        try:
+            seed(args.sessions, args.documents, args.size)
+            addresses = [f'bench-partitions-{s}' for s in range(1, args.sessions + 1)]
+            random.Random(0).shuffle(addresses)
+            half = len(addresses) // 2
+            vacuum('documents')
+
+            plain = measure(client, addresses[:half], args.deletes)
+
+            began = time.perf_counter()
+            moved = partition_documents(db.session.connection(), args.partitions)
+            db.session.commit()
+            move_seconds = time.perf_counter() - began
+            vacuum('documents')
+
+            partitioned = measure(client, addresses[half:], args.deletes)
+        finally:
+            db.session.rollback()
+            if is_partitioned(db.session.connection()):
+                unpartition_documents(db.session.connection())
+            db.session.execute(text("DELETE FROM documents WHERE document_url LIKE 'bench-partitions-%'"))
+            db.session.execute(text("DELETE FROM sessions WHERE address LIKE 'bench-partitions-%'"))
+            db.session.commit()
+
+    print(f"{args.sessions} sessions x {args.documents} documents of {args.size} bytes, "
+          f"{args.partitions} partitions (moved {moved} rows in {move_seconds:.1f}s)")
+    print(f"{'':<24}{'plain':>12}{'partitioned':>14}")
+    for name, value in plain.items():
+        print(f"{name:<24}{value:>12.3f}{partitioned[name]:>14.3f}")
+    print(f"{'VACUUM one partition s':<24}{'-':>12}{partitioned['VACUUM one partition s']:>14.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Measure the per-request overhead of each rate limiter storage.
+
+Times requests to a trivial rate-limited route without a limiter, with the
+per-process memory storage, and with RespStorage against a CounterServer on a
+Unix socket and on TCP (plus Redis, if --redis is given). Also times a bare
+storage.incr() for each.
+
+    cd backend
+    python -m benchmarks.bench_ratelimit --requests 5000 [--redis resp://localhost:6379]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from flask import Flask
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from limits.storage import storage_from_string
+
+from ratelimit import CounterServer
+
+
+def make_app(storage_uri):
+    app = Flask(__name__)
+    if storage_uri is None:
+        app.route('/limited')(lambda: 'ok')
+        return app
+    app.config['RATELIMIT_STORAGE_URI'] = storage_uri
+    limiter = Limiter(app=app, key_func=get_remote_address)
+    app.route('/limited')(limiter.limit('1000000 per minute')(lambda: 'ok'))
+    return app
+
+
+def time_calls(call, count):
+    for _ in range(min(count, 200)):
+        call()
+    timings = []
+    for _ in range(count):
+        began = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - began)
+    timings.sort()
+    return statistics.median(timings) * 1e6, timings[int(len(timings) * 0.99)] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--redis', help='also measure a Redis server at this resp:// URI')
+    args = parser.parse_args()
+
+    socket_path = os.path.join(tempfile.mkdtemp(), 'limiter.sock')
+    unix_server = CounterServer(socket_path).start()
+    tcp_server = CounterServer(('localhost', 0)).start()
+    storages = {
+        'none': None,
+        'memory': 'memory://',
+        'resp unix': f'resp+unix://{socket_path}',
+        'resp tcp': 'resp://{}:{}'.format(*tcp_server.address),
+    }
+    if args.redis:
+        storages['redis'] = args.redis
+
+    results = {}
+    try:
+        for name, uri in storages.items():
+            client = make_app(uri).test_client()
+            request = time_calls(lambda: client.get('/limited'), args.requests)
+            incr = None
+            if uri is not None:
+                storage = storage_from_string(uri)
+                incr = time_calls(lambda: storage.incr('LIMITER/bench', 60), args.requests)
+                storage.reset()
+            results[name] = request, incr
+    finally:
+        unix_server.stop()
+        tcp_server.stop()
+
+    baseline = results['none'][0][0]
+    print(f"{args.requests} requests per storage")
+    print(f"{'storage':<12}{'p50 us':>10}{'p99 us':>10}{'overhead':>10}{'incr p50':>10}{'incr p99':>10}")
+    for name, (request, incr) in results.items():
+        incr_columns = f"{incr[0]:>10.1f}{incr[1]:>10.1f}" if incr else f"{'-':>10}{'-':>10}"
+        print(f"{name:<12}{request[0]:>10.1f}{request[1]:>10.1f}{request[0] - baseline:>10.1f}{incr_columns}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Microbenchmark the JSON encoding of document responses.
+
+Builds single-document and listing responses in an app context, without the
+database, three ways: the old path (a hand-built dict with ``isoformat()``
+dates through Flask's default provider), serialize.py with orjson, and
+serialize.py's stdlib fallback. Reports the median time per response.
+
+    cd backend
+    python -m benchmarks.bench_serialize --sizes 1024 65536 1048576 --listing 100
+"""
+import argparse
+import base64
+import os
+import statistics
+import time
+from datetime import datetime
+
+from flask.json.provider import DefaultJSONProvider
+
+import serialize
+from api import app
+from serialize import FastJSONProvider, document_data
+
+
+def ciphertext(size):
+    return base64.b64encode(os.urandom(size * 3 // 4)).decode()
+
+
+def make_documents(count, size):
+    now = datetime.utcnow()
+    return [(f'document-{i}', ciphertext(48), ciphertext(size), now, now) for i in range(count)]
+
+
+def old_response(provider, documents):
+    items = [{
+        'id': url,
+        'encryptedTitle': title,
+        'encryptedContent': content,
+        'createdAt': created_at.isoformat(),
+        'lastModified': last_modified.isoformat()
+    } for url, title, content, created_at, last_modified in documents]
+    return provider.response({'data': items[0] if len(items) == 1 else {'documents': items}})
+
+
+def new_response(provider, documents):
+    items = [document_data(url, title, created_at, last_modified, content)
+             for url, title, content, created_at, last_modified in documents]
+    return provider.response({'data': items[0] if len(items) == 1 else {'documents': items}})
+
+
+def measure(build, provider, documents, repeat):
+    timings = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        response = build(provider, documents)
+        response.get_data()
+        timings.append(time.perf_counter() - began)
+    return statistics.median(timings) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1024, 64 * 1024, 1024 * 1024],
+                        help='ciphertext bytes per document')
+    parser.add_argument('--listing', type=int, default=100, help='documents per listing')
+    parser.add_argument('--listing-size', type=int, default=4096)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    cases = [(f'document {size} B', make_documents(1, size)) for size in args.sizes]
+    cases.append((f'listing {args.listing} x {args.listing_size} B',
+                  make_documents(args.listing, args.listing_size)))
+
+    orjson = serialize.orjson
+    print(f"{'response':<26}{'old us':>12}{'orjson us':>12}{'stdlib us':>12}{'speedup':>10}")
+    with app.app_context():
+        default, fast = DefaultJSONProvider(app), FastJSONProvider(app)
+        for name, documents in cases:
+            old = measure(old_response, default, documents, args.repeat)
+            new = measure(new_response, fast, documents, args.repeat) if orjson is not None else float('nan')
+            serialize.orjson = None
+            try:
+                fallback = measure(new_response, fast, documents, args.repeat)
+            finally:
+                serialize.orjson = orjson
+            print(f"{name:<26}{old:>12.1f}{new:>12.1f}{fallback:>12.1f}{old / new:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
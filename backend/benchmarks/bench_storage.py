@@ -0,0 +1,72 @@
+"""Compare table sizes for ciphertext stored as base64 text and as bytea.
+
+Fills two scratch tables with the same CryptoJS envelopes, one with the old
+Text columns and one with the Ciphertext (bytea) type, and reports
+pg_total_relation_size for each.
+
+    cd backend
+    python -m benchmarks.bench_storage --documents 5000 --size 4096
+"""
+import argparse
+import base64
+import json
+import os
+
+import sqlalchemy as sa
+
+from api import app, db
+from ciphertext import Ciphertext
+
+
+def envelope(size):
+    # CryptoJS passphrase output: base64('Salted__' + salt + ciphertext)
+    content = base64.b64encode(b'Salted__' + os.urandom(8 + size)).decode()
+    return json.dumps({'iv': os.urandom(16).hex(), 'content': content}, separators=(',', ':'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=5000)
+    parser.add_argument('--size', type=int, default=4096, help='plaintext bytes per document')
+    args = parser.parse_args()
+
+    metadata = sa.MetaData()
+    tables = {
+        name: sa.Table(
+            f'storage_bench_{name}', metadata,
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('encrypted_content', column_type, nullable=False),
+            sa.Column('encrypted_title', column_type, nullable=False)
+        )
+        for name, column_type in (('text', sa.Text), ('bytea', Ciphertext))
+    }
+    rows = [
+        {'encrypted_content': envelope(args.size), 'encrypted_title': envelope(32)}
+        for _ in range(args.documents)
+    ]
+
+    with app.app_context():
+        metadata.create_all(db.engine)
+        try:
+            with db.engine.begin() as connection:
+                for table in tables.values():
+                    connection.execute(table.insert(), rows)
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                sizes = {}
+                for name, table in tables.items():
+                    connection.exec_driver_sql(f'VACUUM ANALYZE {table.name}')
+                    sizes[name] = connection.execute(
+                        sa.text('SELECT pg_total_relation_size(:name)'), {'name': table.name}
+                    ).scalar()
+        finally:
+            metadata.drop_all(db.engine)
+
+    print(f"{args.documents} documents, {args.size} plaintext bytes each")
+    print(f"{'storage':<10}{'bytes':>14}")
+    for name, size in sizes.items():
+        print(f"{name:<10}{size:>14}")
+    print(f"saved {1 - sizes['bytea'] / sizes['text']:.1%}")
+
+
+if __name__ == '__main__':
+    main()
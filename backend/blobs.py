@@ -0,0 +1,141 @@
+"""Content-addressed file storage for large ciphertexts.
+
+Documents whose ciphertext is over ``threshold`` bytes keep it in a file named
+by its sha256 under ``root`` instead of in ``documents.encrypted_content``;
+the row holds the hash and length only (``content_hash``, ``content_length``).
+Identical ciphertexts share one file. What's stored is the ciphertext encoded
+as a JSON string, quotes included, so a document's JSON can be written around
+the file's bytes without decoding them (see ``serialize.document_frame``).
+
+Files are written to a temporary name and renamed into place, so readers never
+see a partial blob. A blob can be deleted once no row references it:
+``collect()`` checks the given hashes after a delete or an update, ``sweep()``
+checks every file. Both leave files written or reused in the last ``grace``
+seconds, since the transaction referencing them may not have committed yet.
+"""
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+
+from sqlalchemy import select
+
+# Blobs are served in pieces of this many bytes
+CHUNK_SIZE = 1024 * 1024
+
+
+class BlobStore:
+    def __init__(self, root=None, threshold=256 * 1024, grace=60):
+        self.root = root
+        self.threshold = threshold
+        self.grace = grace
+
+    @property
+    def enabled(self):
+        return self.root is not None
+
+    def stores(self, size):
+        """Whether content of ``size`` bytes belongs in the store."""
+        return self.enabled and size > self.threshold
+
+    def path(self, digest):
+        name = digest.hex()
+        return os.path.join(self.root, name[:2], name[2:4], name)
+
+    def put(self, data):
+        """Store ``data`` and return its sha256 digest."""
+        digest = hashlib.sha256(data).digest()
+        path = self.path(digest)
+        try:
+            # Already stored; mark it as in use again for collect()
+            os.utime(path)
+            return digest
+        except FileNotFoundError:
+            pass
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        return digest
+
+    def read(self, digest):
+        with open(self.path(digest), 'rb') as file:
+            return file.read()
+
+    def stream(self, digest, head=b'', tail=b'', buffers=False):
+        """Iterate over ``head``, the blob in ``CHUNK_SIZE`` pieces, then ``tail``.
+
+        The blob is memory-mapped, so it's read from the page cache as it's
+        sent rather than loaded first. With ``buffers`` the pieces are
+        memoryviews of the mapping, for ASGI servers, which write any buffer;
+        otherwise they're bytes, as WSGI requires. The mapping is released
+        with the last piece. Raises FileNotFoundError right away if the blob
+        is missing.
+        """
+        with open(self.path(digest), 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        def pieces():
+            view = memoryview(mapped) if buffers else mapped
+            yield head
+            for offset in range(0, len(mapped), CHUNK_SIZE):
+                yield view[offset:offset + CHUNK_SIZE]
+            yield tail
+        return pieces()
+
+    def collect(self, connection, column, digests):
+        """Delete the blobs among ``digests`` that no row references in
+        ``column`` any more; returns how many were deleted."""
+        digests = {bytes(digest) for digest in digests if digest is not None}
+        if not self.enabled or not digests:
+            return 0
+        referenced = set(connection.execute(select(column).where(column.in_(digests))).scalars())
+        return sum(self._remove(digest) for digest in digests - referenced)
+
+    def sweep(self, connection, column, batch_size=1000):
+        """Delete every stored blob that no row references; returns how many were deleted."""
+        if not self.enabled:
+            return 0
+        removed, batch = 0, []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                try:
+                    batch.append(bytes.fromhex(name))
+                except ValueError:
+                    # Temporary files; collected only once abandoned
+                    self._remove_abandoned(os.path.join(directory, name))
+                    continue
+                if len(batch) >= batch_size:
+                    removed += self.collect(connection, column, batch)
+                    batch = []
+        return removed + self.collect(connection, column, batch)
+
+    def _recent(self, path):
+        return time.time() - os.stat(path).st_mtime < self.grace
+
+    def _remove(self, digest):
+        path = self.path(digest)
+        try:
+            if self._recent(path):
+                return False
+            os.unlink(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _remove_abandoned(self, path):
+        try:
+            if not self._recent(path):
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,109 @@
+"""Bulk loading for the document import endpoint and CLI command.
+
+``copy_rows()`` streams rows into a table with ``COPY ... FROM STDIN`` on
+PostgreSQL and falls back to a multi-row INSERT on other backends. Values go
+through the columns' TypeDecorators first, so callers pass the same Python
+values they would assign to a model.
+"""
+import io
+import time
+from datetime import datetime
+
+from sqlalchemy import func, select, text
+from sqlalchemy.types import TypeDecorator
+
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _copy_value(value):
+    """Format one value for COPY's text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\\\x' + bytes(value).hex()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value).translate(_COPY_ESCAPES)
+
+
+def copy_rows(connection, table, columns, rows):
+    """Insert ``rows``, tuples in ``columns`` order, into ``table``."""
+    if not rows:
+        return
+    if connection.dialect.name != 'postgresql':
+        connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+        return
+
+    dialect = connection.dialect
+    processors = []
+    for name in columns:
+        column_type = table.c[name].type
+        if isinstance(column_type, TypeDecorator):
+            processors.append(lambda value, t=column_type: t.process_bind_param(value, dialect))
+        else:
+            processors.append(None)
+
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(
+            _copy_value(value if process is None else process(value))
+            for process, value in zip(processors, row)
+        ))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    quote = dialect.identifier_preparer.quote
+    statement = 'COPY {} ({}) FROM STDIN'.format(
+        quote(table.name), ', '.join(quote(name) for name in columns))
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(statement, buffer)
+    finally:
+        cursor.close()
+
+
+def next_ids(connection, table, count):
+    """Reserve ``count`` primary key values for rows about to be copied in."""
+    if connection.dialect.name == 'postgresql':
+        return list(connection.execute(
+            text('SELECT nextval(pg_get_serial_sequence(:table, :column)) FROM generate_series(1, :count)'),
+            {'table': table.name, 'column': table.primary_key.columns[0].name, 'count': count}
+        ).scalars())
+    # Other backends serialize writers, so max(id) can't move under us
+    start = connection.execute(select(func.coalesce(func.max(table.primary_key.columns[0]), 0))).scalar()
+    return list(range(start + 1, start + 1 + count))
+
+
+class ImportStats:
+    """Rows and bytes loaded so far, and the resulting throughput."""
+
+    def __init__(self, timer=time.perf_counter):
+        self.rows = 0
+        self.bytes = 0
+        self._timer = timer
+        self._started = timer()
+        self._finished = None
+
+    def finish(self):
+        self._finished = self._timer()
+
+    @property
+    def seconds(self):
+        return (self._finished or self._timer()) - self._started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    @property
+    def megabytes_per_second(self):
+        return self.bytes / 1e6 / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'seconds': round(self.seconds, 3),
+            'rowsPerSecond': round(self.rows_per_second, 1),
+            'megabytesPerSecond': round(self.megabytes_per_second, 2)
+        }
@@ -0,0 +1,74 @@
+"""Compact binary storage for the ciphertext strings clients send.
+
+Clients send ciphertext as text: the CryptoJS envelope
+``{"iv":"<hex>","content":"<base64>"}`` or, for newer clients, bare base64.
+``pack()`` turns those into raw bytes behind a one-byte format tag, and
+``unpack()`` renders the exact same string back, so the JSON contract doesn't
+change. Anything that wouldn't round-trip byte for byte is stored as UTF-8.
+"""
+import base64
+import binascii
+import json
+import re
+
+from sqlalchemy import LargeBinary
+from sqlalchemy.types import TypeDecorator
+
+UTF8 = 0
+CRYPTOJS = 1
+BASE64 = 2
+
+_CRYPTOJS_ENVELOPE = re.compile(r'\{"iv":"([0-9a-f]{32})","content":"([A-Za-z0-9+/=]+)"\}\Z')
+
+
+def _b64decode(text):
+    """Decode canonical base64 only, so re-encoding gives back ``text``."""
+    if not text or len(text) % 4:
+        return None
+    try:
+        raw = base64.b64decode(text, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if base64.b64encode(raw).decode('ascii') != text:
+        return None
+    return raw
+
+
+def pack(text):
+    match = _CRYPTOJS_ENVELOPE.match(text)
+    if match:
+        content = _b64decode(match.group(2))
+        if content is not None:
+            return bytes([CRYPTOJS]) + bytes.fromhex(match.group(1)) + content
+    raw = _b64decode(text)
+    if raw is not None:
+        return bytes([BASE64]) + raw
+    return bytes([UTF8]) + text.encode('utf-8')
+
+
+def unpack(data):
+    data = bytes(data)
+    tag, body = data[0], data[1:]
+    if tag == CRYPTOJS:
+        return json.dumps(
+            {'iv': body[:16].hex(), 'content': base64.b64encode(body[16:]).decode('ascii')},
+            separators=(',', ':')
+        )
+    if tag == BASE64:
+        return base64.b64encode(body).decode('ascii')
+    if tag == UTF8:
+        return body.decode('utf-8')
+    raise ValueError(f'Unknown ciphertext format {tag}')
+
+
+class Ciphertext(TypeDecorator):
+    """A bytea column that reads and writes the client's ciphertext strings."""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else pack(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else unpack(value)
@@ -0,0 +1,253 @@
+import copy
+import io
+import zlib
+
+from flask import abort, request
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from werkzeug.wsgi import get_input_stream
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+DEFAULTS = {
+    'COMPRESS_ALGORITHMS': ['zstd', 'br', 'gzip'],
+    'COMPRESS_LEVELS': {'gzip': 6, 'br': 4, 'zstd': 3},
+    'COMPRESS_MIN_SIZE': 512,
+    'COMPRESS_MAX_REQUEST_SIZE': 64 * 1024 * 1024,
+}
+
+
+class _Gzip:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class _Zstd:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+# Decompressors yield the body in pieces of at most CHUNK_SIZE bytes, so a
+# small, highly compressed body can't expand unchecked in one call
+CHUNK_SIZE = 64 * 1024
+
+
+def _gunzip(stream):
+    decompressor = zlib.decompressobj(47)
+    while True:
+        data = stream.read(CHUNK_SIZE)
+        if not data:
+            break
+        while data:
+            yield decompressor.decompress(data, CHUNK_SIZE)
+            data = decompressor.unconsumed_tail
+    yield decompressor.flush()
+
+
+def _unbrotli(stream):
+    decompressor = brotli.Decompressor()
+    while True:
+        data = stream.read(CHUNK_SIZE)
+        if not data:
+            break
+        yield decompressor.process(data, output_buffer_limit=CHUNK_SIZE)
+        while not decompressor.can_accept_more_data():
+            yield decompressor.process(b'', output_buffer_limit=CHUNK_SIZE)
+    while not decompressor.is_finished():
+        data = decompressor.process(b'', output_buffer_limit=CHUNK_SIZE)
+        if not data:
+            raise brotli.error('Truncated brotli stream')
+        yield data
+
+
+def _unzstd(stream):
+    reader = zstandard.ZstdDecompressor().stream_reader(stream)
+    while True:
+        data = reader.read(CHUNK_SIZE)
+        if not data:
+            break
+        yield data
+
+
+COMPRESSORS = {'gzip': _Gzip}
+DECOMPRESSORS = {'gzip': _gunzip}
+if brotli is not None:
+    COMPRESSORS['br'] = _Brotli
+    DECOMPRESSORS['br'] = _unbrotli
+if zstandard is not None:
+    COMPRESSORS['zstd'] = _Zstd
+    DECOMPRESSORS['zstd'] = _unzstd
+
+
+class _DecompressedStream(io.RawIOBase):
+    """The decompressed request body, produced as the view reads it.
+
+    More than ``limit`` bytes of it (unless None) is a 413 and a corrupt body
+    a 400, raised from the read.
+    """
+
+    def __init__(self, chunks, limit):
+        self._chunks = chunks
+        self._limit = limit
+        self._size = 0
+        self._data = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._data:
+            try:
+                data = next(self._chunks, None)
+            except (zlib.error, ValueError) + _library_errors():
+                raise BadRequest('Invalid compressed request body')
+            if data is None:
+                return 0
+            self._size += len(data)
+            if self._limit is not None and self._size > self._limit:
+                raise RequestEntityTooLarge()
+            self._data = memoryview(data)
+        size = min(len(buffer), len(self._data))
+        buffer[:size] = self._data[:size]
+        self._data = self._data[size:]
+        return size
+
+
+class Compress:
+    """Negotiated response compression and request body decompression.
+
+    Responses are compressed with the first of ``COMPRESS_ALGORITHMS`` the
+    client accepts at the highest quality, once they reach
+    ``COMPRESS_MIN_SIZE`` bytes; streamed responses are compressed as they are
+    sent. Request bodies sent with ``Content-Encoding`` are decompressed as
+    the view reads them, up to ``COMPRESS_MAX_REQUEST_SIZE`` bytes, so nothing
+    is decompressed for a request that is rejected first. brotli and zstd are
+    used when their packages are installed.
+
+    Views that consume the body as a stream, holding only part of it at a
+    time, are exempted from the limit with ``streamed``.
+
+    Register it after the Limiter, whose default limits are checked in its
+    own before_request handler.
+    """
+
+    def __init__(self, app=None):
+        self._streamed = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        for name, value in DEFAULTS.items():
+            app.config.setdefault(name, copy.deepcopy(value))
+        self.app = app
+        app.before_request(self.decompress_request)
+        app.after_request(self.compress_response)
+
+    def streamed(self, view):
+        """Decorator lifting ``COMPRESS_MAX_REQUEST_SIZE`` for ``view``."""
+        self._streamed.add(view.__name__)
+        return view
+
+    def decompress_request(self):
+        encoding = request.headers.get('Content-Encoding', 'identity').strip().lower()
+        if encoding == 'identity':
+            return
+        if encoding not in DECOMPRESSORS:
+            abort(415)
+
+        environ = request.environ
+        chunks = DECOMPRESSORS[encoding](get_input_stream(environ))
+        limit = None if request.endpoint in self._streamed else self.app.config['COMPRESS_MAX_REQUEST_SIZE']
+        body = _DecompressedStream(chunks, limit)
+        environ['wsgi.input'] = io.BufferedReader(body, CHUNK_SIZE)
+        # The decompressed length isn't known up front; the stream ends itself
+        environ.pop('CONTENT_LENGTH', None)
+        environ['wsgi.input_terminated'] = True
+        environ.pop('HTTP_CONTENT_ENCODING', None)
+
+    def compress_response(self, response):
+        if response.status_code < 200 or response.status_code in (204, 206, 304)\
+                or 'Content-Encoding' in response.headers\
+                or not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+
+        algorithms = [name for name in self.app.config['COMPRESS_ALGORITHMS'] if name in COMPRESSORS]
+        encoding = request.accept_encodings.best_match(algorithms)
+        if encoding is None:
+            return response
+        compressor = COMPRESSORS[encoding](self.app.config['COMPRESS_LEVELS'][encoding])
+
+        if response.is_streamed:
+            response.response = _compress_stream(response.response, compressor)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.app.config['COMPRESS_MIN_SIZE']:
+                return response
+            compressed = compressor.compress(data) + compressor.finish()
+            if len(compressed) >= len(data):
+                return response
+            response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+
+        # The compressed bytes are a different representation of the same data
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+def _compress_stream(chunks, compressor):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def _library_errors():
+    errors = ()
+    if brotli is not None:
+        errors += (brotli.error,)
+    if zstandard is not None:
+        errors += (zstandard.ZstdError,)
+    return errors
@@ -0,0 +1,122 @@
+"""Engine configuration from the environment.
+
+    DATABASE_URL             postgresql://localhost/securenotes
+    DATABASE_REPLICA_URLS    comma-separated read replicas for read-only routes, see replicas.py
+    DB_POOL_SIZE             connections kept open per process (5)
+    DB_MAX_OVERFLOW          extra connections opened under load, closed on checkin (10)
+    DB_POOL_TIMEOUT          seconds to wait for a free connection before failing (30)
+    DB_POOL_RECYCLE          seconds before a connection is replaced, -1 for never (1800)
+    DB_POOL_PRE_PING         1 to test each connection on checkout (0)
+    DB_STATEMENT_TIMEOUT     milliseconds before Postgres cancels a statement, 0 for none (30000)
+    DB_QUERY_CACHE_SIZE      compiled statements SQLAlchemy keeps per engine (500)
+    DB_STATEMENT_CACHE_SIZE  prepared statements asyncpg keeps per connection (100)
+    DB_PGBOUNCER             1 when connecting through pgbouncer in transaction pooling mode
+
+pgbouncer in transaction pooling mode hands each transaction to any server
+connection, so nothing may outlive a transaction: the statement timeout is set
+with ``SET LOCAL`` when each transaction begins instead of as a startup
+parameter, and asyncpg's prepared statements are turned off.
+"""
+import os
+import time
+import uuid
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from metrics import Counter
+
+DEFAULT_URL = 'postgresql://localhost/securenotes'
+
+pool_checkouts = Counter('db_pool_checkouts_total', 'Connections taken from the pool')
+pool_wait_seconds = Counter('db_pool_wait_seconds_total', 'Time spent getting connections from the pool, '
+                                                    'including opening new ones')
+pool_timeouts = Counter('db_pool_timeouts_total', 'Checkouts that gave up after DB_POOL_TIMEOUT')
+
+
+class _TimedCheckout:
+    """Records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        began = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_timeouts.inc()
+            raise
+        finally:
+            pool_checkouts.inc()
+            pool_wait_seconds.inc(time.perf_counter() - began)
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def _setting(environ, name, default, kind=int):
+    value = environ.get(name)
+    if value is None or value == '':
+        return default
+    if kind is bool:
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return kind(value)
+
+
+def database_url(environ=None):
+    environ = os.environ if environ is None else environ
+    return environ.get('DATABASE_URL') or DEFAULT_URL
+
+
+def replica_urls(environ=None):
+    environ = os.environ if environ is None else environ
+    return [url.strip() for url in environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+
+
+def engine_options(environ=None, asynchronous=False, **defaults):
+    """Keyword arguments for create_engine() (or create_async_engine() with
+    ``asynchronous``), e.g. as ``SQLALCHEMY_ENGINE_OPTIONS``. ``defaults``
+    override the built-in pool defaults but not the environment."""
+    environ = os.environ if environ is None else environ
+    defaults = {'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 30, 'pool_recycle': 1800, **defaults}
+    pgbouncer = _setting(environ, 'DB_PGBOUNCER', False, bool)
+    timeout = _setting(environ, 'DB_STATEMENT_TIMEOUT', 30000)
+
+    connect_args = {}
+    if asynchronous:
+        if pgbouncer:
+            # Server connections change between transactions; unique names keep
+            # one client's unnamed statements from colliding with another's
+            connect_args.update(statement_cache_size=0, prepared_statement_cache_size=0,
+                                prepared_statement_name_func=lambda: f'__asyncpg_{uuid.uuid4()}__')
+        else:
+            connect_args['prepared_statement_cache_size'] = _setting(environ, 'DB_STATEMENT_CACHE_SIZE', 100)
+            if timeout:
+                connect_args['server_settings'] = {'statement_timeout': str(timeout)}
+    elif timeout and not pgbouncer:
+        connect_args['options'] = f'-c statement_timeout={timeout}'
+
+    return {
+        'poolclass': TimedAsyncQueuePool if asynchronous else TimedQueuePool,
+        'pool_size': _setting(environ, 'DB_POOL_SIZE', defaults['pool_size']),
+        'max_overflow': _setting(environ, 'DB_MAX_OVERFLOW', defaults['max_overflow']),
+        'pool_timeout': _setting(environ, 'DB_POOL_TIMEOUT', defaults['pool_timeout'], float),
+        'pool_recycle': _setting(environ, 'DB_POOL_RECYCLE', defaults['pool_recycle']),
+        'pool_pre_ping': _setting(environ, 'DB_POOL_PRE_PING', False, bool),
+        'query_cache_size': _setting(environ, 'DB_QUERY_CACHE_SIZE', 500),
+        'connect_args': connect_args,
+    }
+
+
+def configure_engine(engine, environ=None):
+    """Set up what engine_options() can't pass at connect time; call once per engine."""
+    environ = os.environ if environ is None else environ
+    timeout = _setting(environ, 'DB_STATEMENT_TIMEOUT', 30000)
+    if _setting(environ, 'DB_PGBOUNCER', False, bool) and timeout:
+        @event.listens_for(engine, 'begin')
+        def set_statement_timeout(connection):
+            connection.exec_driver_sql(f'SET LOCAL statement_timeout = {int(timeout)}')
+    return engine
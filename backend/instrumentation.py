@@ -0,0 +1,124 @@
+"""Per-route request metrics, for the Prometheus endpoint at /metrics.
+
+For each route (its endpoint name) this records the latency, the response
+size as sent, the SQL statements run, and how much of the latency went to SQL,
+to rate limiting and to JSON encoding, so a slow route can be pinned on one of
+them. Rate limit rejections are counted per route, and the pool gauges show
+how many connections are in use.
+
+Nothing is recorded unless ``METRICS_ENABLED`` is set: the request hooks and
+wrappers return straight away, and the SQLAlchemy cursor events are only
+listened to while enabled. Register it before Compress so sizes are measured
+after compression. Streamed responses (exports) have no size to record.
+"""
+import functools
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from metrics import Counter, Gauge, Histogram
+
+# 256 B to 64 MiB
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(10))
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+request_seconds = Histogram('http_request_duration_seconds', 'Request latency, by route', ['route'])
+response_bytes = Histogram('http_response_bytes', 'Response body size as sent, by route', ['route'],
+                           buckets=SIZE_BUCKETS)
+request_statements = Histogram('http_request_sql_statements', 'SQL statements per request, by route', ['route'],
+                               buckets=STATEMENT_BUCKETS)
+request_phase_seconds = Histogram('http_request_phase_seconds', 'Time per request spent in sql, the rate '
+                                  'limiter or json encoding, by route', ['route', 'phase'])
+rate_limited_requests = Counter('http_rate_limited_requests_total', 'Requests rejected by a rate limit, by route',
+                                ['route'])
+pool_in_use = Gauge('db_pool_in_use', 'Connections checked out of the pool', ['engine'])
+pool_idle = Gauge('db_pool_idle', 'Open connections waiting in the pool', ['engine'])
+
+PHASES = ('sql', 'limiter', 'json')
+
+
+class RequestMetrics:
+    def __init__(self, app=None):
+        self._enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', False)
+        self.enabled = app.config['METRICS_ENABLED']
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, enabled):
+        enabled = bool(enabled)
+        if enabled and not self._enabled:
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        elif self._enabled and not enabled:
+            event.remove(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.remove(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        self._enabled = enabled
+
+    def watch_pool(self, name, engine):
+        """Report the connections of ``engine``'s pool as ``engine=name``."""
+        pool_in_use.labels(name).set_function(engine.pool.checkedout)
+        pool_idle.labels(name).set_function(engine.pool.checkedin)
+
+    def watch_limiter(self, limiter):
+        """Time the rate limit checks of a Flask-Limiter ``limiter``."""
+        strategy = limiter.limiter
+        strategy.hit = self._timed(strategy.hit, 'limiter')
+        strategy.test = self._timed(strategy.test, 'limiter')
+
+    def watch_json(self, provider):
+        """Time the JSON responses built by ``provider``, e.g. ``app.json``."""
+        provider.response = self._timed(provider.response, 'json')
+
+    def _timed(self, function, phase):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not self._enabled or not has_request_context() or 'metrics' not in g:
+                return function(*args, **kwargs)
+            began = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                g.metrics[phase] += time.perf_counter() - began
+        return wrapper
+
+    def _before_request(self):
+        if self._enabled:
+            g.metrics = dict.fromkeys(PHASES, 0.0)
+            g.metrics_started = time.perf_counter()
+            g.metrics_statements = 0
+
+    def _after_request(self, response):
+        if not self._enabled or 'metrics' not in g:
+            return response
+        route = request.endpoint or 'unmatched'
+        request_seconds.labels(route).observe(time.perf_counter() - g.metrics_started)
+        request_statements.labels(route).observe(g.metrics_statements)
+        for phase, seconds in g.metrics.items():
+            request_phase_seconds.labels(route, phase).observe(seconds)
+        if not response.is_streamed and response.content_length is not None:
+            response_bytes.labels(route).observe(response.content_length)
+        if response.status_code == 429:
+            rate_limited_requests.labels(route).inc()
+        return response
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'metrics' in g:
+            g.metrics_statements += 1
+            context.metrics_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, 'metrics_started', None)
+        if started is not None and has_request_context() and 'metrics' in g:
+            g.metrics['sql'] += time.perf_counter() - started
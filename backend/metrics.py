@@ -0,0 +1,142 @@
+import bisect
+import math
+import threading
+
+# Every metric created in this process, in creation order
+REGISTRY = []
+
+# The Prometheus text exposition format, see exposition()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        if registry is not None:
+            registry.append(self)
+
+    def labels(self, *values):
+        """The metric for one combination of label values, created on first use."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} takes labels {self.labelnames}')
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._child()
+        return child
+
+    def _child(self):
+        return type(self)(self.name, self.documentation, registry=None)
+
+    def _samples(self):
+        yield '', (), self.value
+
+
+class Counter(_Metric):
+    """A monotonically increasing, thread-safe counter; by convention its name ends in ``_total``."""
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge(_Metric):
+    """A thread-safe value that can go up and down, or that ``function``
+    reads when the metrics are collected."""
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, function=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.value = 0
+        self.function = function
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def _samples(self):
+        yield '', (), self.function() if self.function is not None else self.value
+
+
+class Histogram(_Metric):
+    """Counts observations into cumulative ``buckets``, like Prometheus' histograms."""
+    type = 'histogram'
+    # Seconds, for latencies
+    DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+
+    def _child(self):
+        return Histogram(self.name, self.documentation, registry=None, buckets=self.buckets)
+
+    def observe(self, value):
+        # Buckets are upper bounds: a value equal to a bound falls in its bucket
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def _samples(self):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            yield '_bucket', (('le', _number(bound)),), cumulative
+        yield '_sum', (), total
+        yield '_count', (), cumulative
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return repr(value) if abs(value) >= 1e16 else str(int(value))
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def exposition(registry=REGISTRY):
+    """Every metric in ``registry``, in the Prometheus text format."""
+    lines = []
+    for metric in registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}'.replace('\n', ' '))
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        if metric.labelnames:
+            children = sorted(metric._children.items())
+        else:
+            children = [((), metric)]
+        for values, child in children:
+            for suffix, extra, value in child._samples():
+                labels = ','.join(f'{name}="{_escape(value)}"'
+                                  for name, value in tuple(zip(metric.labelnames, values)) + extra)
+                lines.append(f'{metric.name}{suffix}{{{labels}}} {_number(value)}' if labels
+                             else f'{metric.name}{suffix} {_number(value)}')
+    return '\n'.join(lines) + '\n'
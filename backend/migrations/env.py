@@ -5,6 +5,8 @@ from flask import current_app
 
 from alembic import context
 
+from partitioning import include_object, is_partitioned
+
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
@@ -97,10 +99,18 @@ def run_migrations_online():
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        # Index builds and table rewrites can outlast DB_STATEMENT_TIMEOUT
+        connection.exec_driver_sql('SET statement_timeout = 0')
+        # Compare a partitioned documents table (see partitioning.py) as the
+        # models' plain one; per run, as the mode can change between runs
+        configure_args = dict(conf_args)
+        if configure_args.get("include_object") is None:
+            configure_args["include_object"] = include_object(is_partitioned(connection))
+        connection.commit()
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
-            **conf_args
+            **configure_args
         )
 
         with context.begin_transaction():
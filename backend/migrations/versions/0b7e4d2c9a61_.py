@@ -0,0 +1,46 @@
+"""optionally hash-partition documents by session_id
+
+Revision ID: 0b7e4d2c9a61
+Revises: f3a9c1d7b2e4
+Create Date: 2026-10-17 17:22:40.118935
+
+Opt-in: documents is only partitioned when a partition count is passed, and
+rows are moved in batches (default 1000 rows):
+
+    flask db upgrade -x document_partitions=16 -x batch_size=5000
+
+Without it this revision changes nothing. To partition an already upgraded
+database, downgrade to f3a9c1d7b2e4 and upgrade again with the argument.
+Writes to documents wait while the rows move; reads continue. See
+partitioning.py for how the schema differs in partitioned mode.
+
+"""
+from alembic import context, op
+
+from partitioning import is_partitioned, partition_documents, unpartition_documents
+
+
+# revision identifiers, used by Alembic.
+revision = '0b7e4d2c9a61'
+down_revision = 'f3a9c1d7b2e4'
+branch_labels = None
+depends_on = None
+
+
+def x_arguments():
+    arguments = context.get_x_argument(as_dictionary=True)
+    return int(arguments.get('document_partitions', 0)), int(arguments.get('batch_size', 1000))
+
+
+def upgrade():
+    partitions, batch_size = x_arguments()
+    connection = op.get_bind()
+    if partitions and not is_partitioned(connection):
+        partition_documents(connection, partitions, batch_size)
+
+
+def downgrade():
+    _, batch_size = x_arguments()
+    connection = op.get_bind()
+    if is_partitioned(connection):
+        unpartition_documents(connection, batch_size)
@@ -0,0 +1,31 @@
+"""move each session's listing marker on every document write
+
+Revision ID: 5f2c8d1e7a93
+Revises: 9e4a7b2f6c15
+Create Date: 2026-10-17 21:14:37.812406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2c8d1e7a93'
+down_revision = '9e4a7b2f6c15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.alter_column('sessions', 'last_document_deleted_at', new_column_name='documents_changed_at')
+    # Until now creates and updates only showed up in max(last_modified)
+    op.execute("""
+        UPDATE sessions SET documents_changed_at = latest
+        FROM (SELECT session_id, max(last_modified) AS latest FROM documents GROUP BY session_id) AS documents
+        WHERE documents.session_id = sessions.id
+          AND (documents_changed_at IS NULL OR documents_changed_at < latest)
+    """)
+
+
+def downgrade():
+    op.alter_column('sessions', 'documents_changed_at', new_column_name='last_document_deleted_at')
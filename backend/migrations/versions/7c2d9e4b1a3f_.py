@@ -0,0 +1,40 @@
+"""index documents by session for listings and per-session lookups
+
+Revision ID: 7c2d9e4b1a3f
+Revises: e546c5f7ee51
+Create Date: 2026-10-17 10:12:44.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2d9e4b1a3f'
+down_revision = 'e546c5f7ee51'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction, and doesn't
+    # block writes to documents while it builds
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_documents_session_id_last_modified_id',
+            'documents',
+            ['session_id', sa.text('last_modified DESC'), sa.text('id DESC')],
+            unique=False,
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_documents_session_id_last_modified_id',
+            table_name='documents',
+            postgresql_concurrently=True,
+            if_exists=True
+        )
@@ -0,0 +1,43 @@
+"""add content_hash and content_length for ciphertexts in the blob store
+
+Revision ID: 9e4a7b2f6c15
+Revises: 0b7e4d2c9a61
+Create Date: 2026-10-17 19:41:03.552190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from partitioning import is_partitioned
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4a7b2f6c15'
+down_revision = '0b7e4d2c9a61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Nullable without a default, so existing rows aren't rewritten
+    op.add_column('documents', sa.Column('content_hash', sa.LargeBinary(length=32), nullable=True))
+    op.add_column('documents', sa.Column('content_length', sa.Integer(), nullable=True))
+    # Partitioned tables can't be indexed concurrently; the index is empty
+    # either way, as no document is in the blob store yet
+    concurrently = not is_partitioned(op.get_bind())
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_documents_content_hash',
+            'documents',
+            ['content_hash'],
+            unique=False,
+            postgresql_where=sa.text('content_hash IS NOT NULL'),
+            postgresql_concurrently=concurrently,
+            if_not_exists=True
+        )
+
+
+def downgrade():
+    op.drop_index('ix_documents_content_hash', table_name='documents', if_exists=True)
+    op.drop_column('documents', 'content_length')
+    op.drop_column('documents', 'content_hash')
@@ -0,0 +1,93 @@
+"""store document ciphertext as bytea
+
+Revision ID: a41f0c6d2e58
+Revises: 7c2d9e4b1a3f
+Create Date: 2026-10-17 11:40:05.772914
+
+Existing rows are converted in batches that each commit on their own, so the
+conversion never holds one long transaction over the whole table. The batch
+size defaults to 1000 rows:
+
+    flask db upgrade -x batch_size=5000
+
+Pause writes to documents while this runs: a row rewritten by the old code
+after its batch was converted keeps the converted (older) value.
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+from ciphertext import pack, unpack
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41f0c6d2e58'
+down_revision = '7c2d9e4b1a3f'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ('encrypted_content', 'encrypted_title')
+
+
+def batch_size():
+    return int(context.get_x_argument(as_dictionary=True).get('batch_size', 1000))
+
+
+def convert_in_batches(target_type, convert):
+    """Fill the ``<column>_new`` columns from ``<column>``, one batch at a time."""
+    connection = op.get_bind()
+    documents = sa.table(
+        'documents',
+        sa.column('id', sa.Integer),
+        *(sa.column(name) for name in COLUMNS),
+        *(sa.column(f'{name}_new', target_type) for name in COLUMNS)
+    )
+    size = batch_size()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(documents.c.id, *(documents.c[name] for name in COLUMNS))
+            .where(documents.c.id > last_id)
+            .where(documents.c[f'{COLUMNS[0]}_new'].is_(None))
+            .order_by(documents.c.id)
+            .limit(size)
+        ).fetchall()
+        if not rows:
+            return
+        converted = sa.values(
+            sa.column('id', sa.Integer),
+            *(sa.column(name, target_type) for name in COLUMNS),
+            name='converted'
+        ).data([(row[0], *(convert(value) for value in row[1:])) for row in rows])
+        connection.execute(
+            documents.update()
+            .where(documents.c.id == converted.c.id)
+            .values({f'{name}_new': converted.c[name] for name in COLUMNS})
+        )
+        last_id = rows[-1][0]
+
+
+def swap_columns(target_type):
+    for name in COLUMNS:
+        op.drop_column('documents', name)
+        op.alter_column('documents', f'{name}_new', new_column_name=name,
+                        existing_type=target_type, nullable=False)
+
+
+def upgrade():
+    for name in COLUMNS:
+        op.add_column('documents', sa.Column(f'{name}_new', sa.LargeBinary(), nullable=True))
+    with op.get_context().autocommit_block():
+        convert_in_batches(sa.LargeBinary(), pack)
+    # Pick up rows inserted since their batch ran, then switch over
+    convert_in_batches(sa.LargeBinary(), pack)
+    swap_columns(sa.LargeBinary())
+
+
+def downgrade():
+    for name in COLUMNS:
+        op.add_column('documents', sa.Column(f'{name}_new', sa.Text(), nullable=True))
+    with op.get_context().autocommit_block():
+        convert_in_batches(sa.Text(), unpack)
+    convert_in_batches(sa.Text(), unpack)
+    swap_columns(sa.Text())
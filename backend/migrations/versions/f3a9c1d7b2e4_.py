@@ -0,0 +1,38 @@
+"""index sessions by last_accessed for the expired-session sweeper
+
+Revision ID: f3a9c1d7b2e4
+Revises: d1e8b6c3a472
+Create Date: 2026-10-17 16:05:12.904417
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9c1d7b2e4'
+down_revision = 'd1e8b6c3a472'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Built concurrently so sessions stay writable while it builds
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_sessions_last_accessed',
+            'sessions',
+            ['last_accessed'],
+            unique=False,
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_sessions_last_accessed',
+            table_name='sessions',
+            postgresql_concurrently=True,
+            if_exists=True
+        )
@@ -0,0 +1,159 @@
+"""Switch the documents table between a plain table and hash partitions.
+
+Postgres requires the partition key in every unique constraint of a
+partitioned table, so in partitioned mode the primary key is
+``(id, session_id)`` and document URLs are unique per session. ``id`` still
+comes from ``documents_id_seq`` and stays unique, so the ``Document`` model
+keeps ``id`` as its identity. Foreign keys can't reference ``documents(id)``
+either: chunks are deleted with their document by a trigger instead of
+``ON DELETE CASCADE``.
+
+Both directions lock documents against writes (reads continue), move the rows
+in batches of ``batch_size`` and rebuild the indexes once the data is in.
+They run inside the caller's transaction.
+
+The models describe the plain table; ``include_object`` keeps Alembic's
+autogenerate and ``flask db check`` from reporting the partitioned layout as
+drift to undo.
+"""
+import re
+
+import sqlalchemy as sa
+
+COLUMNS = ('id', 'document_url', 'encrypted_content', 'encrypted_title', 'content_digest',
+           'chunk_count', 'created_at', 'last_modified', 'session_id')
+# Added by a later revision than the one partitioning documents
+BLOB_COLUMNS = ('content_hash', 'content_length')
+
+LISTING_INDEX = 'CREATE INDEX ix_documents_session_id_last_modified_id ' \
+                'ON documents (session_id, last_modified DESC, id DESC)'
+CONTENT_HASH_INDEX = 'CREATE INDEX ix_documents_content_hash ' \
+                     'ON documents (content_hash) WHERE content_hash IS NOT NULL'
+SESSION_FOREIGN_KEY = 'ALTER TABLE documents ADD CONSTRAINT documents_session_id_fkey ' \
+                      'FOREIGN KEY (session_id) REFERENCES sessions (id)'
+PARTITION_NAME = re.compile(r'documents_p\d+$')
+
+
+def is_partitioned(connection):
+    return connection.execute(sa.text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('documents')"
+    )).scalar() is True
+
+
+def partition_count(connection):
+    return connection.execute(sa.text(
+        "SELECT count(*) FROM pg_inherits WHERE inhparent = to_regclass('documents')"
+    )).scalar()
+
+
+def has_blob_columns(connection):
+    return connection.execute(sa.text(
+        "SELECT count(*) = 2 FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = 'documents' "
+        "AND column_name IN ('content_hash', 'content_length')"
+    )).scalar() is True
+
+
+def include_object(partitioned):
+    """An Alembic ``include_object`` hook that leaves out the partitions and,
+    when ``partitioned``, the constraints partitioning replaces: the unique
+    document URL (unique per session instead) and the chunks' foreign key
+    (a trigger instead)."""
+    def include(object, name, type_, reflected, compare_to):
+        if type_ == 'table':
+            return not PARTITION_NAME.match(name)
+        if not partitioned:
+            return True
+        if type_ == 'unique_constraint':
+            return object.table.name != 'documents'
+        if type_ == 'foreign_key_constraint':
+            return not (object.table.name == 'document_chunks' and object.referred_table.name == 'documents')
+        return True
+    return include
+
+
+def _move_rows(connection, source, target, batch_size, blobs):
+    """Copy every row of ``source`` into ``target`` in id order; returns the row count."""
+    columns = ', '.join(COLUMNS + BLOB_COLUMNS if blobs else COLUMNS)
+    statement = sa.text(
+        f'INSERT INTO {target} ({columns}) '
+        f'SELECT {columns} FROM {source} WHERE id > :last_id ORDER BY id LIMIT :batch_size '
+        f'RETURNING id'
+    )
+    moved, last_id = 0, 0
+    while True:
+        ids = connection.execute(statement, {'last_id': last_id, 'batch_size': batch_size}).scalars().all()
+        if not ids:
+            return moved
+        moved += len(ids)
+        last_id = max(ids)
+
+
+def _swap_tables(connection, new_table):
+    """Replace documents with ``new_table``, keeping the id sequence."""
+    connection.execute(sa.text(f'ALTER SEQUENCE documents_id_seq OWNED BY {new_table}.id'))
+    connection.execute(sa.text('DROP TABLE documents'))
+    connection.execute(sa.text(f'ALTER TABLE {new_table} RENAME TO documents'))
+
+
+def partition_documents(connection, partitions, batch_size=1000):
+    """Turn documents into ``partitions`` hash partitions on session_id."""
+    if partitions < 2:
+        raise ValueError('Partitioning documents needs at least 2 partitions')
+    
+    def execute(statement):
+        connection.execute(sa.text(statement))
+    
+    execute('LOCK TABLE documents IN EXCLUSIVE MODE')
+    blobs = has_blob_columns(connection)
+    execute('CREATE TABLE documents_partitioned (LIKE documents INCLUDING DEFAULTS) '
+            'PARTITION BY HASH (session_id)')
+    for remainder in range(partitions):
+        execute(f'CREATE TABLE documents_p{remainder} PARTITION OF documents_partitioned '
+                f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})')
+    moved = _move_rows(connection, 'documents', 'documents_partitioned', batch_size, blobs)
+
+    execute('ALTER TABLE document_chunks DROP CONSTRAINT IF EXISTS document_chunks_document_id_fkey')
+    _swap_tables(connection, 'documents_partitioned')
+    execute('ALTER TABLE documents ADD CONSTRAINT documents_pkey PRIMARY KEY (id, session_id)')
+    execute('ALTER TABLE documents ADD CONSTRAINT documents_document_url_key '
+            'UNIQUE (document_url, session_id)')
+    execute(LISTING_INDEX)
+    if blobs:
+        execute(CONTENT_HASH_INDEX)
+    execute(SESSION_FOREIGN_KEY)
+    execute('''
+        CREATE OR REPLACE FUNCTION delete_document_chunks() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            DELETE FROM document_chunks WHERE document_id = OLD.id;
+            RETURN NULL;
+        END
+        $$
+    ''')
+    execute('CREATE TRIGGER documents_delete_chunks AFTER DELETE ON documents '
+            'FOR EACH ROW EXECUTE FUNCTION delete_document_chunks()')
+    return moved
+
+
+def unpartition_documents(connection, batch_size=1000):
+    """Turn a partitioned documents table back into a plain one."""
+    def execute(statement):
+        connection.execute(sa.text(statement))
+    
+    execute('LOCK TABLE documents IN EXCLUSIVE MODE')
+    blobs = has_blob_columns(connection)
+    execute('CREATE TABLE documents_plain (LIKE documents INCLUDING DEFAULTS)')
+    moved = _move_rows(connection, 'documents', 'documents_plain', batch_size, blobs)
+
+    _swap_tables(connection, 'documents_plain')
+    execute('DROP FUNCTION IF EXISTS delete_document_chunks()')
+    execute('ALTER TABLE documents ADD CONSTRAINT documents_pkey PRIMARY KEY (id)')
+    execute('ALTER TABLE documents ADD CONSTRAINT documents_document_url_key UNIQUE (document_url)')
+    execute(LISTING_INDEX)
+    if blobs:
+        execute(CONTENT_HASH_INDEX)
+    execute(SESSION_FOREIGN_KEY)
+    execute('ALTER TABLE document_chunks ADD CONSTRAINT document_chunks_document_id_fkey '
+            'FOREIGN KEY (document_id) REFERENCES documents (id) ON DELETE CASCADE')
+    return moved
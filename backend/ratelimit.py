@@ -0,0 +1,377 @@
+"""Rate limit storage shared by every worker process.
+
+``RespStorage`` is a ``limits`` storage that speaks the Redis protocol (RESP)
+with plain commands, so it works against Redis or against ``CounterServer``,
+a small in-process stand-in that listens on a Unix or TCP socket and needs no
+external service. Select it through ``RATELIMIT_STORAGE_URI``:
+
+    resp://localhost:6379              Redis, or a CounterServer on TCP
+    resp+unix:///tmp/limiter.sock      a CounterServer on a Unix socket
+
+Each hit is a single round trip: ``MULTI``, ``SET key 0 EX ttl NX``,
+``INCRBY`` and ``EXEC`` are written together, so the counter update and its
+expiry are atomic. Importing this module registers the schemes with ``limits``.
+"""
+import fnmatch
+import heapq
+import os
+import socket
+import socketserver
+import threading
+import time
+from urllib.parse import urlparse
+
+from limits.storage import Storage
+
+
+class RespError(Exception):
+    """An error reply from the server."""
+
+
+def _encode(*args):
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+def _read_reply(stream):
+    line = stream.readline()
+    if not line.endswith(b'\r\n'):
+        raise ConnectionError('Connection closed by server')
+    kind, body = line[:1], line[1:-2]
+    if kind == b'+':
+        return body.decode()
+    if kind == b'-':
+        return RespError(body.decode())
+    if kind == b':':
+        return int(body)
+    if kind == b'$':
+        length = int(body)
+        if length < 0:
+            return None
+        data = stream.read(length + 2)
+        return data[:-2]
+    if kind == b'*':
+        length = int(body)
+        if length < 0:
+            return None
+        return [_read_reply(stream) for _ in range(length)]
+    raise ConnectionError(f'Unexpected reply {line!r}')
+
+
+class RespClient:
+    """Minimal RESP client with one connection per thread."""
+
+    def __init__(self, address, timeout=1.0):
+        # address is a Unix socket path or a (host, port) tuple
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        if isinstance(self.address, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.timeout)
+        sock.connect(self.address)
+        return sock, sock.makefile('rb')
+
+    def pipeline(self, *commands):
+        """Send ``commands`` in one write and return their replies, in order."""
+        payload = b''.join(_encode(*command) for command in commands)
+        for attempt in range(2):
+            connection = getattr(self._local, 'connection', None)
+            try:
+                if connection is None:
+                    connection = self._local.connection = self._connect()
+                sock, stream = connection
+                sock.sendall(payload)
+                replies = [_read_reply(stream) for _ in commands]
+                break
+            except TimeoutError:
+                # The server may have applied the commands; resending could double count
+                self.close()
+                raise
+            except OSError:
+                # Stale connection (server restarted); reconnect once
+                self.close()
+                if attempt:
+                    raise
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def execute(self, *command):
+        return self.pipeline(command)[0]
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        if connection is not None:
+            connection[1].close()
+            connection[0].close()
+
+
+def _address(uri):
+    parsed = urlparse(uri)
+    if parsed.scheme == 'resp+unix':
+        return parsed.path
+    return (parsed.hostname or 'localhost', parsed.port or 6379)
+
+
+class RespStorage(Storage):
+    """Fixed and elastic window counters kept in a RESP server."""
+
+    STORAGE_SCHEME = ['resp', 'resp+unix']
+
+    def __init__(self, uri=None, timeout=1.0, **options):
+        self.client = RespClient(_address(uri), timeout=float(timeout))
+        super().__init__(uri, **options)
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        if elastic_expiry:
+            commands = [('INCRBY', key, amount), ('EXPIRE', key, expiry)]
+        else:
+            commands = [('SET', key, 0, 'EX', expiry, 'NX'), ('INCRBY', key, amount)]
+        replies = self.client.pipeline(('MULTI',), *commands, ('EXEC',))
+        results = replies[-1]
+        if results is None:
+            raise RespError('Transaction aborted')
+        for result in results:
+            if isinstance(result, RespError):
+                raise result
+        return results[0] if elastic_expiry else results[1]
+
+    def get(self, key):
+        value = self.client.execute('GET', key)
+        return int(value) if value is not None else 0
+
+    def get_expiry(self, key):
+        ttl = self.client.execute('PTTL', key)
+        return int(time.time() + max(ttl, 0) / 1000)
+
+    def check(self):
+        try:
+            return self.client.execute('PING') == 'PONG'
+        except OSError:
+            return False
+
+    def reset(self):
+        keys = self.client.execute('KEYS', 'LIMITER*')
+        if not keys:
+            return 0
+        return self.client.execute('DEL', *keys)
+
+    def clear(self, key):
+        self.client.execute('DEL', key)
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    # Restarts can rebind the port while old connections are in TIME_WAIT
+    allow_reuse_address = True
+
+
+class CounterServer:
+    """In-memory RESP server holding the limiter's counters for one host.
+
+    Supports the commands RespStorage sends. Every command, and every
+    MULTI/EXEC block as a whole, runs under one lock. Expired keys are dropped
+    when touched and swept every ``sweep_interval`` seconds; beyond
+    ``max_keys``, the key closest to expiring is evicted first.
+    """
+
+    def __init__(self, address, max_keys=100000, sweep_interval=1.0, timer=time.monotonic):
+        self.address = address
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+        self._timer = timer
+        self._data = {}
+        self._expiries = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._server = None
+        self._threads = []
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    # Storage
+    def _alive(self, key, now):
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item
+
+    def _expire(self, key, seconds, now):
+        expires_at = now + seconds
+        self._data[key][1] = expires_at
+        heapq.heappush(self._expiries, (expires_at, key))
+
+    def _make_room(self, now):
+        while len(self._data) >= self.max_keys and self._expiries:
+            expires_at, key = heapq.heappop(self._expiries)
+            item = self._data.get(key)
+            if item is not None and item[1] == expires_at:
+                del self._data[key]
+
+    def sweep(self):
+        """Drop expired keys; returns how many were removed."""
+        removed = 0
+        with self._lock:
+            now = self._timer()
+            while self._expiries and self._expiries[0][0] <= now:
+                expires_at, key = heapq.heappop(self._expiries)
+                item = self._data.get(key)
+                if item is not None and item[1] == expires_at:
+                    del self._data[key]
+                    removed += 1
+            # Rebuild if superseded expiries have piled up
+            if len(self._expiries) > 2 * len(self._data) + 1024:
+                self._expiries = [(item[1], key) for key, item in self._data.items() if item[1] is not None]
+                heapq.heapify(self._expiries)
+        return removed
+
+    def execute(self, command, now=None):
+        """Run one command (a list of bytes) with the lock held; returns the reply."""
+        now = self._timer() if now is None else now
+        name, args = command[0].upper(), command[1:]
+        try:
+            if name == b'PING':
+                return 'PONG'
+            if name == b'GET':
+                item = self._alive(args[0], now)
+                return None if item is None else str(item[0]).encode()
+            if name == b'SET':
+                key, value, options = args[0], int(args[1]), [arg.upper() for arg in args[2:]]
+                if b'NX' in options and self._alive(key, now) is not None:
+                    return None
+                if key not in self._data:
+                    self._make_room(now)
+                self._data[key] = [value, None]
+                if b'EX' in options:
+                    self._expire(key, int(options[options.index(b'EX') + 1]), now)
+                return 'OK'
+            if name == b'INCRBY':
+                key = args[0]
+                item = self._alive(key, now)
+                if item is None:
+                    self._make_room(now)
+                    item = self._data[key] = [0, None]
+                item[0] += int(args[1])
+                return item[0]
+            if name == b'EXPIRE':
+                if self._alive(args[0], now) is None:
+                    return 0
+                self._expire(args[0], int(args[1]), now)
+                return 1
+            if name == b'PTTL':
+                item = self._alive(args[0], now)
+                if item is None:
+                    return -2
+                return -1 if item[1] is None else int((item[1] - now) * 1000)
+            if name == b'DEL':
+                return sum(self._data.pop(key, None) is not None for key in args)
+            if name == b'KEYS':
+                pattern = args[0].decode()
+                return [key for key in list(self._data)
+                        if self._alive(key, now) is not None and fnmatch.fnmatchcase(key.decode(), pattern)]
+            if name == b'FLUSHDB':
+                self._data.clear()
+                self._expiries.clear()
+                return 'OK'
+        except (IndexError, ValueError):
+            return RespError(f'ERR wrong arguments for {name.decode().lower()}')
+        return RespError(f'ERR unknown command {name.decode().lower()}')
+
+    # Serving
+    def start(self):
+        """Listen on ``address`` and serve from background threads."""
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def setup(self):
+                super().setup()
+                if self.connection.family != socket.AF_UNIX:
+                    # Replies are small writes; don't hold them for ACKs
+                    self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def handle(self):
+                queued = None
+                while True:
+                    try:
+                        command = _read_reply(self.rfile)
+                    except (ConnectionError, ValueError, OSError):
+                        return
+                    name = command[0].upper() if command else b''
+                    if name == b'MULTI':
+                        queued, reply = [], 'OK'
+                    elif name == b'EXEC' and queued is None:
+                        reply = RespError('ERR EXEC without MULTI')
+                    elif name == b'EXEC':
+                        with server._lock:
+                            now = server._timer()
+                            reply = [server.execute(queued_command, now) for queued_command in queued]
+                        queued = None
+                    elif queued is not None:
+                        queued.append(command)
+                        reply = 'QUEUED'
+                    else:
+                        with server._lock:
+                            reply = server.execute(command)
+                    self.wfile.write(_encode_reply(reply))
+
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            self._server = socketserver.ThreadingUnixStreamServer(self.address, Handler)
+        else:
+            self._server = _TCPServer(self.address, Handler)
+            self.address = self._server.server_address
+        self._server.daemon_threads = True
+        self._stopped.clear()
+        self._threads = [
+            threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.1},
+                             name='counter-server', daemon=True),
+            threading.Thread(target=self._sweep_forever, name='counter-sweep', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def _sweep_forever(self):
+        while not self._stopped.wait(self.sweep_interval):
+            self.sweep()
+
+
+def _encode_reply(reply):
+    if reply is None:
+        return b'$-1\r\n'
+    if isinstance(reply, RespError):
+        return b'-%s\r\n' % str(reply).encode()
+    if isinstance(reply, str):
+        return b'+%s\r\n' % reply.encode()
+    if isinstance(reply, int):
+        return b':%d\r\n' % reply
+    if isinstance(reply, bytes):
+        return b'$%d\r\n%s\r\n' % (len(reply), reply)
+    return b'*%d\r\n' % len(reply) + b''.join(_encode_reply(item) for item in reply)
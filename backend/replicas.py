@@ -0,0 +1,94 @@
+"""Send read-only routes to replicas, with read-your-writes per session address.
+
+Routes decorated with ``ReplicaRouter.read_only`` run their queries on a
+replica picked per request; everything else, and every request made outside a
+decorated route, uses the primary. After a successful write to a session
+address, reads of that address go to the primary for ``sticky_seconds``, so a
+client never reads from a replica that hasn't replayed its save yet. Keep the
+window above the replicas' usual replay lag.
+
+The sticky marks live in a limits storage (Flask-Limiter's, by default), so
+they are shared by every worker when the limiter storage is.
+"""
+import functools
+import logging
+import random
+
+from flask import g, has_app_context, request
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import create_engine
+
+from database import configure_engine, engine_options
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+replica_reads = Counter('replica_reads_total', 'Read-only requests served by a replica')
+sticky_primary_reads = Counter('sticky_primary_reads_total', 'Read-only requests kept on the primary after a write')
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RoutingSession(FlaskSession):
+    """Binds to the replica chosen for the current request, if any."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and g.get('replica') is not None:
+            return g.replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaRouter:
+    def __init__(self, app, storage, urls=(), sticky_seconds=5):
+        self.storage = storage
+        self.sticky_seconds = sticky_seconds
+        self.engines = [configure_engine(create_engine(url, **engine_options())) for url in urls]
+        app.after_request(self._after_request)
+
+    def _key(self, address):
+        return f'replica-sticky/{address}'
+
+    def wrote(self, address):
+        """Keep reads of ``address`` on the primary for the next ``sticky_seconds``."""
+        if not self.engines:
+            return
+        try:
+            self.storage.incr(self._key(address), self.sticky_seconds, elastic_expiry=True)
+        except Exception:
+            # Without the mark a replica could serve a stale read; log it and move on
+            logger.exception('Could not mark %s as sticky', address)
+
+    def is_sticky(self, address):
+        try:
+            return self.storage.get(self._key(address)) > 0
+        except Exception:
+            logger.exception('Could not read the sticky mark of %s', address)
+            return True
+
+    def choose(self, address):
+        """The replica engine for a read of ``address``, or None for the primary."""
+        if not self.engines:
+            return None
+        if self.is_sticky(address):
+            sticky_primary_reads.inc()
+            return None
+        replica_reads.inc()
+        return random.choice(self.engines)
+
+    def engine(self, primary):
+        """The engine the current request reads from."""
+        return g.get('replica') or primary
+
+    def read_only(self, view):
+        """Run ``view``, which takes an ``address`` argument, on a replica."""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            g.replica = self.choose(kwargs['address'])
+            return view(*args, **kwargs)
+        return wrapper
+
+    def _after_request(self, response):
+        if request.method not in READ_METHODS and response.status_code < 400\
+                and request.view_args and 'address' in request.view_args:
+            self.wrote(request.view_args['address'])
+        return response
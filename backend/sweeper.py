@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select
+
+from metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+sessions_reclaimed = Counter('sessions_reclaimed_total', 'Expired sessions deleted by the sweeper')
+documents_reclaimed = Counter('documents_reclaimed_total', 'Documents deleted with expired sessions')
+sweeper_runs = Counter('session_sweeper_runs_total', 'Completed expired-session sweeps')
+last_run_sessions = Gauge('session_sweeper_last_run_sessions', 'Sessions deleted by the latest sweep')
+last_run_documents = Gauge('session_sweeper_last_run_documents', 'Documents deleted by the latest sweep')
+last_run_seconds = Gauge('session_sweeper_last_run_seconds', 'Duration of the latest sweep')
+
+
+class SweepResult:
+    def __init__(self):
+        self.sessions = 0
+        self.documents = 0
+        self.batches = 0
+        self.seconds = 0.0
+
+
+class SessionSweeper:
+    """Deletes sessions whose ``last_accessed`` is older than ``max_age`` seconds.
+
+    Each batch is one short transaction that claims up to ``batch_size``
+    expired sessions with ``FOR UPDATE SKIP LOCKED`` and deletes them with
+    their documents (chunks follow by cascade). Rows locked by live requests,
+    or by a sweeper in another worker, are skipped until the next run.
+    ``on_reclaimed`` is called with the ``(id, address)`` pairs of each batch,
+    and ``on_released`` with the blob store hashes its documents referenced.
+    """
+
+    def __init__(self, app, db, session_model, document_model, max_age, batch_size=100,
+                 interval=None, pause=0.0, on_reclaimed=None, on_released=None):
+        self.app = app
+        self.db = db
+        self.sessions = session_model.__table__
+        self.documents = document_model.__table__
+        self.max_age = timedelta(seconds=max_age)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pause = pause
+        self.on_reclaimed = on_reclaimed
+        self.on_released = on_released
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def sweep(self, now=None):
+        """Delete every expired session, batch by batch; returns a SweepResult."""
+        result = SweepResult()
+        started = time.perf_counter()
+        cutoff = (now or datetime.utcnow()) - self.max_age
+        while True:
+            with self.app.app_context(), self.db.engine.begin() as connection:
+                rows = connection.execute(self._delete_batch(cutoff)).all()
+            if not rows:
+                break
+            result.batches += 1
+            result.sessions += len(rows)
+            result.documents += rows[0].documents
+            if self.on_reclaimed:
+                self.on_reclaimed([(row.id, row.address) for row in rows])
+            if self.on_released and rows[0].content_hashes:
+                self.on_released(rows[0].content_hashes)
+            if len(rows) < self.batch_size:
+                break
+            if self.pause:
+                time.sleep(self.pause)
+        result.seconds = time.perf_counter() - started
+
+        sessions_reclaimed.inc(result.sessions)
+        documents_reclaimed.inc(result.documents)
+        sweeper_runs.inc()
+        last_run_sessions.set(result.sessions)
+        last_run_documents.set(result.documents)
+        last_run_seconds.set(result.seconds)
+        return result
+
+    def start(self):
+        """Sweep every ``interval`` seconds from a daemon thread, if configured."""
+        if self._thread is not None or self.interval is None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='session-sweeper', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _delete_batch(self, cutoff):
+        sessions, documents = self.sessions, self.documents
+        doomed = select(sessions.c.id)\
+            .where(sessions.c.last_accessed < cutoff)\
+            .order_by(sessions.c.last_accessed)\
+            .limit(self.batch_size)\
+            .with_for_update(skip_locked=True)\
+            .cte('doomed')
+        deleted_documents = delete(documents)\
+            .where(documents.c.session_id.in_(select(doomed.c.id)))\
+            .returning(documents.c.id, documents.c.content_hash)\
+            .cte('deleted_documents')
+        deleted_sessions = delete(sessions)\
+            .where(sessions.c.id.in_(select(doomed.c.id)))\
+            .returning(sessions.c.id, sessions.c.address)\
+            .cte('deleted_sessions')
+        document_count = select(func.count()).select_from(deleted_documents).scalar_subquery()
+        content_hashes = select(func.array_agg(deleted_documents.c.content_hash))\
+            .where(deleted_documents.c.content_hash.isnot(None))\
+            .scalar_subquery()
+        return select(deleted_sessions.c.id, deleted_sessions.c.address,
+                      document_count.label('documents'), content_hashes.label('content_hashes'))
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                result = self.sweep()
+                if result.sessions:
+                    logger.info('Reclaimed %d expired sessions and %d documents in %.2fs',
+                                result.sessions, result.documents, result.seconds)
+            except Exception:
+                logger.exception('Failed to sweep expired sessions')
@@ -2,19 +2,22 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import json
 import pytest
-from api import app, db, Document, Session
 from dotenv import load_dotenv
 
-@pytest.fixture(scope="session")
+# The engine is created when api is imported, so DATABASE_URL has to be set first
+backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+load_dotenv(os.path.join(backend, '.env'))
+load_dotenv(os.path.join(backend, f".env.{os.getenv('FLASK_ENV')}.local"))
+
+from api import app, db, Document, Session
+
+# query_budget fixture, see query_budget.py
+pytest_plugins = ['query_budget']
+
+@pytest.fixture
 def test_app():
-    # Configure app for testing
-    flask_env = os.getenv('FLASK_ENV')
-    
-    load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env'))
-    load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), f'.env.{flask_env}.local'))
-    
-    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
     app.config['TESTING'] = True
     
     # Create tables
@@ -53,4 +56,57 @@ def reset_rate_limits(test_app):
     """Reset rate limits before each test"""
     from api import limiter
     with test_app.app_context():
-        limiter.reset()
\ No newline at end of file
+        limiter.reset()
+
+@pytest.fixture(autouse=True)
+def clear_session_cache():
+    """Start each test with an empty address -> session cache and no pending touches"""
+    from api import session_cache, touch_buffer
+    session_cache.clear()
+    yield
+    touch_buffer.stop()
+
+class ASGITestClient:
+    """Drives asgi.app with the Flask test client's call signature."""
+    
+    class Response:
+        def __init__(self, response):
+            self.status_code = response.status_code
+            self.headers = response.headers
+            self.data = response.content
+            self.mimetype = response.headers.get('content-type', '').split(';')[0]
+        
+        def get_json(self):
+            return json.loads(self.data)
+    
+    def __init__(self, client):
+        self.client = client
+    
+    def open(self, url, method='GET', json=None, data=None, headers=None, content_type=None):
+        headers = dict(headers or {})
+        if content_type:
+            headers['Content-Type'] = content_type
+        response = self.client.request(method, url, json=json, content=data, headers=headers)
+        return self.Response(response)
+    
+    def get(self, url, **kwargs):
+        return self.open(url, 'GET', **kwargs)
+    
+    def post(self, url, **kwargs):
+        return self.open(url, 'POST', **kwargs)
+    
+    def put(self, url, **kwargs):
+        return self.open(url, 'PUT', **kwargs)
+    
+    def patch(self, url, **kwargs):
+        return self.open(url, 'PATCH', **kwargs)
+    
+    def delete(self, url, **kwargs):
+        return self.open(url, 'DELETE', **kwargs)
+
+@pytest.fixture
+def asgi_client(test_app):
+    from starlette.testclient import TestClient
+    from asgi import app as asgi_app
+    with TestClient(asgi_app) as client:
+        yield ASGITestClient(client)
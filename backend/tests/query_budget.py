@@ -0,0 +1,97 @@
+"""Query budgets: fail a test when a block runs more SQL than it declares.
+
+    def test_get_document(test_client, query_budget):
+        with query_budget(1) as queries:
+            test_client.get('/api/sessions/address/documents/url')
+        assert 'encrypted_content' not in queries.statements[0]
+
+Statements are counted on every engine, so the ASGI mode's async engine and
+the replicas count too. ``rows`` and ``bytes`` budgets also count what is
+fetched: every row, and the length of its text and binary values. Loaded by
+conftest.py through ``pytest_plugins``.
+"""
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_SIZED = (str, bytes, bytearray, memoryview)
+
+
+class _CountingCursor:
+    """A DBAPI cursor that adds the rows and bytes it fetches to ``budget``."""
+
+    def __init__(self, cursor, budget):
+        self._cursor = cursor
+        self._budget = budget
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        for row in self._cursor:
+            yield self._count([row])[0]
+
+    def _count(self, rows):
+        budget = self._budget
+        budget.rows += len(rows)
+        for row in rows:
+            budget.bytes += sum(len(value) for value in row if isinstance(value, _SIZED))
+        return rows
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._count([row])
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        return self._count(self._cursor.fetchmany(*args, **kwargs))
+
+    def fetchall(self):
+        return self._count(self._cursor.fetchall())
+
+
+class QueryBudget:
+    """Counts the SQL run inside the block, and fails the test on leaving it
+    if any of the given limits was exceeded."""
+
+    def __init__(self, statements=None, rows=None, bytes=None):
+        self.limits = {'statements': statements, 'rows': rows, 'bytes': bytes}
+        self.statements = []
+        self.rows = 0
+        self.bytes = 0
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        if self.limits['rows'] is not None or self.limits['bytes'] is not None:
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event.remove(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        if event.contains(Engine, 'after_cursor_execute', self._after_cursor_execute):
+            event.remove(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        if exc_type is None:
+            self.check()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Results are read from context.cursor once this returns
+        if context is not None and context.cursor is cursor and cursor.description is not None:
+            context.cursor = _CountingCursor(cursor, self)
+
+    def check(self):
+        spent = {'statements': len(self.statements), 'rows': self.rows, 'bytes': self.bytes}
+        over = [f'{spent[name]} {name} (budget {limit})' for name, limit in self.limits.items()
+                if limit is not None and spent[name] > limit]
+        if over:
+            listing = '\n'.join(f'  {i}. {statement}' for i, statement in enumerate(self.statements, 1))
+            pytest.fail(f"Query budget exceeded: {', '.join(over)}\n{listing}", pytrace=False)
+
+
+@pytest.fixture
+def query_budget():
+    """``with query_budget(statements, rows=None, bytes=None) as queries:``"""
+    return QueryBudget
@@ -0,0 +1,155 @@
+import json
+import threading
+import time
+from datetime import datetime
+import pytest
+from api import autosaves, db, documents_changed, Document, Session
+from autosave import autosaves_received, autosaves_superseded, autosaves_written, writes_saved_ratio
+
+@pytest.fixture
+def coalescing(test_app):
+    autosaves.window = 0.5
+    yield autosaves
+    autosaves.stop()
+    autosaves.window = None
+
+@pytest.fixture
+def document_url(test_app):
+    client = test_app.test_client()
+    client.post('/api/sessions', json={'address': 'test_address'})
+    response = client.post('/api/sessions/test_address/documents',
+                           json={'encryptedTitle': 'title', 'encryptedContent': 'content 0'})
+    return json.loads(response.data)['data']['id']
+
+def stored(test_app, document_url):
+    with test_app.app_context():
+        return db.session.query(Document.encrypted_content, Document.last_modified)\
+            .filter_by(document_url=document_url).one()
+
+def test_rapid_saves_are_written_once(test_app, coalescing, document_url, query_budget):
+    client = test_app.test_client()
+    url = f'/api/sessions/test_address/documents/{document_url}'
+    received, written = autosaves_received.value, autosaves_written.value
+    
+    for i in range(1, 6):
+        # Acknowledged straight away, without writing
+        with query_budget(1):
+            response = client.put(url, json={'encryptedTitle': 'title', 'encryptedContent': f'content {i}'})
+        assert response.status_code == 200
+        assert json.loads(response.data)['data']['encryptedContent'] == f'content {i}'
+    assert stored(test_app, document_url).encrypted_content == 'content 0'
+    
+    # Resending the pending save is skipped like any unchanged save
+    response = client.put(url, json={'encryptedTitle': 'title', 'encryptedContent': 'content 5'})
+    last_modified = json.loads(response.data)['data']['lastModified']
+    assert autosaves_received.value == received + 5
+    
+    # Only the latest is written, within the window
+    time.sleep(1)
+    assert coalescing.pending('test_address', document_url) is None
+    content, stored_modified = stored(test_app, document_url)
+    assert content == 'content 5'
+    assert stored_modified.isoformat() == last_modified
+    assert autosaves_written.value == written + 1
+    assert 0 < writes_saved_ratio.function() < 1
+
+def test_reads_see_pending_saves(test_app, coalescing, document_url):
+    client = test_app.test_client()
+    url = f'/api/sessions/test_address/documents/{document_url}'
+    client.put(url, json={'encryptedTitle': 'title', 'encryptedContent': 'content 1'})
+    assert coalescing.pending('test_address', document_url) is not None
+    
+    data = json.loads(client.get(url).data)['data']
+    assert data['encryptedContent'] == 'content 1'
+    listing = json.loads(client.get('/api/sessions/test_address/documents').data)['data']
+    assert listing['documents'][0]['encryptedContent'] == 'content 1'
+    
+    # Partial updates are written in order after the pending save
+    client.put(url, json={'encryptedTitle': 'title', 'encryptedContent': 'content 2'})
+    response = client.put(url, json={'encryptedTitle': 'renamed'})
+    assert json.loads(response.data)['data']['encryptedContent'] == 'content 2'
+    assert stored(test_app, document_url).encrypted_content == 'content 2'
+
+def test_pending_saves_are_written_on_stop(test_app, coalescing, document_url):
+    client = test_app.test_client()
+    url = f'/api/sessions/test_address/documents/{document_url}'
+    client.put(url, json={'encryptedTitle': 'title', 'encryptedContent': 'content 1'})
+    
+    coalescing.stop()
+    assert stored(test_app, document_url).encrypted_content == 'content 1'
+
+def test_delayed_saves_never_overwrite_newer_rows(test_app, coalescing, document_url):
+    client = test_app.test_client()
+    url = f'/api/sessions/test_address/documents/{document_url}'
+    client.put(url, json={'encryptedTitle': 'title', 'encryptedContent': 'content 1'})
+    
+    # Another worker writes a newer version meanwhile
+    with test_app.app_context():
+        db.session.execute(Document.__table__.update().where(Document.document_url == document_url)
+                           .values(encrypted_content='elsewhere', last_modified=datetime.utcnow()))
+        db.session.commit()
+    
+    written, superseded = autosaves_written.value, autosaves_superseded.value
+    assert coalescing.flush() == 0
+    assert stored(test_app, document_url).encrypted_content == 'elsewhere'
+    # Counted as superseded, not written
+    assert autosaves_written.value == written
+    assert autosaves_superseded.value == superseded + 1
+
+def test_written_saves_change_the_listing_etag(test_app, coalescing, document_url, monkeypatch):
+    client = test_app.test_client()
+    listing = '/api/sessions/test_address/documents?fields=metadata'
+    client.put(f'/api/sessions/test_address/documents/{document_url}',
+               json={'encryptedTitle': 'title', 'encryptedContent': 'content 1'})
+    
+    # Another worker writes a newer document, then serves a listing without
+    # this worker's pending save
+    with test_app.app_context():
+        session_id = db.session.query(Session.id).filter_by(address='test_address').scalar()
+        db.session.add(Document(document_url='elsewhere', encrypted_title='title',
+                                encrypted_content='content', session_id=session_id))
+        db.session.execute(documents_changed([session_id]))
+        db.session.commit()
+    with monkeypatch.context() as patch:
+        patch.setattr(coalescing, 'flush', lambda *args, **kwargs: 0)
+        etag = client.get(listing).headers['ETag']
+    
+    # Written with an older last_modified than the newest document
+    coalescing.flush()
+    assert client.get(listing, headers={'If-None-Match': etag}).status_code == 200
+
+def test_flushes_wait_only_for_their_own_address(test_app, coalescing, document_url, monkeypatch):
+    client = test_app.test_client()
+    client.put(f'/api/sessions/test_address/documents/{document_url}',
+               json={'encryptedTitle': 'title', 'encryptedContent': 'content 1'})
+    writing, release = threading.Event(), threading.Event()
+    write = coalescing._write
+    
+    def slow_write(taken):
+        writing.set()
+        release.wait(5)
+        return write(taken)
+    monkeypatch.setattr(coalescing, '_write', slow_write)
+    flushing = threading.Thread(target=coalescing.flush, args=('test_address',))
+    flushing.start()
+    assert writing.wait(5)
+    
+    # Another session's requests don't queue behind the write
+    assert coalescing.flush('other_address') == 0
+    # The same session's do, until its saves are visible
+    waiting = threading.Thread(target=coalescing.flush, args=('test_address',))
+    waiting.start()
+    waiting.join(0.2)
+    assert waiting.is_alive()
+    release.set()
+    flushing.join()
+    waiting.join(5)
+    assert not waiting.is_alive()
+    assert stored(test_app, document_url).encrypted_content == 'content 1'
+
+def test_coalescing_is_off_by_default(test_app, document_url):
+    assert not autosaves.enabled
+    client = test_app.test_client()
+    client.put(f'/api/sessions/test_address/documents/{document_url}',
+               json={'encryptedTitle': 'title', 'encryptedContent': 'content 1'})
+    assert stored(test_app, document_url).encrypted_content == 'content 1'
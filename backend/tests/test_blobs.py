@@ -0,0 +1,157 @@
+import base64
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timedelta
+import pytest
+from api import blob_store, db, sweeper, Session, Document
+from blobs import BlobStore
+from serialize import dumps
+
+# A CryptoJS envelope, whose quotes are escaped in the stored JSON string
+LARGE = json.dumps({'iv': '0' * 32, 'content': base64.b64encode(os.urandom(3000)).decode()},
+                   separators=(',', ':'))
+
+@pytest.fixture
+def blobs(test_app, tmp_path):
+    blob_store.root, blob_store.threshold, blob_store.grace = str(tmp_path), 1024, 0
+    yield blob_store
+    blob_store.root, blob_store.threshold, blob_store.grace = None, 256 * 1024, 60
+
+@pytest.fixture(params=['wsgi', 'asgi'])
+def test_client(request, test_app, blobs):
+    client = request.getfixturevalue('asgi_client') if request.param == 'asgi' else test_app.test_client()
+    client.post('/api/sessions', json={'address': 'test_address'})
+    return client
+
+def create(client, content):
+    response = client.post('/api/sessions/test_address/documents',
+                           json={'encryptedTitle': 'title', 'encryptedContent': content})
+    return json.loads(response.data)['data']['id']
+
+def stored(test_app, document_url):
+    with test_app.app_context():
+        return db.session.query(Document.encrypted_content, Document.content_hash, Document.content_length)\
+            .filter_by(document_url=document_url).one()
+
+def test_large_content_goes_to_the_blob_store(test_app, test_client, blobs):
+    small, large = create(test_client, 'small'), create(test_client, LARGE)
+    
+    assert stored(test_app, small) == ('small', None, None)
+    content, content_hash, content_length = stored(test_app, large)
+    data = dumps(LARGE)
+    assert content == ''
+    assert content_hash == hashlib.sha256(data).digest() and content_length == len(data)
+    with open(blobs.path(content_hash), 'rb') as file:
+        assert file.read() == data
+
+def test_blob_documents_read_like_any_other(test_app, test_client):
+    document_url = create(test_client, LARGE)
+    url = f'/api/sessions/test_address/documents/{document_url}'
+    
+    response = test_client.get(url)
+    assert response.status_code == 200
+    assert int(response.headers['Content-Length']) == len(response.data)
+    document = json.loads(response.data)['data']
+    assert list(document) == ['id', 'encryptedTitle', 'encryptedContent', 'createdAt', 'lastModified']
+    assert document['encryptedContent'] == LARGE
+    assert test_client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    
+    listing = json.loads(test_client.get('/api/sessions/test_address/documents').data)['data']
+    assert listing['documents'][0]['encryptedContent'] == LARGE
+    batch = test_client.post('/api/sessions/test_address/documents/batch',
+                             json={'operations': [{'op': 'get', 'id': document_url}]})
+    assert json.loads(batch.data)['data']['results'][0]['data']['encryptedContent'] == LARGE
+    
+    # Renaming keeps the content where it is
+    response = test_client.put(url, json={'encryptedTitle': 'renamed'})
+    assert json.loads(response.data)['data']['encryptedContent'] == LARGE
+    assert stored(test_app, document_url).content_hash is not None
+
+def test_get_streams_the_blob(test_app, blobs):
+    client = test_app.test_client()
+    client.post('/api/sessions', json={'address': 'test_address'})
+    document_url = create(client, LARGE)
+    
+    response = client.get(f'/api/sessions/test_address/documents/{document_url}')
+    assert response.is_streamed
+    assert json.loads(response.data)['data']['encryptedContent'] == LARGE
+    
+    # Compressed as it streams
+    response = client.get(f'/api/sessions/test_address/documents/{document_url}',
+                          headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+
+def test_replaced_and_deleted_blobs_are_collected(test_app, test_client, blobs):
+    first, second = create(test_client, LARGE), create(test_client, LARGE)
+    path = blobs.path(stored(test_app, first).content_hash)
+    
+    # Identical ciphertexts share a blob, which stays while either uses it
+    test_client.put(f'/api/sessions/test_address/documents/{first}',
+                    json={'encryptedTitle': 'title', 'encryptedContent': 'small'})
+    assert stored(test_app, first) == ('small', None, None)
+    assert os.path.exists(path)
+    
+    test_client.delete(f'/api/sessions/test_address/documents/{second}')
+    assert not os.path.exists(path)
+    
+    create(test_client, LARGE)
+    assert os.path.exists(path)
+    test_client.delete('/api/sessions/test_address')
+    assert not os.path.exists(path)
+
+def test_batch_writes_and_deletes_blobs(test_app, test_client, blobs):
+    response = test_client.post('/api/sessions/test_address/documents/batch',
+                                json={'operations': [{'op': 'create', 'encryptedTitle': 'title',
+                                                      'encryptedContent': LARGE}]})
+    document_url = json.loads(response.data)['data']['results'][0]['data']['id']
+    path = blobs.path(stored(test_app, document_url).content_hash)
+    assert os.path.exists(path)
+    
+    test_client.post('/api/sessions/test_address/documents/batch',
+                     json={'operations': [{'op': 'delete', 'id': document_url}]})
+    assert not os.path.exists(path)
+
+def test_export_and_import_keep_blobs(test_app, test_client):
+    document_url = create(test_client, LARGE)
+    exported = test_client.get('/api/sessions/test_address/export').data
+    assert json.loads(exported)['encryptedContent'] == LARGE
+    
+    test_client.post('/api/sessions', json={'address': 'other_address'})
+    test_client.post('/api/sessions/other_address/import', data=exported, content_type='application/x-ndjson')
+    with test_app.app_context():
+        hashes = db.session.query(Document.content_hash).order_by(Document.id).all()
+    assert len(hashes) == 2 and hashes[0] == hashes[1] == (stored(test_app, document_url).content_hash,)
+
+def test_recent_blobs_are_kept(test_app, tmp_path):
+    store = BlobStore(str(tmp_path / 'store'), grace=60)
+    digest = store.put(b'"orphan"')
+    with test_app.app_context(), db.engine.connect() as connection:
+        assert store.collect(connection, Document.content_hash, [digest]) == 0
+        assert os.path.exists(store.path(digest))
+    
+        old = time.time() - 120
+        os.utime(store.path(digest), (old, old))
+        assert store.collect(connection, Document.content_hash, [digest]) == 1
+        assert not os.path.exists(store.path(digest))
+
+def test_collect_blobs_command(test_app, test_client, blobs):
+    document_url = create(test_client, LARGE)
+    orphan = blobs.put(b'"orphan"')
+    
+    result = test_app.test_cli_runner().invoke(args=['collect-blobs'])
+    assert result.exit_code == 0
+    assert 'Deleted 1 unreferenced blobs' in result.output
+    assert not os.path.exists(blobs.path(orphan))
+    assert os.path.exists(blobs.path(stored(test_app, document_url).content_hash))
+
+def test_sweeper_collects_blobs(test_app, test_client, blobs):
+    path = blobs.path(stored(test_app, create(test_client, LARGE)).content_hash)
+    with test_app.app_context():
+        db.session.query(Session).update({'last_accessed': datetime.utcnow() - timedelta(days=1)})
+        db.session.commit()
+    
+    assert sweeper.sweep().documents == 1
+    assert not os.path.exists(path)
@@ -0,0 +1,37 @@
+import base64
+import json
+import os
+import pytest
+from ciphertext import pack, unpack, BASE64, CRYPTOJS, UTF8
+
+def cryptojs_envelope(size):
+    content = base64.b64encode(b'Salted__' + os.urandom(size)).decode()
+    return json.dumps({'iv': os.urandom(16).hex(), 'content': content}, separators=(',', ':'))
+
+def test_cryptojs_envelope_is_stored_as_raw_bytes():
+    text = cryptojs_envelope(100)
+    packed = pack(text)
+    assert packed[0] == CRYPTOJS
+    assert len(packed) == 1 + 16 + 8 + 100
+    assert unpack(packed) == text
+
+def test_base64_is_stored_as_raw_bytes():
+    text = base64.b64encode(os.urandom(30)).decode()
+    packed = pack(text)
+    assert packed[0] == BASE64
+    assert len(packed) == 31
+    assert unpack(packed) == text
+
+@pytest.mark.parametrize('text', [
+    '{"content": "test_content"}',
+    '{"iv":"00112233445566778899AABBCCDDEEFF","content":"AAAA"}',
+    '{"iv":"00112233445566778899aabbccddeeff","content":"AAA"}',
+    'AAB=',
+    'not base64 at all',
+    'ünïcode',
+    '',
+])
+def test_anything_else_round_trips_as_utf8(text):
+    packed = pack(text)
+    assert packed[0] == UTF8
+    assert unpack(packed) == text
@@ -0,0 +1,117 @@
+import gzip
+import json
+import pytest
+import brotli
+import zstandard
+from flask import Flask
+from compress import Compress
+from api import db, Session, Document
+
+@pytest.fixture(autouse=True)
+def test_document(test_app):
+    with test_app.app_context():
+        session = Session(address='test_address')
+        db.session.add(session)
+        db.session.commit()
+        db.session.add(Document(
+            document_url='test_doc_url',
+            encrypted_content='{"content": "%s"}' % ('a' * 4096),
+            encrypted_title='{"title": "test_title"}',
+            session_id=session.id
+        ))
+        db.session.commit()
+
+DECOMPRESS = {
+    'gzip': gzip.decompress,
+    'br': brotli.decompress,
+    'zstd': lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+}
+
+@pytest.mark.parametrize('accept, expected', [
+    ('gzip', 'gzip'),
+    ('br', 'br'),
+    ('zstd', 'zstd'),
+    ('gzip, br, zstd', 'zstd'),
+    ('gzip;q=1.0, zstd;q=0.5', 'gzip'),
+])
+def test_response_is_compressed_as_negotiated(test_client, accept, expected):
+    response = test_client.get('/api/sessions/test_address/documents/test_doc_url',
+                               headers={'Accept-Encoding': accept})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == expected
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.headers['ETag'].startswith('W/')
+    
+    data = json.loads(DECOMPRESS[expected](response.data))
+    assert data['data']['encryptedContent'] == '{"content": "%s"}' % ('a' * 4096)
+
+def test_small_and_unaccepted_responses_are_not_compressed(test_client):
+    response = test_client.get('/api/sessions/test_address', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    
+    response = test_client.get('/api/sessions/test_address/documents/test_doc_url')
+    assert 'Content-Encoding' not in response.headers
+    
+    response = test_client.get('/api/sessions/test_address/documents/test_doc_url',
+                               headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+
+def test_compressed_response_revalidates(test_client):
+    url = '/api/sessions/test_address/documents/test_doc_url'
+    etag = test_client.get(url, headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+    response = test_client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
+
+def test_streamed_response_is_compressed():
+    stream_app = Flask(__name__)
+    Compress(stream_app)
+    
+    @stream_app.route('/stream')
+    def stream():
+        return stream_app.response_class((f'{{"line": {i}}}\n' for i in range(1000)),
+                                         mimetype='application/x-ndjson')
+    
+    response = stream_app.test_client().get('/stream', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    lines = gzip.decompress(response.data).decode().splitlines()
+    assert len(lines) == 1000
+
+@pytest.mark.parametrize('encoding, compress', [
+    ('gzip', gzip.compress),
+    ('br', brotli.compress),
+    ('zstd', lambda data: zstandard.ZstdCompressor().compress(data)),
+])
+def test_compressed_request_body(test_client, encoding, compress):
+    body = json.dumps({'encryptedContent': 'x' * 100000, 'encryptedTitle': 'title'}).encode()
+    response = test_client.post('/api/sessions/test_address/documents', data=compress(body),
+                                headers={'Content-Encoding': encoding, 'Content-Type': 'application/json'})
+    assert response.status_code == 200
+    assert json.loads(response.data)['data']['encryptedContent'] == 'x' * 100000
+
+def test_compressed_request_body_limits(test_app, test_client):
+    url = '/api/sessions/test_address/documents'
+    headers = {'Content-Type': 'application/json'}
+    
+    response = test_client.post(url, data=b'{}', headers={**headers, 'Content-Encoding': 'compress'})
+    assert response.status_code == 415
+    
+    response = test_client.post(url, data=b'not gzip', headers={**headers, 'Content-Encoding': 'gzip'})
+    assert response.status_code == 400
+    
+    limit = test_app.config['COMPRESS_MAX_REQUEST_SIZE']
+    test_app.config['COMPRESS_MAX_REQUEST_SIZE'] = 1024
+    try:
+        response = test_client.post(url, data=gzip.compress(b' ' * 1024 * 1024),
+                                    headers={**headers, 'Content-Encoding': 'gzip'})
+        assert response.status_code == 413
+    finally:
+        test_app.config['COMPRESS_MAX_REQUEST_SIZE'] = limit
+
+def test_rate_limited_request_body_is_not_decompressed(test_client):
+    headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+    for _ in range(5):
+        test_client.get('/api/sessions/test_address/export')
+    
+    # Rejected before anything reads the body, so it isn't found corrupt
+    response = test_client.get('/api/sessions/test_address/export', data=b'not gzip', headers=headers)
+    assert response.status_code == 429
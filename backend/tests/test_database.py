@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+import pytest
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.engine.default import CACHE_HIT
+from sqlalchemy.ext.asyncio import create_async_engine
+from api import db
+from asgi import async_url
+from database import (configure_engine, database_url, engine_options, pool_checkouts, pool_timeouts,
+                      pool_wait_seconds, TimedAsyncQueuePool, TimedQueuePool)
+
+@pytest.fixture
+def url(test_app):
+    with test_app.app_context():
+        return db.engine.url
+
+def make_engine(url, environ):
+    return configure_engine(create_engine(url, **engine_options(environ)), environ)
+
+def test_engine_options_from_environment():
+    options = engine_options({
+        'DB_POOL_SIZE': '20', 'DB_MAX_OVERFLOW': '0', 'DB_POOL_TIMEOUT': '2.5',
+        'DB_POOL_RECYCLE': '-1', 'DB_POOL_PRE_PING': 'true', 'DB_STATEMENT_TIMEOUT': '5000'
+    })
+    assert options['poolclass'] is TimedQueuePool
+    assert (options['pool_size'], options['max_overflow'], options['pool_timeout']) == (20, 0, 2.5)
+    assert (options['pool_recycle'], options['pool_pre_ping']) == (-1, True)
+    assert options['connect_args'] == {'options': '-c statement_timeout=5000'}
+    
+    # Defaults, which the environment still overrides
+    options = engine_options({}, pool_size=10)
+    assert (options['pool_size'], options['max_overflow'], options['pool_pre_ping']) == (10, 10, False)
+    assert engine_options({'DB_POOL_SIZE': '3'}, pool_size=10)['pool_size'] == 3
+    assert engine_options({'DB_STATEMENT_TIMEOUT': '0'})['connect_args'] == {}
+    
+    assert database_url({}) == 'postgresql://localhost/securenotes'
+    assert database_url({'DATABASE_URL': 'postgresql://db/notes'}) == 'postgresql://db/notes'
+
+def test_engine_options_for_pgbouncer():
+    # No startup parameters and no prepared statements outlive a transaction
+    assert engine_options({'DB_PGBOUNCER': '1'})['connect_args'] == {}
+    options = engine_options({'DB_PGBOUNCER': '1'}, asynchronous=True)
+    assert options['poolclass'] is TimedAsyncQueuePool
+    connect_args = options['connect_args']
+    assert (connect_args['statement_cache_size'], connect_args['prepared_statement_cache_size']) == (0, 0)
+    assert connect_args['prepared_statement_name_func']() != connect_args['prepared_statement_name_func']()
+    
+    connect_args = engine_options({'DB_STATEMENT_CACHE_SIZE': '50'}, asynchronous=True)['connect_args']
+    assert connect_args == {'prepared_statement_cache_size': 50,
+                            'server_settings': {'statement_timeout': '30000'}}
+
+@pytest.mark.parametrize('pgbouncer', ['0', '1'])
+def test_statement_timeout(url, pgbouncer):
+    engine = make_engine(url, {'DB_STATEMENT_TIMEOUT': '100', 'DB_PGBOUNCER': pgbouncer})
+    try:
+        with engine.connect() as connection:
+            assert connection.execute(text('SHOW statement_timeout')).scalar() == '100ms'
+            with pytest.raises(exc.OperationalError, match='statement timeout'):
+                connection.execute(text('SELECT pg_sleep(1)'))
+    finally:
+        engine.dispose()
+
+@pytest.mark.parametrize('pgbouncer', ['0', '1'])
+def test_async_statement_timeout(url, pgbouncer):
+    environ = {'DB_STATEMENT_TIMEOUT': '100', 'DB_PGBOUNCER': pgbouncer}
+    
+    async def run():
+        engine = create_async_engine(async_url(url), **engine_options(environ, asynchronous=True))
+        configure_engine(engine.sync_engine, environ)
+        try:
+            async with engine.connect() as connection:
+                # Twice, so a cached prepared statement would be reused
+                for _ in range(2):
+                    assert (await connection.execute(text('SHOW statement_timeout'))).scalar() == '100ms'
+                with pytest.raises(exc.DBAPIError, match='statement timeout'):
+                    await connection.execute(text('SELECT pg_sleep(1)'))
+        finally:
+            await engine.dispose()
+    
+    asyncio.run(run())
+
+def test_pool_checkout_wait_is_measured(url):
+    engine = make_engine(url, {'DB_POOL_SIZE': '1', 'DB_MAX_OVERFLOW': '0', 'DB_POOL_TIMEOUT': '0.2'})
+    try:
+        checkouts, waited, timeouts = pool_checkouts.value, pool_wait_seconds.value, pool_timeouts.value
+        held = engine.connect()
+    
+        # The only connection is busy: the next checkout waits, then times out
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+        assert pool_timeouts.value == timeouts + 1
+        assert pool_wait_seconds.value - waited >= 0.2
+    
+        waited = pool_wait_seconds.value
+        threading.Timer(0.1, held.close).start()
+        with engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+        assert pool_wait_seconds.value - waited >= 0.1
+        assert pool_checkouts.value == checkouts + 3
+    finally:
+        engine.dispose()
+
+def test_pool_timeout_is_a_503(test_app):
+    client = test_app.test_client()
+    with test_app.app_context():
+        def exhausted(*args):
+            raise exc.TimeoutError('QueuePool limit reached')
+        event.listen(db.engine, 'before_cursor_execute', exhausted)
+        try:
+            response = client.get('/api/sessions/test_address')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', exhausted)
+    assert response.status_code == 503
+    assert response.get_json() == {'error': 'Database busy'}
+    assert response.headers['Retry-After'] == '1'
+
+def test_route_statements_are_cached(test_app):
+    client = test_app.test_client()
+    client.post('/api/sessions', json={'address': 'cached_statements'})
+    created = client.post('/api/sessions/cached_statements/documents',
+                          json={'encryptedTitle': 'title', 'encryptedContent': 'content'}).get_json()['data']
+    url = f"/api/sessions/cached_statements/documents/{created['id']}"
+    requests = [
+        lambda: client.get(url),
+        lambda: client.get('/api/sessions/cached_statements/documents'),
+        lambda: client.put(url, json={'encryptedTitle': f'title {time.time()}'}),
+    ]
+    for request in requests:
+        request()
+    
+    # Once warm, the fixed queries are never compiled again
+    misses = []
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context.cache_hit is not CACHE_HIT:
+            misses.append(statement)
+    
+    with test_app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            for request in requests:
+                assert request().status_code == 200
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    assert misses == []
+    assert client.delete('/api/sessions/cached_statements').status_code == 200
@@ -1,24 +1,15 @@
 import pytest
 import json
-from datetime import datetime
-from api import app, db, Session, Document
+import time
+from datetime import datetime, timedelta, timezone
+from werkzeug.http import http_date
+from api import db, Session, Document
 
-@pytest.fixture
-def test_app():
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://localhost/securenotes_test'
-    app.config['TESTING'] = True
-    
-    with app.app_context():
-        db.create_all()
-        
-    yield app
-    
-    with app.app_context():
-        db.session.remove()
-        db.drop_all()
-
-@pytest.fixture
-def test_client(test_app):
+# Every endpoint test runs against both serving modes
+@pytest.fixture(params=['wsgi', 'asgi'])
+def test_client(request, test_app):
+    if request.param == 'asgi':
+        return request.getfixturevalue('asgi_client')
     return test_app.test_client()
 
 @pytest.fixture
@@ -203,4 +194,598 @@ def test_pagination(test_app, test_client, test_session):
         # Test second page
         response = test_client.get(f'/api/sessions/test_address/documents?page=2')
         data = json.loads(response.data)
-        assert len(data['data']['documents']) == 5
\ No newline at end of file
+        assert len(data['data']['documents']) == 5
+
+def test_get_document_resolves_session_and_document_in_one_query(test_app, test_client, test_session, query_budget):
+    with test_app.app_context():
+        session = db.session.query(Session).filter_by(address='test_address').first()
+        doc = Document(
+            document_url='test_doc_url',
+            encrypted_content='{"content": "test_content"}',
+            encrypted_title='{"title": "test_title"}',
+            session_id=session.id
+        )
+        db.session.add(doc)
+        db.session.commit()
+        
+        with query_budget(1):
+            response = test_client.get('/api/sessions/test_address/documents/test_doc_url')
+        assert response.status_code == 200
+        
+        # The session id is cached now, so only the document is fetched
+        with query_budget(1) as queries:
+            response = test_client.get('/api/sessions/test_address/documents/test_doc_url')
+        assert response.status_code == 200
+        assert 'sessions' not in queries.statements[0]
+
+def test_get_document_distinguishes_missing_session_and_document(test_app, test_client, test_session):
+    response = test_client.get('/api/sessions/nonexistent/documents/test_doc_url')
+    assert response.status_code == 404
+    assert json.loads(response.data)['error'] == 'Session not found'
+    
+    response = test_client.get('/api/sessions/test_address/documents/nonexistent')
+    assert response.status_code == 404
+    assert json.loads(response.data)['error'] == 'Document not found'
+
+def test_end_session_clears_session_cache(test_app, test_client):
+    from api import session_cache
+    test_client.post('/api/sessions', json={'address': 'cached_address'})
+    assert test_client.get('/api/sessions/cached_address/documents').status_code == 200
+    assert session_cache.get('cached_address') is not None
+    
+    assert test_client.delete('/api/sessions/cached_address').status_code == 200
+    assert session_cache.get('cached_address') is None
+    assert test_client.get('/api/sessions/cached_address/documents').status_code == 404
+
+def test_get_documents_metadata_skips_content(test_app, test_client, test_session, query_budget):
+    with test_app.app_context():
+        session = db.session.query(Session).filter_by(address='test_address').first()
+        for i in range(3):
+            doc = Document(
+                document_url=f'test_doc_{i}',
+                encrypted_content='{"content": "test_content"}',
+                encrypted_title='{"title": "test_title"}',
+                session_id=session.id
+            )
+            db.session.add(doc)
+        db.session.commit()
+        
+        with query_budget(4) as queries:
+            response = test_client.get('/api/sessions/test_address/documents?fields=metadata')
+        assert response.status_code == 200
+        # The paginate COUNT(*) subquery names every column but never reads them
+        selects = [s for s in queries.statements if s.startswith('SELECT documents.')]
+        assert len(selects) == 1
+        assert 'encrypted_content' not in selects[0]
+        
+        data = json.loads(response.data)
+        assert len(data['data']['documents']) == 3
+        for doc in data['data']['documents']:
+            assert 'encryptedContent' not in doc
+            assert doc['encryptedTitle'] == '{"title": "test_title"}'
+        
+        response = test_client.get('/api/sessions/test_address/documents?fields=bogus')
+        assert response.status_code == 400
+
+def test_get_documents_metadata_reads_no_ciphertext(test_app, test_client, test_session, query_budget):
+    with test_app.app_context():
+        session = db.session.query(Session).filter_by(address='test_address').first()
+        for i in range(3):
+            db.session.add(Document(
+                document_url=f'test_doc_{i}',
+                encrypted_content='x' * 65536,
+                encrypted_title='{"title": "test_title"}',
+                session_id=session.id
+            ))
+        db.session.commit()
+        
+        # Titles, urls and dates only; one document's content would be 64 KiB
+        with query_budget(4, rows=10, bytes=4096):
+            response = test_client.get('/api/sessions/test_address/documents?fields=metadata')
+        assert response.status_code == 200
+        
+        with query_budget(4, bytes=4 * 65536) as queries:
+            response = test_client.get('/api/sessions/test_address/documents?fields=all')
+        assert response.status_code == 200
+        assert queries.bytes > 3 * 4096
+
+def test_cursor_pagination(test_app, test_client, test_session, query_budget):
+    with test_app.app_context():
+        session = db.session.query(Session).filter_by(address='test_address').first()
+        
+        # Create 25 test documents, several sharing a timestamp
+        now = datetime.utcnow()
+        for i in range(25):
+            doc = Document(
+                document_url=f'test_doc_{i}',
+                encrypted_content='{"content": "test_content"}',
+                encrypted_title='{"title": "test_title"}',
+                session_id=session.id,
+                last_modified=now.replace(microsecond=0) if i % 3 == 0 else now.replace(microsecond=i)
+            )
+            db.session.add(doc)
+        db.session.commit()
+        
+        seen = []
+        cursor = ''
+        with query_budget(7) as queries:
+            while cursor is not None:
+                response = test_client.get(f'/api/sessions/test_address/documents?cursor={cursor}')
+                assert response.status_code == 200
+                data = json.loads(response.data)['data']
+                assert 'total' not in data
+                seen.extend(doc['id'] for doc in data['documents'])
+                cursor = data['nextCursor']
+        
+        assert len(seen) == 25
+        assert len(set(seen)) == 25
+        assert not any('count(' in statement for statement in queries.statements)
+        
+        expected = [doc.document_url for doc in Document.query
+                    .order_by(Document.last_modified.desc(), Document.id.desc())]
+        assert seen == expected
+
+def test_cursor_pagination_invalid_cursor(test_app, test_client, test_session):
+    response = test_client.get('/api/sessions/test_address/documents?cursor=not-a-cursor')
+    assert response.status_code == 400
+    assert json.loads(response.data)['error'] == 'Invalid cursor'
+
+def test_validate_session_does_not_write(test_app, test_client, test_session, query_budget):
+    with test_app.app_context():
+        with query_budget(3) as queries:
+            for _ in range(3):
+                response = test_client.get('/api/sessions/test_address')
+                assert response.status_code == 200
+        assert queries.statements
+        assert all(statement.startswith('SELECT') for statement in queries.statements)
+
+def test_validate_session_touches_are_flushed_in_one_update(test_app, test_client, test_session, query_budget):
+    from datetime import timedelta
+    from api import touch_buffer
+    with test_app.app_context():
+        stale = datetime.utcnow() - timedelta(hours=2)
+        for address in ('stale_1', 'stale_2'):
+            db.session.add(Session(address=address, last_accessed=stale))
+        db.session.commit()
+        
+        for address in ('stale_1', 'stale_2'):
+            response = test_client.get(f'/api/sessions/{address}')
+            data = json.loads(response.data)
+            assert datetime.fromisoformat(data['data']['lastAccessed']) > stale
+        assert touch_buffer.pending() == 2
+        
+        with query_budget(1) as queries:
+            assert touch_buffer.flush() == 2
+        assert len(queries.statements) == 1
+        assert queries.statements[0].startswith('UPDATE sessions')
+        
+        db.session.expire_all()
+        for address in ('stale_1', 'stale_2'):
+            assert Session.query.filter_by(address=address).first().last_accessed > stale
+
+def test_get_document_conditional(test_app, test_client, test_session, query_budget):
+    with test_app.app_context():
+        session = db.session.query(Session).filter_by(address='test_address').first()
+        doc = Document(
+            document_url='test_doc_url',
+            encrypted_content='{"content": "test_content"}',
+            encrypted_title='{"title": "test_title"}',
+            session_id=session.id,
+            # Last-Modified is only sent once its second is over
+            last_modified=datetime.utcnow() - timedelta(seconds=5)
+        )
+        db.session.add(doc)
+        db.session.commit()
+        
+        url = '/api/sessions/test_address/documents/test_doc_url'
+        response = test_client.get(url)
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        
+        with query_budget(1) as queries:
+            response = test_client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        assert response.headers['ETag'] == etag
+        assert len(queries.statements) == 1
+        assert 'encrypted_content' not in queries.statements[0]
+        
+        response = test_client.get(url, headers={'If-Modified-Since': last_modified})
+        assert response.status_code == 304
+        
+        test_client.put(url, json={'encryptedTitle': '{"title": "updated_title"}'})
+        response = test_client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        assert json.loads(response.data)['data']['encryptedTitle'] == '{"title": "updated_title"}'
+
+def test_get_documents_conditional(test_app, test_client, test_session, query_budget):
+    with test_app.app_context():
+        url = '/api/sessions/test_address/documents?fields=metadata'
+        created = test_client.post('/api/sessions/test_address/documents', json={
+            'encryptedContent': '{"content": "test_content"}',
+            'encryptedTitle': '{"title": "test_title"}'
+        })
+        document_url = json.loads(created.data)['data']['id']
+        
+        etag = test_client.get(url).headers['ETag']
+        with query_budget(1) as queries:
+            response = test_client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert len(queries.statements) == 1
+        
+        # Another page or field set is a different representation
+        assert test_client.get(url + '&page=1&cursor=', headers={'If-None-Match': etag}).status_code == 200
+        
+        # Creates, updates and deletes all change the listing ETag
+        test_client.put(f'/api/sessions/test_address/documents/{document_url}',
+                        json={'encryptedTitle': '{"title": "updated_title"}'})
+        response = test_client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        
+        test_client.delete(f'/api/sessions/test_address/documents/{document_url}')
+        response = test_client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert json.loads(response.data)['data']['documents'] == []
+
+def test_get_documents_if_modified_since(test_app, test_client, test_session):
+    with test_app.app_context():
+        url = '/api/sessions/test_address/documents'
+        # A session that never had documents has no Last-Modified
+        assert 'Last-Modified' not in test_client.get(url).headers
+        
+        test_client.post('/api/sessions/test_address/documents', json={
+            'encryptedContent': '{"content": "test_content"}',
+            'encryptedTitle': '{"title": "test_title"}'
+        })
+        db.session.query(Session).filter_by(address='test_address')\
+            .update({'documents_changed_at': datetime.utcnow() - timedelta(minutes=2)})
+        db.session.commit()
+        last_modified = test_client.get(url).headers['Last-Modified']
+        response = test_client.get(url, headers={'If-Modified-Since': last_modified})
+        assert response.status_code == 304
+        
+        response = test_client.get(url, headers={'If-Modified-Since': 'Wed, 01 Jan 2020 00:00:00 GMT'})
+        assert response.status_code == 200
+        
+        # A later write moves it forward
+        db.session.query(Session).filter_by(address='test_address')\
+            .update({'documents_changed_at': datetime.utcnow() - timedelta(minutes=1)})
+        db.session.commit()
+        response = test_client.get(url, headers={'If-Modified-Since': last_modified})
+        assert response.status_code == 200
+        assert response.headers['Last-Modified'] != last_modified
+
+def test_revalidate_within_the_same_second(test_app, test_client, test_session):
+    with test_app.app_context():
+        url = '/api/sessions/test_address/documents'
+        # Start early in a second so the writes and reads below share it
+        time.sleep(1.01 - time.time() % 1)
+        created = test_client.post(url, json={
+            'encryptedContent': '{"content": "test_content"}',
+            'encryptedTitle': '{"title": "test_title"}'
+        })
+        document_url = url + '/' + json.loads(created.data)['data']['id']
+        now = http_date(datetime.now(timezone.utc))
+        
+        for target in (url, document_url):
+            response = test_client.get(target)
+            assert response.status_code == 200
+            assert 'ETag' in response.headers
+            assert 'Last-Modified' not in response.headers
+        
+        test_client.put(document_url, json={'encryptedTitle': '{"title": "updated_title"}'})
+        for target in (url, document_url):
+            response = test_client.get(target, headers={'If-Modified-Since': now})
+            assert response.status_code == 200
+            assert b'updated_title' in response.data
+
+def test_update_document_skips_identical_writes(test_app, test_client, test_session, query_budget):
+    from api import document_writes, document_writes_skipped
+    with test_app.app_context():
+        created = test_client.post('/api/sessions/test_address/documents', json={
+            'encryptedContent': '{"content": "test_content"}',
+            'encryptedTitle': '{"title": "test_title"}'
+        })
+        created = json.loads(created.data)['data']
+        url = f"/api/sessions/test_address/documents/{created['id']}"
+        
+        skipped, written = document_writes_skipped.value, document_writes.value
+        with query_budget(3) as queries:
+            response = test_client.put(url, json={
+                'encryptedContent': '{"content": "test_content"}',
+                'encryptedTitle': '{"title": "test_title"}'
+            })
+        assert response.status_code == 200
+        assert json.loads(response.data)['data'] == created
+        assert not any(statement.startswith('UPDATE') for statement in queries.statements)
+        assert not any('encrypted_content' in statement for statement in queries.statements)
+        assert document_writes_skipped.value == skipped + 1
+        
+        # A partial update that changes nothing is skipped too
+        response = test_client.put(url, json={'encryptedTitle': '{"title": "test_title"}'})
+        assert json.loads(response.data)['data']['lastModified'] == created['lastModified']
+        assert document_writes_skipped.value == skipped + 2
+        
+        response = test_client.put(url, json={'encryptedTitle': '{"title": "updated_title"}'})
+        data = json.loads(response.data)['data']
+        assert data['encryptedTitle'] == '{"title": "updated_title"}'
+        assert data['encryptedContent'] == '{"content": "test_content"}'
+        assert data['lastModified'] != created['lastModified']
+        assert document_writes.value == written + 1
+
+def test_content_digest_is_cleared_by_direct_writes(test_app, test_session):
+    from api import content_digest
+    with test_app.app_context():
+        session = db.session.query(Session).filter_by(address='test_address').first()
+        doc = Document(
+            document_url='test_doc_url',
+            encrypted_content='{"content": "test_content"}',
+            encrypted_title='{"title": "test_title"}',
+            content_digest=content_digest('{"title": "test_title"}', '{"content": "test_content"}'),
+            session_id=session.id
+        )
+        db.session.add(doc)
+        db.session.commit()
+        assert doc.content_digest is not None
+        
+        doc.encrypted_content = '{"content": "changed"}'
+        db.session.commit()
+        assert doc.content_digest is None
+
+def test_chunked_document_lifecycle(test_app, test_client, test_session, query_budget):
+    with test_app.app_context():
+        response = test_client.post('/api/sessions/test_address/documents', json={
+            'encryptedTitle': '{"title": "test_title"}',
+            'encryptedChunks': ['chunk_0', 'chunk_1', 'chunk_2']
+        })
+        assert response.status_code == 200
+        data = json.loads(response.data)['data']
+        assert data['encryptedChunks'] == ['chunk_0', 'chunk_1', 'chunk_2']
+        assert 'encryptedContent' not in data
+        url = f"/api/sessions/test_address/documents/{data['id']}"
+        
+        # Only the changed chunk is sent and written
+        with query_budget(4) as queries:
+            response = test_client.patch(url, json={
+                'chunks': [{'index': 1, 'encryptedChunk': 'chunk_1_edited'}]
+            })
+        assert response.status_code == 200
+        assert json.loads(response.data)['data']['chunkCount'] == 3
+        assert not any('encrypted_content' in statement for statement in queries.statements)
+        
+        data = json.loads(test_client.get(url).data)['data']
+        assert data['encryptedChunks'] == ['chunk_0', 'chunk_1_edited', 'chunk_2']
+        
+        # Grow, then shrink
+        response = test_client.patch(url, json={
+            'chunkCount': 4,
+            'chunks': [{'index': 3, 'encryptedChunk': 'chunk_3'}]
+        })
+        assert response.status_code == 200
+        response = test_client.patch(url, json={'chunkCount': 2, 'encryptedTitle': '{"title": "updated"}'})
+        assert response.status_code == 200
+        data = json.loads(test_client.get(url).data)['data']
+        assert data['encryptedChunks'] == ['chunk_0', 'chunk_1_edited']
+        assert data['encryptedTitle'] == '{"title": "updated"}'
+        
+        listing = json.loads(test_client.get('/api/sessions/test_address/documents').data)['data']
+        assert listing['documents'][0]['encryptedChunks'] == ['chunk_0', 'chunk_1_edited']
+        
+        # A whole-document PUT turns it back into a single blob
+        response = test_client.put(url, json={'encryptedContent': '{"content": "test_content"}'})
+        data = json.loads(response.data)['data']
+        assert data['encryptedContent'] == '{"content": "test_content"}'
+        assert 'encryptedChunks' not in data
+        assert test_client.patch(url, json={'chunkCount': 1}).status_code == 400
+        
+        assert test_client.delete(url).status_code == 200
+
+def test_patch_document_validation(test_app, test_client, test_session):
+    with test_app.app_context():
+        response = test_client.post('/api/sessions/test_address/documents', json={
+            'encryptedTitle': '{"title": "test_title"}',
+            'encryptedChunks': ['chunk_0']
+        })
+        url = f"/api/sessions/test_address/documents/{json.loads(response.data)['data']['id']}"
+        
+        assert test_client.patch(url, json={'chunkCount': 0}).status_code == 400
+        assert test_client.patch(url, json={'chunkCount': 2}).status_code == 400
+        assert test_client.patch(url, json={'chunks': [{'index': 1, 'encryptedChunk': 'x'}]}).status_code == 400
+        assert test_client.patch(url, json={'chunks': [{'index': 0}]}).status_code == 400
+        assert test_client.patch(url, json={'chunks': [{'index': True, 'encryptedChunk': 'x'}]}).status_code == 400
+        assert test_client.patch(url, json={'encryptedTitle': 123}).status_code == 400
+        # Bodies that aren't objects are rejected, not a 500
+        for body in (['chunks'], 5):
+            response = test_client.patch(url, json=body)
+            assert response.status_code == 400
+            assert json.loads(response.data)['error'] == 'Invalid request body'
+            assert test_client.put(url, json=body).status_code == 400
+            assert test_client.post('/api/sessions/test_address/documents', json=body).status_code == 400
+        response = test_client.patch(url, json={'chunkCount': 2, 'chunks': [
+            {'index': 1, 'encryptedChunk': 'x'}, {'index': 1, 'encryptedChunk': 'y'}
+        ]})
+        assert response.status_code == 400
+        assert json.loads(response.data)['error'] == 'Duplicate chunk indexes'
+        # Nothing was written, and the session is still usable
+        assert json.loads(test_client.get(url).data)['data']['encryptedChunks'] == ['chunk_0']
+        assert test_client.patch(url, json={'chunks': [{'index': 0, 'encryptedChunk': 'x'}]}).status_code == 200
+        
+        response = test_client.post('/api/sessions/test_address/documents', json={
+            'encryptedTitle': '{"title": "test_title"}',
+            'encryptedChunks': []
+        })
+        assert response.status_code == 400
+        response = test_client.post('/api/sessions/test_address/documents', json={
+            'encryptedTitle': '{"title": "test_title"}',
+            'encryptedContent': '{"content": "test_content"}',
+            'encryptedChunks': ['chunk_0']
+        })
+        assert response.status_code == 400
+
+def test_ciphertexts_must_be_strings(test_app, test_client, test_session):
+    with test_app.app_context():
+        url = '/api/sessions/test_address/documents'
+        assert test_client.post(url, json={'encryptedTitle': 123, 'encryptedContent': 'content'}).status_code == 400
+        assert test_client.post(url, json={'encryptedTitle': 'title', 'encryptedContent': None}).status_code == 400
+        
+        response = test_client.post(url, json={'encryptedTitle': 'title', 'encryptedContent': 'content'})
+        document_url = json.loads(response.data)['data']['id']
+        assert test_client.put(f'{url}/{document_url}', json={'encryptedContent': ['x']}).status_code == 400
+        assert test_client.put(f'{url}/{document_url}', json={'encryptedTitle': None}).status_code == 400
+        
+        # In a batch only the invalid operations fail
+        response = test_client.post(f'{url}/batch', json={'operations': [
+            {'op': 'create', 'encryptedTitle': 'title', 'encryptedContent': None},
+            {'op': 'create', 'encryptedTitle': 'title', 'encryptedContent': 'content'},
+            {'op': 'update', 'id': document_url, 'encryptedTitle': {'title': 1}}
+        ]})
+        assert response.status_code == 200
+        results = json.loads(response.data)['data']['results']
+        assert [result['status'] for result in results] == [400, 200, 400]
+        assert results[0]['error'] == 'Invalid encryptedTitle or encryptedContent'
+        
+        document = json.loads(test_client.get(f'{url}/{document_url}').data)['data']
+        assert (document['encryptedTitle'], document['encryptedContent']) == ('title', 'content')
+
+def test_rate_limit_exceeded(test_app, test_client, test_session):
+    with test_app.app_context():
+        statuses = [test_client.get('/api/sessions/test_address/export').status_code for _ in range(6)]
+        assert statuses == [200] * 5 + [429]
+        
+        # JSON like every other error, from either app
+        response = test_client.get('/api/sessions/test_address/export')
+        assert json.loads(response.data) == {'error': 'Rate limit exceeded: 5 per 1 minute'}
+        assert 1 <= int(response.headers['Retry-After']) <= 60
+
+@pytest.mark.parametrize('name, value', [
+    ('AUTOSAVE_COALESCE_WINDOW', 1.0),
+    ('DATABASE_REPLICA_URLS', ['postgresql://replica/securenotes']),
+    ('METRICS_ENABLED', True),
+    ('COMPRESS_MIN_SIZE', 1024),
+])
+def test_asgi_refuses_flask_only_options(test_app, monkeypatch, name, value):
+    from starlette.testclient import TestClient
+    from asgi import app as asgi_app
+    monkeypatch.setitem(test_app.config, name, value)
+    with pytest.raises(RuntimeError, match=name):
+        with TestClient(asgi_app):
+            pass
+
+def test_batch_documents(test_app, test_client, test_session, query_budget):
+    with test_app.app_context():
+        session = db.session.query(Session).filter_by(address='test_address').first()
+        for i in range(3):
+            db.session.add(Document(
+                document_url=f'test_doc_{i}',
+                encrypted_content='{"content": "test_content"}',
+                encrypted_title='{"title": "test_title"}',
+                session_id=session.id
+            ))
+        db.session.commit()
+        
+        with query_budget(6) as queries:
+            response = test_client.post('/api/sessions/test_address/documents/batch', json={'operations': [
+                {'op': 'create', 'encryptedTitle': '{"title": "new_1"}', 'encryptedContent': '{"content": "new_1"}'},
+                {'op': 'create', 'encryptedTitle': '{"title": "new_2"}', 'encryptedContent': '{"content": "new_2"}'},
+                {'op': 'get', 'id': 'test_doc_0'},
+                {'op': 'update', 'id': 'test_doc_1', 'encryptedContent': '{"content": "updated"}'},
+                {'op': 'delete', 'id': 'test_doc_2'},
+                {'op': 'get', 'id': 'nonexistent'},
+                {'op': 'delete', 'id': 'test_doc_2'},
+                {'op': 'rename'},
+            ]})
+        assert response.status_code == 200
+        results = json.loads(response.data)['data']['results']
+        
+        assert [result['status'] for result in results] == [200, 200, 200, 200, 200, 404, 400, 400]
+        assert results[0]['data']['encryptedTitle'] == '{"title": "new_1"}'
+        assert results[2]['data']['encryptedContent'] == '{"content": "test_content"}'
+        assert results[3]['data']['encryptedContent'] == '{"content": "updated"}'
+        assert results[3]['data']['encryptedTitle'] == '{"title": "test_title"}'
+        
+        # Session lookup, one SELECT, one INSERT, one UPDATE, one DELETE and
+        # the listing marker, all in a single transaction
+        assert len(queries.statements) <= 6
+        assert sum(statement.startswith('INSERT') for statement in queries.statements) == 1
+        
+        db.session.expire_all()
+        urls = {doc.document_url for doc in Document.query.filter_by(session_id=session.id)}
+        assert urls == {'test_doc_0', 'test_doc_1', results[0]['data']['id'], results[1]['data']['id']}
+        assert Document.query.filter_by(document_url='test_doc_1').first().encrypted_content == '{"content": "updated"}'
+        
+        # Other methods on the batch path still reach the document routes
+        assert test_client.get('/api/sessions/test_address/documents/batch').status_code == 404
+
+def test_batch_documents_validation(test_app, test_client, test_session):
+    url = '/api/sessions/test_address/documents/batch'
+    assert test_client.post(url, json={}).status_code == 400
+    assert test_client.post(url, json={'operations': []}).status_code == 400
+    assert test_client.post('/api/sessions/nonexistent/documents/batch',
+                            json={'operations': [{'op': 'get', 'id': 'x'}]}).status_code == 404
+
+# Statements each route may run, with a cold session cache. Going over means a
+# route picked up a query, e.g. a lazy load or a refresh after commit; raise a
+# budget only together with its reason. COPY in imports isn't counted.
+QUERY_BUDGETS = [
+    # INSERT; the response is built before the commit expires the row
+    ('POST', '/api/sessions', {'json': {'address': 'budget_address'}}, 1),
+    # The session; touches are buffered
+    ('GET', '/api/sessions/test_address', {}, 1),
+    # Session id, ETag, page, COUNT and the chunks of every chunked document on the page
+    ('GET', '/api/sessions/test_address/documents', {}, 5),
+    # No COUNT in cursor mode
+    ('GET', '/api/sessions/test_address/documents?cursor=', {}, 4),
+    # No chunks without content
+    ('GET', '/api/sessions/test_address/documents?fields=metadata', {}, 4),
+    # Session id, then one server-side cursor each for chunks and documents
+    ('GET', '/api/sessions/test_address/export', {}, 3),
+    # Session id, ids for the batch and the listing marker
+    ('POST', '/api/sessions/test_address/import', {
+        'data': '{"encryptedTitle": "title", "encryptedContent": "content"}\n',
+        'content_type': 'application/x-ndjson'}, 3),
+    # Session id, INSERT and the listing marker
+    ('POST', '/api/sessions/test_address/documents', {
+        'json': {'encryptedTitle': 'title', 'encryptedContent': 'content'}}, 3),
+    # Session id, one SELECT, INSERT, UPDATE and DELETE for all operations, and the listing marker
+    ('POST', '/api/sessions/test_address/documents/batch', {'json': {'operations': [
+        {'op': 'create', 'encryptedTitle': 'title', 'encryptedContent': 'content'},
+        {'op': 'get', 'id': 'budget_doc_0'},
+        {'op': 'update', 'id': 'budget_doc_1', 'encryptedContent': 'updated'},
+        {'op': 'delete', 'id': 'budget_doc_2'}]}}, 6),
+    # Session and document in one join
+    ('GET', '/api/sessions/test_address/documents/budget_doc_0', {}, 1),
+    # The join for the validators, then one refresh of every other column
+    ('GET', '/api/sessions/test_address/documents/budget_doc_1', {'headers': {'If-None-Match': '"stale"'}}, 2),
+    # Join, UPDATE and the listing marker
+    ('PUT', '/api/sessions/test_address/documents/budget_doc_0', {'json': {'encryptedContent': 'updated'}}, 3),
+    # Join, upsert of the sent chunks, UPDATE and the listing marker
+    ('PATCH', '/api/sessions/test_address/documents/budget_chunked', {
+        'json': {'chunks': [{'index': 0, 'encryptedChunk': 'edited'}]}}, 4),
+    # Join, DELETE and the listing marker
+    ('DELETE', '/api/sessions/test_address/documents/budget_doc_0', {}, 3),
+    # Session id, then a Core DELETE each for documents and the session
+    ('DELETE', '/api/sessions/test_address', {}, 3),
+]
+
+@pytest.mark.parametrize('method, url, kwargs, budget', QUERY_BUDGETS,
+                         ids=[f'{method} {url}' for method, url, kwargs, budget in QUERY_BUDGETS])
+def test_query_budget(test_app, test_client, test_session, query_budget, method, url, kwargs, budget):
+    from api import session_cache
+    with test_app.app_context():
+        session = db.session.query(Session).filter_by(address='test_address').first()
+        for i in range(3):
+            db.session.add(Document(document_url=f'budget_doc_{i}', encrypted_content='content',
+                                    encrypted_title='title', session_id=session.id))
+        db.session.commit()
+        created = test_client.post('/api/sessions/test_address/documents',
+                                   json={'encryptedTitle': 'title', 'encryptedChunks': ['chunk_0', 'chunk_1']})
+        url = url.replace('budget_chunked', json.loads(created.data)['data']['id'])
+        session_cache.clear()
+        
+        with query_budget(budget):
+            response = test_client.open(url, method=method, **kwargs)
+            # Streamed responses run their queries as they are read
+            response.data
+        assert response.status_code == 200
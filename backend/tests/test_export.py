@@ -0,0 +1,103 @@
+import json
+import os
+import subprocess
+import sys
+from api import db, Session
+
+# Streams a session's export through the WSGI app in a fresh interpreter and
+# prints the bytes received and the process' peak RSS in KiB
+EXPORT_SCRIPT = '''
+import resource, sys
+from werkzeug.test import EnvironBuilder
+from api import app
+
+app.config['TESTING'] = True
+environ = EnvironBuilder(path='/api/sessions/%s/export' % sys.argv[1]).get_environ()
+body = app(environ, lambda status, headers: None)
+received = sum(len(chunk) for chunk in body)
+body.close()
+print(received, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+def seed_documents(address, count, size):
+    """Insert ``count`` documents of ``size`` bytes of ciphertext in one statement."""
+    session = Session(address=address)
+    db.session.add(session)
+    db.session.flush()
+    # The leading zero byte is the UTF-8 tag of ciphertext.pack()
+    db.session.execute(db.text('''
+        INSERT INTO documents (document_url, encrypted_title, encrypted_content,
+                               created_at, last_modified, session_id)
+        SELECT :address || '_' || i, '\\x00'::bytea || convert_to('title', 'UTF8'),
+               '\\x00'::bytea || convert_to(repeat('x', :size), 'UTF8'), now(), now(), :session_id
+        FROM generate_series(1, :count) AS i
+    '''), {'address': address, 'size': size, 'count': count, 'session_id': session.id})
+    db.session.commit()
+
+def export_in_subprocess(address):
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, '-c', EXPORT_SCRIPT, address],
+        cwd=backend, capture_output=True, text=True, check=True
+    ).stdout
+    received, peak_rss = output.split()
+    return int(received), int(peak_rss)
+
+def test_export_session(test_app, test_client):
+    with test_app.app_context():
+        session = Session(address='test_address')
+        db.session.add(session)
+        db.session.commit()
+    
+        urls = []
+        for i in range(3):
+            response = test_client.post('/api/sessions/test_address/documents', json={
+                'encryptedTitle': f'{{"title": "title_{i}"}}',
+                'encryptedContent': f'{{"content": "content_{i}"}}'
+            })
+            urls.append(json.loads(response.data)['data']['id'])
+        response = test_client.post('/api/sessions/test_address/documents', json={
+            'encryptedTitle': '{"title": "chunked"}',
+            'encryptedChunks': ['chunk_0', 'chunk_1']
+        })
+        urls.append(json.loads(response.data)['data']['id'])
+    
+        # Another session's documents and chunks stay out of the export
+        other = Session(address='other_address')
+        db.session.add(other)
+        db.session.commit()
+        test_client.post('/api/sessions/other_address/documents', json={
+            'encryptedTitle': '{"title": "other"}',
+            'encryptedChunks': ['other_chunk']
+        })
+    
+        response = test_client.get('/api/sessions/test_address/export')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        assert response.is_streamed
+    
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        assert [line['id'] for line in lines] == urls
+        assert lines[0]['encryptedContent'] == '{"content": "content_0"}'
+        assert lines[3]['encryptedChunks'] == ['chunk_0', 'chunk_1']
+        assert 'encryptedContent' not in lines[3]
+        for line in lines:
+            assert line == json.loads(test_client.get(
+                f"/api/sessions/test_address/documents/{line['id']}").data)['data']
+
+def test_export_session_not_found(test_client):
+    assert test_client.get('/api/sessions/nonexistent/export').status_code == 404
+
+def test_export_memory_is_flat(test_app):
+    # 20x the documents (and 30+ MB more ciphertext) should not move peak RSS
+    # by more than the noise of a fresh interpreter
+    size = 16 * 1024
+    with test_app.app_context():
+        seed_documents('small_export', 100, size)
+        seed_documents('large_export', 2000, size)
+    
+    small_bytes, small_rss = export_in_subprocess('small_export')
+    large_bytes, large_rss = export_in_subprocess('large_export')
+    assert small_bytes > 100 * size
+    assert large_bytes > 2000 * size
+    assert large_rss - small_rss < 8 * 1024
@@ -0,0 +1,151 @@
+import gzip
+import json
+import tracemalloc
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, select
+from api import db, Session, Document, DocumentChunk
+from bulk import copy_rows, next_ids
+from ciphertext import Ciphertext
+
+@pytest.fixture(autouse=True)
+def sessions(test_app):
+    with test_app.app_context():
+        db.session.add(Session(address='test_address'))
+        db.session.add(Session(address='restore_address'))
+        db.session.commit()
+
+def ndjson(documents):
+    return ''.join(json.dumps(document) + '\n' for document in documents).encode()
+
+DOCUMENTS = [
+    {'encryptedTitle': '{"title": "plain"}', 'encryptedContent': '{"iv":"00112233445566778899aabbccddeeff","content":"aGVsbG8="}',
+     'createdAt': '2024-01-01T00:00:00', 'lastModified': '2024-01-02T00:00:00'},
+    {'encryptedTitle': 'tab\there', 'encryptedContent': 'back\\slash\nnewline'},
+    {'encryptedTitle': '{"title": "chunked"}', 'encryptedChunks': ['chunk_0', 'chunk_1', 'chunk_2']},
+    {'encryptedTitle': '{"title": "last"}', 'encryptedContent': 'bGFzdA=='},
+]
+
+def test_import_round_trips_export(test_app, test_client):
+    test_app.config['IMPORT_BATCH_SIZE'] = 3
+    try:
+        response = test_client.post('/api/sessions/test_address/import', data=ndjson(DOCUMENTS),
+                                    content_type='application/x-ndjson')
+    finally:
+        test_app.config['IMPORT_BATCH_SIZE'] = 1000
+    assert response.status_code == 200
+    stats = json.loads(response.data)['data']
+    assert stats['rows'] == 4
+    assert stats['bytes'] == len(ndjson(DOCUMENTS))
+    assert stats['rowsPerSecond'] > 0
+    
+    exported = [json.loads(line) for line in test_client.get('/api/sessions/test_address/export').data.splitlines()]
+    assert len(exported) == 4
+    for original, document in zip(DOCUMENTS, exported):
+        assert document['encryptedTitle'] == original['encryptedTitle']
+        assert document.get('encryptedContent') == original.get('encryptedContent')
+        assert document.get('encryptedChunks') == original.get('encryptedChunks')
+    assert exported[0]['createdAt'] == '2024-01-01T00:00:00'
+    assert exported[0]['lastModified'] == '2024-01-02T00:00:00'
+    
+    # Imported documents work like any other, including the no-op write check
+    url = f"/api/sessions/test_address/documents/{exported[3]['id']}"
+    assert json.loads(test_client.get(url).data)['data'] == exported[3]
+    response = test_client.put(url, json={'encryptedTitle': '{"title": "last"}', 'encryptedContent': 'bGFzdA=='})
+    assert json.loads(response.data)['data']['lastModified'] == exported[3]['lastModified']
+    
+    # And the export restores into another session
+    response = test_client.post('/api/sessions/restore_address/import', data=ndjson(exported))
+    assert json.loads(response.data)['data']['rows'] == 4
+    restored = [json.loads(line) for line in test_client.get('/api/sessions/restore_address/export').data.splitlines()]
+    assert [document['encryptedTitle'] for document in restored] == [document['encryptedTitle'] for document in exported]
+    assert not {document['id'] for document in restored} & {document['id'] for document in exported}
+
+def test_import_changes_listing_etag(test_app, test_client):
+    url = '/api/sessions/test_address/documents'
+    test_client.post(url, json={'encryptedTitle': 'new', 'encryptedContent': 'new'})
+    etag = test_client.get(url).headers['ETag']
+    
+    # Older than the existing document, so the listing marker must move on its own
+    test_client.post('/api/sessions/test_address/import', data=ndjson(DOCUMENTS[:1]))
+    response = test_client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert json.loads(response.data)['data']['total'] == 2
+
+def test_import_is_all_or_nothing(test_app, test_client):
+    body = ndjson(DOCUMENTS[:2]) + b'{"encryptedTitle": "no content"}\n' + ndjson(DOCUMENTS[2:])
+    response = test_client.post('/api/sessions/test_address/import', data=body)
+    assert response.status_code == 400
+    assert json.loads(response.data)['error'] == 'Invalid document on line 3'
+    
+    response = test_client.post('/api/sessions/test_address/import', data=b'not json\n')
+    assert response.status_code == 400
+    
+    with test_app.app_context():
+        assert Document.query.count() == 0
+        assert DocumentChunk.query.count() == 0
+    
+    assert test_client.post('/api/sessions/nonexistent/import', data=ndjson(DOCUMENTS)).status_code == 404
+
+def test_import_compressed_body(test_client):
+    response = test_client.post('/api/sessions/test_address/import', data=gzip.compress(ndjson(DOCUMENTS)),
+                                headers={'Content-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert json.loads(response.data)['data']['rows'] == 4
+
+def test_import_compressed_body_is_streamed(test_app, test_client):
+    def import_peak(count):
+        # 16 KiB per document, well past the limit for bodies read whole
+        body = gzip.compress(ndjson([{'encryptedTitle': 'title', 'encryptedContent': 'x' * 16 * 1024}] * count))
+        tracemalloc.start()
+        try:
+            response = test_client.post('/api/sessions/test_address/import', data=body,
+                                        headers={'Content-Encoding': 'gzip'})
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert response.status_code == 200
+        assert json.loads(response.data)['data']['rows'] == count
+        return peak
+    
+    config = dict(test_app.config)
+    test_app.config['COMPRESS_MAX_REQUEST_SIZE'] = test_app.config['IMPORT_BATCH_BYTES'] = 1024 * 1024
+    try:
+        small_peak = import_peak(256)
+        # 8x the body (28 MB more) is still read and copied a batch at a time
+        large_peak = import_peak(2048)
+    finally:
+        test_app.config.update(config)
+    assert large_peak - small_peak < 2 * 1024 * 1024
+
+def test_import_documents_command(test_app, tmp_path):
+    source = tmp_path / 'export.ndjson'
+    source.write_bytes(ndjson(DOCUMENTS))
+    runner = test_app.test_cli_runner()
+    
+    result = runner.invoke(args=['import-documents', 'new_address', str(source)])
+    assert result.exit_code != 0
+    assert 'Session new_address not found' in result.output
+    
+    result = runner.invoke(args=['import-documents', 'new_address', str(source), '--create-session', '--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith('Imported 4 documents')
+    assert 'rows/s' in result.output and 'MB/s' in result.output
+    
+    with test_app.app_context():
+        session = Session.query.filter_by(address='new_address').one()
+        assert Document.query.filter_by(session_id=session.id).count() == 4
+
+def test_copy_rows_falls_back_to_insert():
+    engine = create_engine('sqlite://')
+    metadata = MetaData()
+    table = Table('items', metadata, Column('id', Integer, primary_key=True),
+                  Column('name', String), Column('ciphertext', Ciphertext))
+    metadata.create_all(engine)
+    
+    with engine.begin() as connection:
+        ids = next_ids(connection, table, 2)
+        copy_rows(connection, table, ('id', 'name', 'ciphertext'),
+                  [(ids[0], 'first', 'aGVsbG8='), (ids[1], 'second', 'plain text')])
+        assert next_ids(connection, table, 1) == [ids[1] + 1]
+        rows = connection.execute(select(table).order_by(table.c.id)).all()
+    assert rows == [(1, 'first', 'aGVsbG8='), (2, 'second', 'plain text')]
@@ -0,0 +1,104 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from api import db, request_metrics
+from instrumentation import (pool_in_use, rate_limited_requests, request_phase_seconds, request_seconds,
+                             request_statements, response_bytes)
+from metrics import Counter, Gauge, Histogram, exposition
+
+@pytest.fixture
+def enabled(test_app):
+    request_metrics.enabled = True
+    yield
+    request_metrics.enabled = False
+
+def test_exposition_format():
+    registry = []
+    requests = Counter('requests_total', 'Requests', registry=registry)
+    requests.inc(3)
+    Gauge('temperature', 'Degrees', ['room'], registry=registry).labels('hall "a"').set(21.5)
+    Gauge('answer', 'Computed', registry=registry, function=lambda: 42)
+    latency = Histogram('latency_seconds', 'Latency', ['route'], registry=registry, buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.labels('get').observe(value)
+    
+    assert exposition(registry).splitlines() == [
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total 3',
+        '# HELP temperature Degrees',
+        '# TYPE temperature gauge',
+        'temperature{room="hall \\"a\\""} 21.5',
+        '# HELP answer Computed',
+        '# TYPE answer gauge',
+        'answer 42',
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{route="get",le="0.1"} 2',
+        'latency_seconds_bucket{route="get",le="1"} 3',
+        'latency_seconds_bucket{route="get",le="+Inf"} 4',
+        'latency_seconds_sum{route="get"} 3.65',
+        'latency_seconds_count{route="get"} 4',
+    ]
+    
+    with pytest.raises(ValueError):
+        latency.labels('get', 'extra')
+
+def test_metrics_endpoint_is_off_by_default(test_app):
+    client = test_app.test_client()
+    assert client.get('/metrics').status_code == 404
+    
+    # Nothing is recorded, and no cursor events are listened to
+    count = request_seconds.labels('validate_session').count
+    client.get('/api/sessions/test_address')
+    assert request_seconds.labels('validate_session').count == count
+    assert not event.contains(Engine, 'before_cursor_execute', request_metrics._before_cursor_execute)
+
+def test_request_metrics(test_app, enabled):
+    client = test_app.test_client()
+    client.post('/api/sessions', json={'address': 'test_address'})
+    created = client.post('/api/sessions/test_address/documents',
+                          json={'encryptedTitle': 'title', 'encryptedContent': 'x' * 2000}).get_json()['data']
+    
+    latency = request_seconds.labels('get_document')
+    statements = request_statements.labels('get_document')
+    sizes = response_bytes.labels('get_document')
+    sql = request_phase_seconds.labels('get_document', 'sql')
+    encoding = request_phase_seconds.labels('get_document', 'json')
+    before = latency.count, statements.sum, sizes.count, sql.sum, encoding.sum
+    
+    response = client.get(f"/api/sessions/test_address/documents/{created['id']}")
+    assert response.status_code == 200
+    assert latency.count == before[0] + 1
+    assert statements.sum == before[1] + 1
+    assert sizes.count == before[2] + 1 and sizes.sum >= len(response.data)
+    assert sql.sum > before[3] and encoding.sum > before[4]
+    assert latency.sum > sql.sum
+    
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{route="get_document"}' in body
+    assert 'db_pool_in_use{engine="primary"}' in body
+    assert '# TYPE http_request_sql_statements histogram' in body
+
+def test_rate_limit_rejections_are_counted(test_app, enabled):
+    client = test_app.test_client()
+    rejected = rate_limited_requests.labels('create_session')
+    before = rejected.value
+    limiter_time = request_phase_seconds.labels('create_session', 'limiter')
+    checked = limiter_time.sum
+    
+    statuses = [client.post('/api/sessions', json={'address': f'address_{i}'}).status_code for i in range(7)]
+    assert statuses.count(429) == 2
+    assert rejected.value == before + 2
+    assert limiter_time.sum > checked
+    
+    # Scrapes are never limited
+    assert all(client.get('/metrics').status_code == 200 for _ in range(60))
+
+def test_pool_gauges(test_app):
+    in_use = pool_in_use.labels('primary').function
+    with test_app.app_context():
+        before = in_use()
+        with db.engine.connect():
+            assert in_use() == before + 1
+        assert in_use() == before
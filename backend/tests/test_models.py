@@ -1,20 +1,6 @@
 import pytest
 from datetime import datetime
-from api import app, db, Session, Document
-
-@pytest.fixture
-def test_app():
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://localhost/securenotes_test'
-    app.config['TESTING'] = True
-    
-    with app.app_context():
-        db.create_all()
-        
-    yield app
-    
-    with app.app_context():
-        db.session.remove()
-        db.drop_all()
+from api import db, Session, Document
 
 @pytest.fixture
 def test_session(test_app):
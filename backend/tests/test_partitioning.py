@@ -0,0 +1,108 @@
+import json
+from datetime import datetime, timedelta
+import pytest
+import flask_migrate
+from api import db, sweeper, Session, Document, DocumentChunk
+from partitioning import is_partitioned, partition_count, partition_documents, unpartition_documents
+
+@pytest.fixture(autouse=True)
+def drop_chunk_trigger(test_app):
+    yield
+    # Partitioning adds a trigger function that drop_all() doesn't know about
+    with test_app.app_context():
+        db.session.execute(db.text('DROP FUNCTION IF EXISTS delete_document_chunks() CASCADE'))
+        db.session.commit()
+
+def create_documents(client, address, count, chunked=False):
+    urls = []
+    for i in range(count):
+        content = {'encryptedChunks': [f'chunk_{i}_0', f'chunk_{i}_1']} if chunked\
+            else {'encryptedContent': f'content_{i}'}
+        response = client.post(f'/api/sessions/{address}/documents',
+                               json={'encryptedTitle': f'title_{i}', **content})
+        urls.append(json.loads(response.data)['data']['id'])
+    return urls
+
+def test_partitioned_documents(test_app, test_client):
+    addresses = [f'address_{i}' for i in range(6)]
+    with test_app.app_context():
+        db.session.add_all([Session(address=address) for address in addresses])
+        db.session.commit()
+    existing = create_documents(test_client, 'address_0', 3) + create_documents(test_client, 'address_0', 1, chunked=True)
+    create_documents(test_client, 'address_1', 5)
+    
+    with test_app.app_context():
+        moved = partition_documents(db.session.connection(), 4, batch_size=2)
+        db.session.commit()
+        assert moved == 9
+        assert is_partitioned(db.session.connection())
+        assert partition_count(db.session.connection()) == 4
+    
+    # Existing documents are still served
+    response = test_client.get(f'/api/sessions/address_0/documents/{existing[0]}')
+    assert json.loads(response.data)['data']['encryptedContent'] == 'content_0'
+    response = test_client.get(f'/api/sessions/address_0/documents/{existing[3]}')
+    assert json.loads(response.data)['data']['encryptedChunks'] == ['chunk_0_0', 'chunk_0_1']
+    
+    # And every route keeps working on the partitioned table
+    for address in addresses:
+        create_documents(test_client, address, 2)
+    chunked = create_documents(test_client, 'address_2', 1, chunked=True)[0]
+    listing = json.loads(test_client.get('/api/sessions/address_0/documents').data)['data']
+    assert listing['total'] == 6
+    
+    url = f'/api/sessions/address_0/documents/{existing[1]}'
+    response = test_client.put(url, json={'encryptedContent': 'updated'})
+    assert json.loads(response.data)['data']['encryptedContent'] == 'updated'
+    response = test_client.patch(f'/api/sessions/address_2/documents/{chunked}',
+                                 json={'chunks': [{'index': 1, 'encryptedChunk': 'edited'}]})
+    assert response.status_code == 200
+    
+    response = test_client.post('/api/sessions/address_3/import',
+                                data=b'{"encryptedTitle": "imported", "encryptedChunks": ["a", "b"]}\n')
+    assert json.loads(response.data)['data']['rows'] == 1
+    
+    # Deleting a document or a session still removes the chunks
+    with test_app.app_context():
+        chunks = DocumentChunk.query.count()
+    assert test_client.delete(f'/api/sessions/address_0/documents/{existing[3]}').status_code == 200
+    assert test_client.delete('/api/sessions/address_3').status_code == 200
+    with test_app.app_context():
+        assert DocumentChunk.query.count() == chunks - 4
+    
+        db.session.query(Session).filter_by(address='address_4')\
+            .update({'last_accessed': datetime.utcnow() - timedelta(days=1)})
+        db.session.commit()
+    assert sweeper.sweep().documents == 2
+    
+    with test_app.app_context():
+        rows = {doc.document_url: (doc.encrypted_content, doc.session_id) for doc in Document.query}
+        assert unpartition_documents(db.session.connection(), batch_size=5) == len(rows)
+        db.session.commit()
+        assert not is_partitioned(db.session.connection())
+        assert {doc.document_url: (doc.encrypted_content, doc.session_id) for doc in Document.query} == rows
+    
+    # Back on the plain table, new ids continue from the same sequence
+    url = create_documents(test_client, 'address_5', 1)[0]
+    with test_app.app_context():
+        assert Document.query.filter_by(document_url=url).one().id > max(
+            doc.id for doc in Document.query.filter(Document.document_url != url))
+    assert test_client.delete('/api/sessions/address_2').status_code == 200
+
+def test_partition_documents_needs_two_partitions(test_app):
+    with test_app.app_context():
+        with pytest.raises(ValueError):
+            partition_documents(db.session.connection(), 1)
+
+def test_migrations_match_the_models_when_partitioned(test_app):
+    with test_app.app_context():
+        db.drop_all()
+        try:
+            flask_migrate.upgrade(x_arg=['document_partitions=4'])
+            assert partition_count(db.session.connection()) == 4
+            db.session.rollback()
+            # Exits if autogenerate would change anything, e.g. drop the partitions
+            flask_migrate.check()
+        finally:
+            db.session.execute(db.text('DROP TABLE IF EXISTS alembic_version'))
+            db.session.commit()
@@ -0,0 +1,34 @@
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from api import app, db
+from query_budget import QueryBudget
+
+def run(statement):
+    with app.app_context():
+        return db.session.execute(text(statement)).all()
+
+def test_budget_counts_statements_rows_and_bytes(query_budget):
+    with query_budget(2, rows=4, bytes=12) as queries:
+        run("SELECT 'abc' FROM generate_series(1, 3)")
+        run('SELECT 1')
+    assert len(queries.statements) == 2
+    assert (queries.rows, queries.bytes) == (4, 9)
+
+def test_exceeding_a_budget_fails_with_the_statements():
+    with pytest.raises(pytest.fail.Exception, match=r'3 rows \(budget 2\)[\s\S]*generate_series'):
+        with QueryBudget(rows=2):
+            run('SELECT * FROM generate_series(1, 3)')
+    
+    with pytest.raises(pytest.fail.Exception, match=r'2 statements \(budget 1\)'):
+        with QueryBudget(1):
+            run('SELECT 1')
+            run('SELECT 2')
+    
+    # Errors inside the block are left alone, and nothing stays listening
+    budget = QueryBudget(0)
+    with pytest.raises(ZeroDivisionError):
+        with budget:
+            run('SELECT 1')
+            1 / 0
+    assert not event.contains(Engine, 'before_cursor_execute', budget._before_cursor_execute)
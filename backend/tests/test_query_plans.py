@@ -0,0 +1,64 @@
+import pytest
+from sqlalchemy import event
+from api import db, Session, Document
+
+SESSIONS = 50
+DOCUMENTS_PER_SESSION = 100
+
+@pytest.fixture(autouse=True)
+def seed(test_app):
+    with test_app.app_context():
+        # Seed enough rows that a sequential scan is never the cheap option
+        for s in range(SESSIONS):
+            session = Session(address=f'plan_session_{s}')
+            db.session.add(session)
+            db.session.flush()
+            db.session.add_all([Document(
+                document_url=f'plan_doc_{s}_{d}',
+                encrypted_content='{"content": "test_content"}',
+                encrypted_title='{"title": "test_title"}',
+                session_id=session.id
+            ) for d in range(DOCUMENTS_PER_SESSION)])
+        db.session.commit()
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+
+def document_plans(test_client, method, url, **kwargs):
+    """Issue a request and EXPLAIN every statement it ran against documents"""
+    captured = []
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if 'documents' in statement and not statement.startswith('EXPLAIN'):
+            captured.append((statement, parameters))
+    
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = test_client.open(url, method=method, **kwargs)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    assert response.status_code == 200, response.data
+    assert captured
+    
+    plans = []
+    with db.engine.connect() as connection:
+        for statement, parameters in captured:
+            rows = connection.exec_driver_sql('EXPLAIN ' + statement, parameters)
+            plans.append('\n'.join(row[0] for row in rows))
+        connection.rollback()
+    return plans
+
+@pytest.mark.parametrize('method, url', [
+    ('GET', '/api/sessions/plan_session_1/documents'),
+    ('GET', '/api/sessions/plan_session_1/documents?page=5'),
+    ('GET', '/api/sessions/plan_session_1/documents?fields=metadata'),
+    ('GET', '/api/sessions/plan_session_1/documents?cursor='),
+    ('GET', '/api/sessions/plan_session_2/documents/plan_doc_2_7'),
+    ('PUT', '/api/sessions/plan_session_3/documents/plan_doc_3_7'),
+    ('DELETE', '/api/sessions/plan_session_4/documents/plan_doc_4_7'),
+    ('DELETE', '/api/sessions/plan_session_5'),
+])
+def test_document_routes_never_seq_scan(test_app, test_client, method, url):
+    kwargs = {'json': {'encryptedTitle': '{"title": "updated"}'}} if method == 'PUT' else {}
+    with test_app.app_context():
+        for plan in document_plans(test_client, method, url, **kwargs):
+            assert 'Seq Scan on documents' not in plan, plan
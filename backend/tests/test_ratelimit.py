@@ -0,0 +1,159 @@
+import socket
+import threading
+import pytest
+from flask import Flask
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from limits.storage import storage_from_string
+from ratelimit import CounterServer, RespClient, RespError, RespStorage
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / 'limiter.sock')
+
+@pytest.fixture
+def server(socket_path):
+    server = CounterServer(socket_path).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def storage(server, socket_path):
+    return storage_from_string(f'resp+unix://{socket_path}')
+
+def test_storage_is_registered(storage):
+    assert isinstance(storage, RespStorage)
+    assert storage.check()
+
+def test_fixed_window_counter(storage):
+    assert storage.incr('LIMITER/a', 60) == 1
+    assert storage.incr('LIMITER/a', 60, amount=4) == 5
+    assert storage.get('LIMITER/a') == 5
+    assert storage.get('LIMITER/missing') == 0
+    assert storage.get_expiry('LIMITER/a') > 0
+
+    storage.clear('LIMITER/a')
+    assert storage.get('LIMITER/a') == 0
+
+    storage.incr('LIMITER/b', 60)
+    storage.incr('LIMITER/c', 60, elastic_expiry=True)
+    assert storage.reset() == 2
+    assert storage.get('LIMITER/b') == 0
+
+def test_counter_updates_are_atomic(server, socket_path):
+    # A timed-out command isn't resent, so allow for a loaded machine
+    storages = [RespStorage(f'resp+unix://{socket_path}', timeout=10) for _ in range(4)]
+
+    def hit(storage):
+        for _ in range(250):
+            storage.incr('LIMITER/shared', 60)
+
+    threads = [threading.Thread(target=hit, args=(storage,)) for storage in storages for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert storages[0].get('LIMITER/shared') == 2000
+
+def test_tcp_storage():
+    server = CounterServer(('localhost', 0)).start()
+    try:
+        host, port = server.address
+        storage = storage_from_string(f'resp://{host}:{port}')
+        assert storage.incr('LIMITER/tcp', 60) == 1
+        assert storage.incr('LIMITER/tcp', 60) == 2
+    finally:
+        server.stop()
+
+def test_client_reconnects_after_server_restart(socket_path):
+    server = CounterServer(socket_path).start()
+    client = RespClient(socket_path)
+    assert client.execute('PING') == 'PONG'
+    server.stop()
+
+    server = CounterServer(socket_path).start()
+    try:
+        assert client.execute('PING') == 'PONG'
+        with pytest.raises(RespError):
+            client.execute('LPUSH', 'key', 'value')
+    finally:
+        server.stop()
+
+def test_client_does_not_resend_after_a_timeout(socket_path):
+    # A server that reads commands but never replies
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen()
+    received = []
+
+    def read(connection):
+        while data := connection.recv(4096):
+            received.append(data)
+
+    def serve():
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=read, args=(connection,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    client = RespClient(socket_path, timeout=0.2)
+    try:
+        with pytest.raises(TimeoutError):
+            client.execute('INCRBY', 'LIMITER/key', 1)
+    finally:
+        client.close()
+        listener.close()
+    assert b''.join(received).count(b'INCRBY') == 1
+
+def test_expired_windows_are_evicted():
+    timer = FakeTimer()
+    server = CounterServer('unused', max_keys=3, timer=timer)
+    server.execute([b'SET', b'a', b'0', b'EX', b'10', b'NX'])
+    server.execute([b'SET', b'b', b'0', b'EX', b'20', b'NX'])
+    assert server.execute([b'INCRBY', b'a', b'1']) == 1
+
+    # A new window starts once the old one expires
+    timer.now += 10
+    assert server.execute([b'GET', b'a']) is None
+    assert server.execute([b'SET', b'a', b'0', b'EX', b'10', b'NX']) == 'OK'
+    assert server.execute([b'PTTL', b'a']) == 10000
+
+    timer.now += 15
+    assert server.sweep() == 2
+    assert len(server) == 0
+
+def test_full_server_evicts_soonest_expiring():
+    server = CounterServer('unused', max_keys=3, timer=FakeTimer())
+    for key, ttl in ((b'a', b'30'), (b'b', b'10'), (b'c', b'20'), (b'd', b'40')):
+        server.execute([b'SET', key, b'0', b'EX', ttl])
+    assert len(server) == 3
+    assert server.execute([b'GET', b'b']) is None
+    assert server.execute([b'GET', b'a']) == b'0'
+
+def test_limit_is_shared_across_workers(server, socket_path):
+    # Two apps stand in for two gunicorn workers
+    clients = []
+    for _ in range(2):
+        worker = Flask(__name__)
+        worker.config['RATELIMIT_STORAGE_URI'] = f'resp+unix://{socket_path}'
+        limiter = Limiter(app=worker, key_func=get_remote_address)
+
+        @worker.route('/limited')
+        @limiter.limit('5 per minute')
+        def limited():
+            return 'ok'
+
+        clients.append(worker.test_client())
+
+    statuses = [clients[i % 2].get('/limited').status_code for i in range(8)]
+    assert statuses == [200] * 5 + [429] * 3
@@ -0,0 +1,127 @@
+import json
+import time
+import pytest
+from sqlalchemy import create_engine, text
+from api import autosaves, db, replicas, Session, Document
+from replicas import replica_reads, sticky_primary_reads
+
+@pytest.fixture
+def replica(test_app):
+    """A second local database standing in for a replica of the primary."""
+    with test_app.app_context():
+        url = db.engine.url
+    with create_engine(url, isolation_level='AUTOCOMMIT').connect() as connection:
+        if not connection.execute(text("SELECT 1 FROM pg_database WHERE datname = 'securenotes_replica'")).scalar():
+            connection.execute(text('CREATE DATABASE securenotes_replica'))
+    
+    engine = create_engine(url.set(database='securenotes_replica'))
+    db.metadata.create_all(engine)
+    engines, sticky_seconds = replicas.engines, replicas.sticky_seconds
+    replicas.engines, replicas.sticky_seconds = [engine], 1
+    yield engine
+    
+    replicas.engines, replicas.sticky_seconds = engines, sticky_seconds
+    db.metadata.drop_all(engine)
+    engine.dispose()
+
+def add_session(engine, session_id, address):
+    with engine.begin() as connection:
+        connection.execute(Session.__table__.insert().values(
+            id=session_id, address=address, created_at=text('now()'), last_accessed=text('now()')))
+
+def replicate(test_app, replica, document_url):
+    """Copy one document from the primary, as replay would."""
+    with test_app.app_context():
+        row = db.session.execute(Document.__table__.select()
+                                 .where(Document.document_url == document_url)).mappings().one()
+    with replica.begin() as connection:
+        connection.execute(Document.__table__.insert().values(**row))
+
+def test_read_only_routes_use_the_replica(test_app, replica):
+    client = test_app.test_client()
+    add_session(replica, 1000, 'replica_only')
+    with test_app.app_context():
+        add_session(db.engine, 1001, 'primary_only')
+    reads = replica_reads.value
+    
+    assert client.get('/api/sessions/replica_only').status_code == 200
+    assert client.get('/api/sessions/replica_only/documents').status_code == 200
+    assert client.get('/api/sessions/primary_only').status_code == 404
+    assert replica_reads.value == reads + 3
+    
+    # Writes go to the primary
+    response = client.post('/api/sessions/replica_only/documents',
+                           json={'encryptedTitle': 'title', 'encryptedContent': 'content'})
+    assert response.status_code == 404
+
+def test_reads_stick_to_the_primary_after_a_write(test_app, replica):
+    client = test_app.test_client()
+    add_session(replica, 1000, 'address')
+    add_session(replica, 1001, 'other')
+    with test_app.app_context():
+        add_session(db.engine, 1000, 'address')
+        add_session(db.engine, 1001, 'other')
+    
+    response = client.post('/api/sessions/address/documents',
+                           json={'encryptedTitle': 'title', 'encryptedContent': 'content'})
+    url = f"/api/sessions/address/documents/{json.loads(response.data)['data']['id']}"
+    sticky = sticky_primary_reads.value
+    
+    # The replica hasn't replayed the save, but the writer reads it back
+    assert client.get(url).status_code == 200
+    assert json.loads(client.get('/api/sessions/address/documents').data)['data']['total'] == 1
+    assert sticky_primary_reads.value == sticky + 2
+    # Other addresses still read from the replica
+    assert client.get('/api/sessions/other/documents').status_code == 200
+    assert sticky_primary_reads.value == sticky + 2
+    
+    # Once the window has passed, reads go back to the replica
+    time.sleep(1.1)
+    assert json.loads(client.get(url).data)['error'] == 'Document not found'
+    replicate(test_app, replica, url.rsplit('/', 1)[1])
+    assert client.get(url).status_code == 200
+    
+    # Every successful write renews the window
+    assert client.put(url, json={'encryptedTitle': 'updated'}).status_code == 200
+    assert json.loads(client.get(url).data)['data']['encryptedTitle'] == 'updated'
+
+def test_created_sessions_are_sticky(test_app, replica):
+    client = test_app.test_client()
+    assert client.post('/api/sessions', json={'address': 'new_address'}).status_code == 200
+    assert client.get('/api/sessions/new_address').status_code == 200
+
+def test_unreadable_sticky_marks_fall_back_to_the_primary(test_app, replica):
+    class BrokenStorage:
+        def get(self, key):
+            raise ConnectionError('storage unavailable')
+    
+    storage, replicas.storage = replicas.storage, BrokenStorage()
+    try:
+        with test_app.app_context():
+            add_session(db.engine, 1001, 'primary_only')
+        assert test_app.test_client().get('/api/sessions/primary_only').status_code == 200
+    finally:
+        replicas.storage = storage
+
+def test_coalesced_saves_are_sticky_when_written(test_app, replica):
+    client = test_app.test_client()
+    add_session(replica, 1000, 'address')
+    with test_app.app_context():
+        add_session(db.engine, 1000, 'address')
+    response = client.post('/api/sessions/address/documents',
+                           json={'encryptedTitle': 'title', 'encryptedContent': 'content 0'})
+    document_url = json.loads(response.data)['data']['id']
+    replicate(test_app, replica, document_url)
+    url = f'/api/sessions/address/documents/{document_url}'
+    
+    autosaves.window = 10
+    try:
+        client.put(url, json={'encryptedTitle': 'title', 'encryptedContent': 'content 1'})
+        assert autosaves.pending('address', document_url) is not None
+        # The save outlives the window its PUT started; writing it starts another
+        time.sleep(1.1)
+        assert json.loads(client.get(url).data)['data']['encryptedContent'] == 'content 1'
+        assert autosaves.pending('address', document_url) is None
+    finally:
+        autosaves.stop()
+        autosaves.window = None
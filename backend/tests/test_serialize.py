@@ -0,0 +1,64 @@
+import json
+from datetime import datetime
+import pytest
+import serialize
+from serialize import document_data, document_frame, dumps, loads
+
+@pytest.fixture(params=['orjson', 'stdlib'])
+def encoder(request, monkeypatch):
+    if request.param == 'stdlib':
+        monkeypatch.setattr(serialize, 'orjson', None)
+    elif serialize.orjson is None:
+        pytest.skip('orjson is not installed')
+    return request.param
+
+def test_document_data():
+    created, modified = datetime(2024, 1, 2, 3, 4, 5, 678901), datetime(2024, 1, 2, 3, 4, 6)
+    assert list(document_data('url', 'title', created, modified, 'content')) == [
+        'id', 'encryptedTitle', 'encryptedContent', 'createdAt', 'lastModified']
+    assert document_data('url', 'title', created, modified, None, ['a', 'b'])['encryptedChunks'] == ['a', 'b']
+    assert 'encryptedContent' not in document_data('url', 'title', created, modified, content=False)
+    assert document_data('url', 'title', created, modified)['encryptedContent'] is None
+
+def test_dumps_matches_isoformat(encoder):
+    created = datetime(2024, 1, 2, 3, 4, 5, 678901)
+    modified = datetime(2024, 1, 2, 3, 4, 6)
+    data = document_data('url', 'tïtle', created, modified, '"quoted"\n' + 'x' * 100000)
+    
+    encoded = dumps({'data': data})
+    assert isinstance(encoded, bytes)
+    assert json.loads(encoded) == {'data': {
+        'id': 'url',
+        'encryptedTitle': 'tïtle',
+        'encryptedContent': '"quoted"\n' + 'x' * 100000,
+        'createdAt': created.isoformat(),
+        'lastModified': modified.isoformat()
+    }}
+    assert loads(encoded) == json.loads(encoded)
+    
+    with pytest.raises(TypeError):
+        dumps({'value': object()})
+
+def test_document_frame(encoder):
+    created, modified = datetime(2024, 1, 2, 3, 4, 5, 678901), datetime(2024, 1, 2, 3, 4, 6)
+    content = '{"iv":"00","content":"x"}'
+    head, tail = document_frame('url', 'tïtle', created, modified)
+    assert head + dumps(content) + tail == dumps(document_data('url', 'tïtle', created, modified, content))
+    head, tail = document_frame('url', 'tïtle', created, modified, wrap=True)
+    assert head + dumps(content) + tail == dumps({'data': document_data('url', 'tïtle', created, modified, content)})
+
+def test_routes_use_the_encoder(test_app, encoder):
+    client = test_app.test_client()
+    client.post('/api/sessions', json={'address': 'test_address'})
+    created = client.post('/api/sessions/test_address/documents',
+                          json={'encryptedTitle': 'title', 'encryptedContent': 'content'})
+    assert created.mimetype == 'application/json'
+    document = created.get_json()['data']
+    assert datetime.fromisoformat(document['createdAt'])
+    
+    fetched = client.get(f"/api/sessions/test_address/documents/{document['id']}").get_json()['data']
+    assert fetched == document
+    
+    response = client.post('/api/sessions/test_address/documents', data='{"encryptedTitle":',
+                           content_type='application/json')
+    assert response.status_code == 400
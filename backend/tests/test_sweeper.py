@@ -0,0 +1,105 @@
+import time
+from datetime import datetime, timedelta
+from api import db, session_cache, sweeper, Session, Document, DocumentChunk
+from sweeper import SessionSweeper, sessions_reclaimed, sweeper_runs, last_run_documents, last_run_sessions
+
+def seed(test_app, expired, fresh, documents=2):
+    """Create sessions last accessed 13 hours (expired) or 1 hour (fresh) ago."""
+    now = datetime.utcnow()
+    with test_app.app_context():
+        for i in range(expired + fresh):
+            session = Session(
+                address=f'{"expired" if i < expired else "fresh"}_{i}',
+                last_accessed=now - timedelta(hours=13 if i < expired else 1)
+            )
+            db.session.add(session)
+            db.session.flush()
+            for d in range(documents):
+                document = Document(
+                    document_url=f'doc_{i}_{d}',
+                    encrypted_title='title',
+                    encrypted_content='',
+                    chunk_count=1,
+                    session_id=session.id
+                )
+                document.chunks = [DocumentChunk(index=0, encrypted_chunk='chunk')]
+                db.session.add(document)
+        db.session.commit()
+
+def make_sweeper(test_app, **kwargs):
+    return SessionSweeper(test_app, db, Session, Document, max_age=12 * 60 * 60, **kwargs)
+
+def test_sweep_deletes_expired_sessions_in_batches(test_app):
+    seed(test_app, expired=5, fresh=3)
+    reclaimed = []
+    before = sessions_reclaimed.value
+    
+    result = make_sweeper(test_app, batch_size=2, on_reclaimed=reclaimed.extend).sweep()
+    assert (result.sessions, result.documents, result.batches) == (5, 10, 3)
+    assert sorted(address for _, address in reclaimed) == [f'expired_{i}' for i in range(5)]
+    assert sessions_reclaimed.value - before == 5
+    assert (last_run_sessions.value, last_run_documents.value) == (5, 10)
+    
+    with test_app.app_context():
+        assert sorted(session.address for session in Session.query) == ['fresh_5', 'fresh_6', 'fresh_7']
+        assert Document.query.count() == 6
+        assert DocumentChunk.query.count() == 6
+    
+    result = make_sweeper(test_app).sweep()
+    assert (result.sessions, result.batches) == (0, 0)
+
+def test_sweep_skips_locked_sessions(test_app):
+    seed(test_app, expired=3, fresh=0)
+    with test_app.app_context():
+        # A live request holding a row lock on one of the expired sessions
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        connection.execute(db.select(Session.id).where(Session.address == 'expired_1').with_for_update())
+        try:
+            began = time.perf_counter()
+            result = make_sweeper(test_app, batch_size=10).sweep()
+            assert time.perf_counter() - began < 5
+            assert result.sessions == 2
+        finally:
+            transaction.rollback()
+            connection.close()
+    
+        assert [session.address for session in Session.query] == ['expired_1']
+    
+    assert make_sweeper(test_app).sweep().sessions == 1
+
+def test_sweeper_forgets_cached_sessions(test_app):
+    seed(test_app, expired=1, fresh=0)
+    client = test_app.test_client()
+    assert client.get('/api/sessions/expired_0/documents').status_code == 200
+    assert session_cache.get('expired_0') is not None
+    
+    sweeper.sweep()
+    assert session_cache.get('expired_0') is None
+    assert client.get('/api/sessions/expired_0/documents').status_code == 404
+
+def test_scheduled_sweeps(test_app):
+    seed(test_app, expired=2, fresh=1)
+    scheduled = make_sweeper(test_app, interval=0.05)
+    runs = sweeper_runs.value
+    scheduled.start()
+    try:
+        deadline = time.monotonic() + 5
+        while sweeper_runs.value == runs and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        scheduled.stop()
+    with test_app.app_context():
+        assert [session.address for session in Session.query] == ['fresh_2']
+
+def test_sweep_sessions_command(test_app):
+    seed(test_app, expired=3, fresh=1)
+    runner = test_app.test_cli_runner()
+    
+    result = runner.invoke(args=['sweep-sessions', '--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith('Reclaimed 3 sessions and 6 documents in 2 batches')
+    
+    # A shorter max age also reaches the fresh session
+    result = runner.invoke(args=['sweep-sessions', '--max-age', '60'])
+    assert result.output.startswith('Reclaimed 1 sessions')
@@ -0,0 +1,111 @@
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime, Integer, column, or_, update, values
+
+logger = logging.getLogger(__name__)
+
+
+class TouchBuffer:
+    """Write-behind buffer for ``last_accessed`` style timestamps.
+
+    ``touch()`` records the access in memory and skips it entirely when the
+    row was touched less than ``granularity`` seconds ago. Pending touches are
+    written by a background thread every ``flush_interval`` seconds as a single
+    ``UPDATE ... FROM (VALUES ...)``, and once more when the process exits.
+    """
+
+    def __init__(self, app, db, model, granularity=60, flush_interval=10, batch_size=1000):
+        self.app = app
+        self.db = db
+        self.table = model.__table__
+        self.granularity = timedelta(seconds=granularity)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        atexit.register(self.stop)
+
+    def touch(self, key, last_accessed, now=None):
+        """Record an access to row ``key`` and return its effective timestamp.
+
+        ``last_accessed`` is the value currently stored in the database.
+        """
+        now = now or datetime.utcnow()
+        with self._lock:
+            latest = max(last_accessed or datetime.min, self._pending.get(key, datetime.min))
+            if now - latest < self.granularity:
+                return latest
+            self._pending[key] = now
+        self._start()
+        return now
+
+    def discard(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Write every pending touch; returns the number of rows sent."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        items = list(pending.items())
+        try:
+            with self.app.app_context(), self.db.engine.begin() as connection:
+                for i in range(0, len(items), self.batch_size):
+                    connection.execute(self._update(items[i:i + self.batch_size]))
+        except Exception:
+            # Keep the touches for the next attempt unless newer ones arrived
+            with self._lock:
+                for key, touched in pending.items():
+                    self._pending[key] = max(touched, self._pending.get(key, touched))
+            raise
+        return len(items)
+
+    def stop(self):
+        """Stop the background thread and write whatever is still pending."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _update(self, items):
+        touches = values(
+            column('id', Integer),
+            column('last_accessed', DateTime),
+            name='touches'
+        ).data(items)
+        table = self.table
+        return update(table)\
+            .where(table.c.id == touches.c.id)\
+            .where(or_(table.c.last_accessed.is_(None),
+                       table.c.last_accessed < touches.c.last_accessed))\
+            .values(last_accessed=touches.c.last_accessed)
+
+    def _start(self):
+        if self._thread is not None or self.flush_interval is None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='touch-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush session touches')
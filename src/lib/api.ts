@@ -56,7 +56,7 @@ export const api = {
   // Document endpoints
   getDocuments: async (address: string, page = 1) => {
     return fetchApi<{ documents: DocumentMetadata[], total: number, pages: number }>(
-      `/api/sessions/${address}/documents?page=${page}`
+      `/api/sessions/${address}/documents?page=${page}&fields=metadata`
     )
   },
 